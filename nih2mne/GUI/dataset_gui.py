@@ -35,6 +35,8 @@ import glob
 import pandas as pd
 from nih2mne.utilities.calc_hm import get_localizer_dframe, compute_movement
 from nih2mne.utilities.data_crop_wrapper import get_term_time
+from nih2mne.utilities.ctf_reader import Meg4Reader
+from pyctf.ctf_res4 import TYPE_MEG
 import shutil
 import copy
 import numpy as np
@@ -236,18 +238,20 @@ class InputDatasetTile(QtWidgets.QWidget):
             self.head_movement = 'No hz2.ds'
     
     def _check_trailing_zeros(self):
-        tmp_ = self.raw.copy().pick('meg')
-        max_time_ = tmp_.times[-1]
+        #Read just the last 10 seconds of the MEG channels from the meg4
+        ds = Meg4Reader(self.fname)
+        n_total = ds.n_trials * ds.n_samples
+        max_time_ = (n_total - 1) / ds.sfreq
         if max_time_ < 10:
             return None
-        tmp_.crop(max_time_ - 10, None) #Pull just the last 10 seconds
-        tmp_.load_data()
-        test_vals = np.ones(tmp_._data.shape) * tmp_._data
-        if (test_vals).sum() == 0.0:
+        meg_idx = [i for i, ch_type in enumerate(ds.ch_types) if ch_type == TYPE_MEG]
+        start = n_total - 1 - int(np.round(10 * ds.sfreq))
+        test_vals = ds.get_continuous(meg_idx, start=start)
+        if not np.any(test_vals):
             self.early_termination = True
         else:
             self.early_termination = False
-        del tmp_
+        del ds
         
         
     def set_status_label(self):
@@ -363,6 +367,21 @@ class InputDatasetTile(QtWidgets.QWidget):
             print(f'No associated trigger processing file for task: {self.taskname.lower()}')
         if (current_trigfile == None) or (current_trigfile == ""):
             return
+        if current_trigfile.endswith(('.yml', '.yaml')):
+            #Rule spec - apply in process
+            from nih2mne.utilities.trigger_rules import apply_rules
+            from nih2mne.utilities.markerfile_write import main as write_markerfile
+            try:
+                dframe = apply_rules(op.join(self.trigfile_dir, current_trigfile), self.fname)
+                write_markerfile(dframe=dframe, ds_filename=self.fname)
+                self._trigproc_error = False
+            except Exception as e:
+                print(f'Trigproc error: {type(e).__name__}: {str(e)}')
+                self._trigproc_error = True
+            self.load_meg() #Reload to get the newly created annotations
+            self.set_events_label()
+            self.set_status_label() 
+            return
         if current_trigfile.endswith('.py'):
             _python_path = sys.executable
             cmd = f'{_python_path} {self.trigfile_dir}/{current_trigfile} {self.fname}'
@@ -22,7 +22,7 @@ Layout:
 
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QGridLayout, \
-    QHBoxLayout, QVBoxLayout, QPushButton, QLabel,  QComboBox, QLineEdit, QMessageBox, QCheckBox
+    QHBoxLayout, QVBoxLayout, QPushButton, QLabel,  QComboBox, QLineEdit, QMessageBox, QCheckBox, QProgressDialog
 
 import sys
 import shlex
@@ -864,9 +864,8 @@ class Subject_GUI(QWidget):
         megidx_ = self.b_chooser_meg.currentIndex()
         megtmp_ = self.bids_info.meg_list[megidx_]
         if hasattr(self, 'qa_file'):
-            megtmp_.load()
             qa_dict = read_yml(self.qa_file)
-            qa_dframe = qa_dataset(megtmp_.raw, task_type=megtmp_.task, qa_dict=qa_dict)
+            qa_dframe = qa_dataset(megtmp_.annotations, task_type=megtmp_.task, qa_dict=qa_dict)
             return qa_dframe
         else:
             try:
@@ -1200,7 +1199,16 @@ class BIDS_Project_Window(QMainWindow):
     def select_bids_root(self):
         self.bids_root = QtWidgets.QFileDialog.getExistingDirectory(self, 'Select Folder')
         os.chdir(self.bids_root)
-        self.bids_project = bids_project(bids_root=self.bids_root)
+        progress = QProgressDialog('Loading subjects', None, 0, 0, self)
+        progress.setMinimumDuration(500)
+        def _update_progress(n_done, n_total, subject):
+            progress.setMaximum(n_total)
+            progress.setValue(n_done)
+            progress.setLabelText(f'Loaded {subject}')
+            QApplication.processEvents()
+        self.bids_project = bids_project(bids_root=self.bids_root, 
+                                         progress_callback=_update_progress)
+        progress.close()
         self.page_idx = 0
         self.subject_start_idx = 0
         self.update_subjects_layout()
@@ -1266,10 +1274,15 @@ def cmdline_main():
                         default=6, type=int)
     parser.add_argument('-num_cols', help='Number of subject columns',
                         default=4, type=int)
+    parser.add_argument('-n_workers', help='Number of subjects to load in parallel',
+                        default=8, type=int)
     args = parser.parse_args()
     bids_root = args.bids_root
     
-    bids_pro = bids_project(bids_root=bids_root)
+    def _print_progress(n_done, n_total, subject):
+        print(f'Loaded subject {n_done}/{n_total}: {subject}')
+    bids_pro = bids_project(bids_root=bids_root, n_workers=args.n_workers,
+                            progress_callback=_print_progress)
     window(bids_project=bids_pro, num_rows=args.num_rows, num_cols=args.num_cols)
 
 if __name__ == '__main__':
@@ -38,7 +38,7 @@ import mne
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QGridLayout, \
     QHBoxLayout, QVBoxLayout, QPushButton, QLabel,  QComboBox, QLineEdit, QCheckBox, \
-    QFileDialog, QDialog, QListWidgetItem
+    QFileDialog, QDialog, QListWidgetItem, QMessageBox
     
 from PyQt5 import QtGui
 import sys
@@ -46,8 +46,9 @@ import os, os.path as op
 import numpy as np
 from nih2mne.utilities.trigger_utilities import (parse_marks, detect_digital, 
                                                  check_analog_inverted, threshold_detect, 
-                                                 append_conditions, correct_to_projector, 
-                                                 add_event_offset)
+                                                 append_conditions, correct_to_projector_asof, 
+                                                 add_event_offset, read_trigger_channels)
+from nih2mne.utilities.trigger_rules import save_rule_spec, validate_rule_spec
 from collections import OrderedDict
 from PyQt5.QtCore import Qt, pyqtSignal
 from nih2mne import config
@@ -61,10 +62,12 @@ from nih2mne.GUI.templates.trigger_single_line import Ui_Form as trig_singleline
 
 class trig_tile(QWidget, trig_singleline_UiForm): 
     def __init__(self, chan_name=None, include_polarity=True, 
-                 event_count=None, meg_fname=None):
+                 event_count=None, meg_fname=None, trig_data=None):
         super().__init__()
         self.setupUi(self) 
         self.meg_fname = meg_fname
+        #Preloaded trigger channels (read_trigger_channels) - else read the file
+        self.trig_data = trig_data if trig_data is not None else meg_fname
         self.trig_type = chan_name[1:4]
         self.ch_name = chan_name 
         self.lbl_ChannelName.setText(f'{chan_name} :')
@@ -77,7 +80,7 @@ class trig_tile(QWidget, trig_singleline_UiForm):
 
         # Event counter display
         if self.trig_type == 'ADC':
-            self.event_dframe = threshold_detect(self.meg_fname,  channel=self.ch_name)
+            self.event_dframe = threshold_detect(self.trig_data,  channel=self.ch_name)
             self.event_count = len(self.event_dframe)
         elif self.trig_type == 'PPT':
             self.event_count = event_count
@@ -446,13 +449,13 @@ class event_coding_window(QMainWindow):
                     if i.startswith('UADC016'):
                         btn_invert_val = invert_val
                         if tile.cb_HistUp.checkState() == 2:
-                            invert_val = check_analog_inverted(fname=self.meg_fname, ch_name='UADC016')
+                            invert_val = check_analog_inverted(fname=self.trig_data, ch_name='UADC016')
                             if btn_invert_val:
                                 invert_val = not invert_val
                     
                     # Make non-projector case
                     
-                    tmp_dframe = threshold_detect(dsname=self.meg_fname, 
+                    tmp_dframe = threshold_detect(dsname=self.trig_data, 
                                                  channel=i, 
                                                  mark=markname, 
                                                  invert=invert_val)
@@ -464,7 +467,7 @@ class event_coding_window(QMainWindow):
             
             
             # Add digital triggers
-            dig_dframe = detect_digital(filename=self.meg_fname, channel='UPPT001')
+            dig_dframe = detect_digital(filename=self.trig_data, channel='UPPT001')
             for i, tile in self.tile_dict.items():
                 if i.startswith('UPPT'):
                     markname = tile.te_EvtName.text()
@@ -481,9 +484,9 @@ class event_coding_window(QMainWindow):
             # Correct to projector
             if hasattr(self, 'corr2proj_list'):
                 if len(self.corr2proj_list) > 0:
-                    dframe = correct_to_projector(dframe, 
-                                                  event_list=self.corr2proj_list, 
-                                                  window=[-0.2,0.2])
+                    dframe = correct_to_projector_asof(dframe, 
+                                                       event_list=self.corr2proj_list, 
+                                                       max_latency=0.2)
             
             # Add fixed time offset
             if self.ui.te_FixedOffset.text().strip() not in ['0', '']:
@@ -561,6 +564,8 @@ class event_coding_window(QMainWindow):
                                                system_clock='ignore', preload=False, 
                                                verbose=False)
         self.trig_ch_names = [i for i in self.meg_raw.ch_names if i.startswith('UADC') or i.startswith('UPPT')]
+        #Read the trigger channels once - shared by all of the detectors
+        self.trig_data = read_trigger_channels(self.meg_fname)
         if 'UADC016' not in self.trig_ch_names:
             self.ui.pb_CorrectToProjector.setDisabled(True)
         self.fill_trig_chan_layout()
@@ -576,7 +581,8 @@ class event_coding_window(QMainWindow):
             ### Analogue Channels ###
             if i.startswith('UADC'):
                 self.tile_dict[i]=trig_tile(chan_name=i,include_polarity=True,
-                                            meg_fname=self.meg_fname)
+                                            meg_fname=self.meg_fname, 
+                                            trig_data=self.trig_data)
                 if i=='UADC016':
                     self.tile_dict[i].te_EvtName.setText('projector')
                     #Enable the histogram based polarity assessment option
@@ -590,7 +596,7 @@ class event_coding_window(QMainWindow):
 
             ### Digital Channels - Breakout the Codes ###
             elif i.startswith('UPPT'):
-                dig_dframe = detect_digital(self.meg_fname, channel=i)
+                dig_dframe = detect_digital(self.trig_data, channel=i)
                 event_vals = list(dig_dframe.condition.unique())
                 event_vals = sorted(event_vals, key=int)
                 dig_event_counts = dig_dframe.condition.value_counts()
@@ -599,7 +605,8 @@ class event_coding_window(QMainWindow):
                     self.tile_dict[evt_key]= trig_tile(chan_name=f'{i} [{evt_name}]', 
                                                  include_polarity=True,
                                                  event_count=dig_event_counts[evt_name], 
-                                                 meg_fname = self.meg_fname)
+                                                 meg_fname = self.meg_fname, 
+                                                 trig_data = self.trig_data)
                     
                     #Add items to list in complicated QT fashion
                     item = QtWidgets.QListWidgetItem(self.ui.list_DigitalChannels)
@@ -631,6 +638,50 @@ class event_coding_window(QMainWindow):
             default_name = 'task_v1.py'
         return op.join(default_loc, default_name)
     
+    def get_rule_spec(self):
+        '''Serializable rule spec of the current selections - see 
+        nih2mne.utilities.trigger_rules'''
+        spec = {'version':1, 'analog':[], 'digital':[]}
+        dig_codes = {}
+        for i, tile in self.tile_dict.items():
+            markname = tile.te_EvtName.text()
+            if markname == '':
+                continue
+            if i.startswith('UADC'):
+                entry = {'channel':i, 'name':markname, 
+                         'invert':tile.cb_Down.checkState()==2, 'auto_invert':False}
+                if i.startswith('UADC016') and (tile.cb_HistUp.checkState()==2):
+                    entry['auto_invert'] = True
+                spec['analog'].append(entry)
+            elif i.startswith('UPPT'):
+                dig_codes[i.split('_')[-1]] = markname
+        spec['digital'].append({'channel':'UPPT001', 'codes':dig_codes})
+        
+        if len(getattr(self, 'corr2proj_list', [])) > 0:
+            spec['projector_correction'] = {'events':list(self.corr2proj_list), 
+                                            'max_latency':0.2}
+        offset_txt = self.ui.te_FixedOffset.text().strip()
+        if (offset_txt not in ['0', '']) and (len(getattr(self, 'add_offset_list', [])) > 0):
+            spec['offset'] = {'events':list(self.add_offset_list), 
+                              'seconds':float(offset_txt) / 1000}
+        
+        spec['parse_marks'] = []
+        parsemarks_dict = {i:j for i,j in self.extract_evt_dict().items() if j['type']=='parse' }
+        for entry in parsemarks_dict.values():
+            parse_tile = entry['tile']
+            markname = parse_tile.te_MrkName.text()
+            if markname not in self.final_events_list:
+                continue
+            spec['parse_marks'].append(
+                {'name':markname, 
+                 'lead':parse_tile.combo_LeadSelection.currentText(),
+                 'lag':parse_tile.combo_LagSelection.currentText(),
+                 'window':[float(parse_tile.te_StartOffset.text().strip()),
+                           float(parse_tile.te_StopOffset.text().strip())],
+                 'marker_on':'lead' if parse_tile.cb_OnLead.isChecked() else 'lag'})
+        spec['keep'] = list(self.final_events_list)
+        return spec
+    
     def write_parser_script(self):
         '''    
         Part 1: Write Threshold Detect Options
@@ -645,6 +696,14 @@ class event_coding_window(QMainWindow):
         self.events_to_write = self.final_events_list
         print(self.events_to_write)
         
+        ##### Check the selections before writing anything #####
+        try:
+            rule_spec = validate_rule_spec(self.get_rule_spec())
+        except ValueError as e:
+            QMessageBox.warning(self, 'Invalid trigger selections', 
+                                f'The processing script was not written:\n{str(e)}')
+            return
+        
         ##### Python Header Section #####
         header=["#!/usr/bin/env python3\n",
                 "# -*- coding: utf-8 -*-\n",
@@ -658,7 +717,8 @@ class event_coding_window(QMainWindow):
                 "import mne\n",
                 "import nih2mne\n",
                 '''from nih2mne.utilities.trigger_utilities import (parse_marks, detect_digital,
-                    check_analog_inverted, threshold_detect, append_conditions, correct_to_projector, add_event_offset)\n''',
+                    check_analog_inverted, threshold_detect, append_conditions, correct_to_projector_asof, add_event_offset)\n''',
+                '''from nih2mne.utilities.trigger_cache import TriggerCache\n''',
                 '''from nih2mne.utilities.markerfile_write import main as write_markerfile\n'''
                 "\n\n",
                 "meg_fname = sys.argv[1]\n\n"
@@ -666,12 +726,15 @@ class event_coding_window(QMainWindow):
         default_fname = self.get_default_scriptname()
         fname, _ = QFileDialog.getSaveFileName(self, "Save File", default_fname, 
                                                "Text Files (*.py);;All Files (*)")#, options=options)
+        if fname == '':
+            return
         with open(fname, 'w') as f:
             f.writelines(header)
         
         ##### Make a list of dataframes ####
         init_code = []
         init_code.append('dframe_list=[]')
+        init_code.append('trig = TriggerCache(meg_fname)  #Cached raw trigger detections')
                          
         
         ##### Analog Triggers #####
@@ -693,14 +756,14 @@ class event_coding_window(QMainWindow):
                 
                 if i.startswith('UADC016'):
                     if tile.cb_HistUp.checkState()==2:
-                        tmp_code = f"invert_val = check_analog_inverted(fname=meg_fname, ch_name='UADC016')"
+                        tmp_code = f"invert_val = trig.check_analog_inverted(ch_name='UADC016')"
                         ana_trig_code.append(tmp_code)
                         if invert_val == True:
                             tmp_code = "invert_val = not invert_val"
                             ana_trig_code.append(tmp_code)
                 
                 # NOTE: invert val below needs to be evaluated in code and not set in {}
-                tmp_code = f"tmp_dframe = threshold_detect(dsname=meg_fname, channel='{i}', mark='{markname}', invert=invert_val)" 
+                tmp_code = f"tmp_dframe = trig.threshold_detect(channel='{i}', mark='{markname}', invert=invert_val)" 
                 ana_trig_code.append(tmp_code)
                 tmp_code = f"dframe_list.append(tmp_dframe)"
                 ana_trig_code.append(tmp_code)
@@ -708,7 +771,7 @@ class event_coding_window(QMainWindow):
         ##### Digital Triggers #####       
         dig_trig_code = []
         dig_trig_code.append('##### Digital Trigger Coding ######')
-        tmp_code = f"dig_dframe = detect_digital(filename=meg_fname, channel='UPPT001')" #, mark='{markname}')"
+        tmp_code = f"dig_dframe = trig.detect_digital(channel='UPPT001')" #, mark='{markname}')"
         dig_trig_code.append(tmp_code)
         for i, tile in self.tile_dict.items():
             if i.startswith('UPPT'):
@@ -721,6 +784,7 @@ class event_coding_window(QMainWindow):
                 dig_trig_code.append(tmp_code)        
         tmp_code = f"dframe_list.append(dig_dframe)"
         dig_trig_code.append(tmp_code)
+        dig_trig_code.append('trig.save()')
         
         ##### Tidy up data   #######
         time_corr_code = []
@@ -730,7 +794,7 @@ class event_coding_window(QMainWindow):
         ##### Correct to Projector ###### 
         if hasattr(self, 'corr2proj_list'):
             if len(self.corr2proj_list) > 0:
-                tmp_code = f'dframe = correct_to_projector(dframe, event_list={self.corr2proj_list}, window=[-0.2,0.2])'
+                tmp_code = f'dframe = correct_to_projector_asof(dframe, event_list={self.corr2proj_list}, max_latency=0.2)'
                 time_corr_code.append(tmp_code)        
         
         ##### Add offset to events ######
@@ -794,6 +858,11 @@ final_dframe = append_conditions(final_dframe_list)
             for i in init_trig_code:
                 f.write(i+'\n')
                 f.write('\n')
+        
+        ##### Rule spec for the in-process trigger engine #####
+        spec_fname = op.splitext(fname)[0]+'.yml'
+        save_rule_spec(rule_spec, spec_fname)
+        print(f'Wrote rule spec: {spec_fname}')
 
     
 class grid_selector(QMainWindow):
@@ -27,7 +27,11 @@ import pandas as pd
 import pyctf
 import mne_bids
 from nih2mne.megcore_prep_mri_bids import mripreproc
+from nih2mne.utilities.events import read_annotations, event_counts
+from nih2mne.utilities.bids_index import BidsIndex, fs_recon_status
+from nih2mne.dataQA.qa_state import write_state, read_state, get_state_fname
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 CFG_VERSION = 1.0
@@ -105,6 +109,10 @@ def run_sbatch(cmd=None, mem=None, threads=None, time="02:00:00",
 #%%
 class qa_megraw_object:
     '''Current minimal template - add more later'''
+    # Saved in the QA state (raw and psd are not saved)
+    _state_fields = ['rel_path', 'fname', 'task', 'is_emptyroom', 'BADS',
+                     'status', 'is_valid', 'chan_power']
+    
     def __init__(self, fname, run_qa=False):
         self.rel_path = fname
         self.fname = op.basename(fname)
@@ -126,6 +134,19 @@ class qa_megraw_object:
         # Compute PSD
         self._compute_psd()
     
+    def to_state(self):
+        return {key:getattr(self, key) for key in self._state_fields 
+                if hasattr(self, key)}
+    
+    @classmethod
+    def from_state(cls, state):
+        '''Restore from to_state without re-reading the dataset'''
+        obj = cls.__new__(cls)
+        obj.__dict__.update(state)
+        if 'chan_power' in state:
+            obj.chan_power = np.array(state['chan_power'])
+        return obj
+    
     def _get_task(self):
         tmp = self.fname.split('_')
         task_stub = [i for i in tmp if i[0:4]=='task'][0]
@@ -224,11 +245,14 @@ class qa_megraw_object:
     def coil_locs_head(self):
         return pyctf.getHC.getHC(op.join(self.fname, op.basename(self.fname).replace('.ds','.hc')), 'head')
 
+    @property
+    def annotations(self):
+        '''Annotations from the MarkerFile/events.tsv - raw is not loaded'''
+        return read_annotations(self.rel_path)
+
     @property    
     def event_counts(self):
-        if not hasattr(self, 'raw'):
-            self.load()
-        return pd.DataFrame(self.raw.annotations).description.value_counts()
+        return event_counts(self.rel_path)
 
     def __repr__(self):
         tmp_ = f'megraw: {self.task} : {self.fname}'
@@ -244,10 +268,17 @@ class qa_megraw_object:
         return tmp_
             
 #%%
+def _get_index(bids_root, subject, index=None, subjects_dir=None):
+    '''Use the project index or refresh the index for a single subject'''
+    if index is None:
+        index = BidsIndex(bids_root, subjects_dir=subjects_dir)
+        index.refresh(subjects=[subject])
+    return index
+
 class meglist_class:
-    def __init__(self, subject=None, bids_root=None):
-        dsets = glob.glob(f'{op.join(bids_root, subject, "**", "*.ds")}',
-                          recursive=True)
+    def __init__(self, subject=None, bids_root=None, index=None):
+        index = _get_index(bids_root, subject, index)
+        dsets = index.files(subject=subject, extension='.ds')
         tmp = [qa_megraw_object(i) for i in dsets if not self._is_hzfile(i) ]
         self.meg_list = tmp
         self.meg_emptyroom = [i for i in self.meg_list if i.is_emptyroom]
@@ -315,13 +346,10 @@ class meglist_class:
         return len(self.meg_list)
     
 class qa_mri_class:    
-    def __init__(self, subject=None, bids_root=None):
-        mr_list = glob.glob(f'{op.join(bids_root, subject,"**", "anat/*")}', recursive=True)
-        all_mri_list = []
-        for i in mr_list:
-            if (i[-4:]=='.nii') or (i[-7:]=='.nii.gz'):
-                all_mri_list.append(i)
-        self.all_mris = all_mri_list
+    def __init__(self, subject=None, bids_root=None, index=None):
+        index = _get_index(bids_root, subject, index)
+        self.all_mris = index.files(subject=subject, datatype='anat', 
+                                    extension=['.nii', '.nii.gz'])
         if len(self.all_mris)==0:
             self.mri = None
             self.mri_json_qa = 'No MRIs'
@@ -376,16 +404,14 @@ class qa_mri_class:
         else:
             self.mri_json_qa = 'BAD'
 
-    def check_fs_recon(self):
+    def check_fs_recon(self, index=None):
         '''
         Returns status of freesurfer reconstruction
     
         Parameters
         ----------
-        subjid : str
-            Subject ID
-        subjects_dir : str
-            Freesurfer subjects dir
+        index : BidsIndex, optional
+            Use the indexed status if the index covers this subjects_dir
     
         Returns
         -------
@@ -393,32 +419,24 @@ class qa_mri_class:
             
     
         '''
-        logfile = op.join(self.subjects_dir, self.subject, 'scripts', 'recon-all.log')
-        if not op.exists(logfile):
-            finished = False
-            started = False
-            fs_success_line=[]
-        else:
-            started = True
-            with open(logfile) as f:
-                fs_success_line = f.readlines()[-1]
-        if 'finished without error' in fs_success_line:
-            finished = True
-        else:
-            finished = False
-        has_lhpial = os.path.exists(op.join(self.subjects_dir, self.subject, 'surf', 'lh.pial'))
-        has_rhpial = os.path.exists(op.join(self.subjects_dir, self.subject, 'surf', 'rh.pial'))
-        out_dict = dict(fs_success = finished,
-                        fs_started = started,
-                    lhpial = has_lhpial, 
-                    rhpial = has_rhpial)
-        return out_dict
+        if (index is not None) and \
+            (op.abspath(index.subjects_dir) == op.abspath(self.subjects_dir)):
+            out_dict = index.fs_recon(self.subject)
+            if out_dict is not None:
+                return out_dict
+        return fs_recon_status(self.subjects_dir, self.subject)
         
 
 class _subject_bids_info(qa_mri_class, meglist_class):
     '''Subject Status Mixin of MRI and MEG classes'''
+    # Saved in the QA state - meg_list is saved as a list of dataset states
+    _state_fields = ['subject', 'bids_id', 'mri', 'mri_json', 'mri_json_qa', 
+                     'fs_recon', 'all_mris', 'qa_file', 'bids_root', 
+                     'deriv_project', 'deriv_root', 'qa_output_dir', 
+                     'subjects_dir']
+    
     def __init__(self, subject, bids_root=None, subjects_dir=None, 
-                 deriv_project=None):
+                 deriv_project=None, index=None):
         if subject[0:4]=='sub-':
             self.subject = subject
             self.bids_id = subject[4:]
@@ -437,7 +455,7 @@ class _subject_bids_info(qa_mri_class, meglist_class):
         
         # Save variables
         self.qa_output_dir = op.join(self.bids_root, 'derivatives', 'megQA')
-        self.qa_default_fname = op.join(self.qa_output_dir, self.subject + '.pkl')
+        self.qa_default_fname = get_state_fname(self.bids_root, self.subject)
         
         if not op.exists(op.join(bids_root, self.subject)):
             raise ValueError(f'Subject {self.subject} does not exist in {bids_root}')
@@ -447,17 +465,22 @@ class _subject_bids_info(qa_mri_class, meglist_class):
         else:
             self.subjects_dir = subjects_dir
         
+        # Project index - not saved with the subject
+        index = _get_index(self.bids_root, self.subject, index, 
+                           subjects_dir=self.subjects_dir)
+        
         # MEG Component
-        meglist_class.__init__(self, self.subject, self.bids_root)
+        meglist_class.__init__(self, self.subject, self.bids_root, index=index)
         
         # MRI Component
-        qa_mri_class.__init__(self, subject=self.subject, bids_root=self.bids_root)
+        qa_mri_class.__init__(self, subject=self.subject, bids_root=self.bids_root,
+                              index=index)
         
         # Freesurfer Component
-        self.fs_recon = self.check_fs_recon()
+        self.fs_recon = self.check_fs_recon(index=index)
         
-    def _reload_info(self):
-        self.fs_recon = self.check_fs_recon()
+    def _reload_info(self, index=None):
+        self.fs_recon = self.check_fs_recon(index=index)
         
     def proc_freesurfer(self): 
         cmd = f"export SUBJECTS_DIR={self.subjects_dir}; recon-all -all -i {self.mri} -s {self.subject}" 
@@ -594,7 +617,7 @@ class _subject_bids_info(qa_mri_class, meglist_class):
         return self.info
     
     def save(self, fname=None, overwrite=False):
-        if not op.exists(self.qa_output_dir): os.makedirs(self.qa_output_dir)
+        os.makedirs(self.qa_output_dir, exist_ok=True)
         if fname == None:
             fname = self.qa_default_fname
         
@@ -612,17 +635,35 @@ class _subject_bids_info(qa_mri_class, meglist_class):
                 return
             
         if (fname_exists==False) or (overwrite==True):
-            with open(fname, 'wb') as f:
-                dill.dump(self, f)
+            write_state(self.to_state(), fname)
             if overwrite==True:
                 print(f'Overwrote: {fname}')
     
+    def to_state(self):
+        '''JSON serializable state for the QA store (qa_state)'''
+        state = {key:getattr(self, key) for key in self._state_fields 
+                 if hasattr(self, key)}
+        state['meg_list'] = [i.to_state() for i in self.meg_list]
+        return state
+    
+    @classmethod
+    def from_state(cls, state):
+        '''Restore a saved subject without searching the BIDS tree'''
+        obj = cls.__new__(cls)
+        state = dict(state)
+        meg_list = state.pop('meg_list', [])
+        obj.__dict__.update(state)
+        obj.meg_list = [qa_megraw_object.from_state(i) for i in meg_list]
+        obj.meg_emptyroom = [i for i in obj.meg_list if i.is_emptyroom]
+        obj.qa_default_fname = get_state_fname(obj.bids_root, obj.subject)
+        return obj
+    
         
         
 
 
 def subject_bids_info( subject=None, bids_root=None, subjects_dir=None, 
-                              deriv_project=None, force_update=False):
+                              deriv_project=None, force_update=False, index=None):
     '''
     Main entrypoint for subject bids infor (Factory method) to initialize 
     subject_bids_info class. This is necessary to be able to preload 
@@ -640,6 +681,8 @@ def subject_bids_info( subject=None, bids_root=None, subjects_dir=None,
         Project output in derivatives folder. The default is None.
     force_update : TYPE, optional
         DESCRIPTION. The default is False.
+    index : BidsIndex, optional
+        Refreshed project index. The default is None (index this subject).
 
     Returns
     -------
@@ -649,20 +692,45 @@ def subject_bids_info( subject=None, bids_root=None, subjects_dir=None,
     '''
     if subject[0:4]!='sub-':
         subject = 'sub-'+subject
-    qa_default_fname = op.join(bids_root, 'derivatives', 'megQA', subject+'.pkl')
+    qa_default_fname = get_state_fname(bids_root, subject)
+    legacy_fname = op.join(bids_root, 'derivatives', 'megQA', subject+'.pkl')
     if op.exists(qa_default_fname) and (force_update==False):
-        with open(qa_default_fname, 'rb') as f:
-            bids_info = dill.load(f)
-            
-        bids_info._reload_info()
+        bids_info = _subject_bids_info.from_state(read_state(qa_default_fname))
+        bids_info._reload_info(index=index)
+        return bids_info
+    elif op.exists(legacy_fname) and (force_update==False):
+        bids_info = migrate_pickle(legacy_fname)
+        bids_info._reload_info(index=index)
         return bids_info
     else:
         tmp_ = _subject_bids_info(subject=subject, bids_root=bids_root, 
                           subjects_dir=subjects_dir,
-                          deriv_project=deriv_project)
+                          deriv_project=deriv_project, index=index)
         tmp_.save(overwrite=True)
         return tmp_
 
+def migrate_pickle(pkl_fname):
+    '''
+    Convert a dill pickled subject (CFG_VERSION 1.0) to the QA state store.
+    The pickle is left in place and the .jsonl is used from then on.
+
+    Parameters
+    ----------
+    pkl_fname : str
+        derivatives/megQA/sub-X.pkl
+
+    Returns
+    -------
+    _subject_bids_info
+
+    '''
+    with open(pkl_fname, 'rb') as f:
+        legacy = dill.load(f)
+    bids_info = _subject_bids_info.from_state(_subject_bids_info.to_state(legacy))
+    write_state(bids_info.to_state(), bids_info.qa_default_fname)
+    print(f'Migrated {pkl_fname} to {bids_info.qa_default_fname}')
+    return bids_info
+
 class _bids_subject_list():
     def __init__(self, subject_list, bids_root):
         for subject in subject_list:
@@ -685,26 +753,68 @@ class _bids_subject_list():
 # TODO: 
     # Make dot accessible subject with object attributes - Munch does not allow that
 class bids_project():
-    def __init__(self, bids_root=None, project_root=None, force_update=False):
-        _subjects = glob.glob('sub-*', root_dir=bids_root)
+    def __init__(self, bids_root=None, project_root=None, force_update=False,
+                 n_workers=8, progress_callback=None):
+        '''
+        Load the subject QA info for all subjects in the BIDS folder
+
+        Parameters
+        ----------
+        bids_root : str
+            Top level of the bids directory
+        project_root : str, optional
+            The default is derivatives/nihmeg.
+        force_update : bool, optional
+            Regenerate the saved subject info. The default is False.
+        n_workers : int, optional
+            Subjects loaded concurrently (threads - the loading is mostly 
+            file I/O). The default is 8.
+        progress_callback : callable, optional
+            Called as progress_callback(n_done, n_total, subject) from the 
+            calling thread after each subject is loaded
+
+        '''
+        self.index = BidsIndex(bids_root)
+        self.index.refresh()
+        _subjects = self.index.subjects()
         self.subjects = OrderedDict()  
         self.error_subjects= []
         self.bids_root = bids_root
         if project_root == None:
             self.project_root = op.join(self.bids_root, 'derivatives', 'nihmeg')
-        for subject in _subjects:
-            try:
-                tmp_ = subject_bids_info( subject=subject, bids_root=bids_root, 
-                                         force_update=force_update)
+        
+        #Results are merged in subject order regardless of completion order
+        results = [None] * len(_subjects)
+        n_workers = max(1, min(int(n_workers), len(_subjects)))
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(self._load_subject, subject, force_update):idx
+                       for idx, subject in enumerate(_subjects)}
+            for n_done, future in enumerate(as_completed(futures), start=1):
+                idx = futures[future]
+                results[idx] = future.result()
+                if progress_callback is not None:
+                    progress_callback(n_done, len(_subjects), _subjects[idx])
+        for subject, (tmp_, error) in zip(_subjects, results):
+            if error is None:
                 self.subjects[subject] = tmp_
-                if not op.exists(tmp_.qa_default_fname): tmp_.save()
-            except BaseException as e:
-                print(f'Error reading {subject}: \n {str(e)}')
+            else:
+                print(f'Error reading {subject}: \n {error}')
                 self.error_subjects.append(subject)
         
         self._fs_status()
         self.compile_issues()
     
+    def _load_subject(self, subject, force_update=False):
+        '''Load/create the subject info - errors are returned'''
+        try:
+            tmp_ = subject_bids_info( subject=subject, bids_root=self.bids_root, 
+                                     force_update=force_update, 
+                                     index=self.index)
+            if not op.exists(tmp_.qa_default_fname): tmp_.save()
+            return tmp_, None
+        except Exception as e:
+            return None, str(e)
+    
     def __repr__(self):
         txt = f'BIDS root: {self.bids_root}\n'
         txt += f'Project root: {self.project_root}\n'
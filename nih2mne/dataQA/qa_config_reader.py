@@ -17,7 +17,9 @@ def read_yml(fname):
     return dat
 
 def qa_dataset(raw, task_type=None, qa_dict=None):
-    dframe = pd.DataFrame(raw.annotations)
+    '''raw : mne.io.Raw | mne.Annotations (nih2mne.utilities.events.read_annotations)'''
+    annot = raw.annotations if hasattr(raw, 'annotations') else raw
+    dframe = pd.DataFrame(annot)
     try:
         raw_evts_counts = pd.DataFrame(dframe.description.value_counts().items(), columns=['Condition', 'Raw'])
     except:
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON-lines store for the subject QA state (derivatives/megQA/sub-X.jsonl).
+
+The first line is a header with the schema version.  Each following line
+holds a single field:
+
+    {"schema_version": 1, "kind": "nih2mne_subject_qa", "saved": "..."}
+    {"field": "subject", "value": "sub-ON01"}
+    {"field": "mri_json_qa", "value": "GOOD"}
+    {"field": "meg_list", "value": [{"fname": ..., "task": ...}, ...]}
+
+Fields can be read without decoding the others:
+
+    read_state(fname, fields=['mri', 'fs_recon'])
+    read_project_state(bids_root, fields=['mri_json_qa', 'fs_recon'])
+
+Older schema versions are upgraded on read with the functions registered by
+register_migration.  The object conversion is in bids_project_interface
+(to_state / from_state).
+
+@author: jstout
+"""
+import os, os.path as op
+import glob
+import json
+import datetime
+import tempfile
+import numpy as np
+import pandas as pd
+
+SCHEMA_VERSION = 1
+state_kind = 'nih2mne_subject_qa'
+state_ext = '.jsonl'
+_migrations = {}
+
+def register_migration(from_version):
+    '''
+    Decorator to register the upgrade of a state dict from_version ->
+    from_version + 1.  The function is called with the full state dict and
+    returns the upgraded dict.
+    '''
+    def _register(func):
+        _migrations[from_version] = func
+        return func
+    return _register
+
+def migrate_state(state, version):
+    '''Apply the registered migrations from version to SCHEMA_VERSION'''
+    if version > SCHEMA_VERSION:
+        raise ValueError(f'QA state version {version} is newer than the supported version {SCHEMA_VERSION}')
+    while version < SCHEMA_VERSION:
+        if version not in _migrations:
+            raise ValueError(f'No migration registered for QA state version {version}')
+        state = _migrations[version](state)
+        version += 1
+    return state
+
+def get_state_fname(bids_root, subject):
+    '''derivatives/megQA/sub-X.jsonl'''
+    if subject[0:4] != 'sub-':
+        subject = 'sub-'+subject
+    return op.join(bids_root, 'derivatives', 'megQA', subject+state_ext)
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.bool_):
+        return bool(obj)
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+def write_state(state, fname):
+    '''
+    Write the state dict to a JSON-lines file.  The file is written to a temp
+    file and moved into place.
+
+    Parameters
+    ----------
+    state : dict
+        {field : json serializable value}
+    fname : str
+        Output file
+
+    Returns
+    -------
+    fname : str
+
+    '''
+    header = dict(schema_version=SCHEMA_VERSION, kind=state_kind,
+                  saved=datetime.datetime.now().isoformat(timespec='seconds'))
+    lines = [json.dumps(header)]
+    lines += [json.dumps({'field':key, 'value':val}, default=_json_default)
+              for key, val in state.items()]
+    os.makedirs(op.dirname(op.abspath(fname)), exist_ok=True)
+    fd, tmp_fname = tempfile.mkstemp(dir=op.dirname(op.abspath(fname)), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_fname, fname)
+    return fname
+
+def read_state(fname, fields=None):
+    '''
+    Read the state from a JSON-lines file
+
+    Parameters
+    ----------
+    fname : str
+        State file
+    fields : list, optional
+        Only decode these fields. The default is None (all fields).  Fields
+        are not available in partial reads of an older schema version.
+
+    Returns
+    -------
+    dict
+
+    '''
+    prefixes = None if fields is None else \
+        tuple(json.dumps({'field':i})[:-1]+',' for i in fields)
+    state = {}
+    with open(fname) as f:
+        header = json.loads(f.readline())
+        if header.get('kind') != state_kind:
+            raise ValueError(f'{fname} is not a QA state file')
+        version = header['schema_version']
+        if (fields is not None) and (version != SCHEMA_VERSION):
+            #Migrations operate on the full state
+            return {key:val for key, val in read_state(fname).items() if key in fields}
+        for line in f:
+            if (prefixes is not None) and not line.startswith(prefixes):
+                continue
+            entry = json.loads(line)
+            state[entry['field']] = entry['value']
+            if (prefixes is not None) and (len(state) == len(prefixes)):
+                break
+    return migrate_state(state, version)
+
+def read_project_state(bids_root, fields=['mri', 'mri_json_qa', 'fs_recon']):
+    '''
+    Selected fields of all saved subjects in the project.  Only the requested
+    fields are decoded.
+
+    Parameters
+    ----------
+    bids_root : str
+        Top level of the bids directory
+    fields : list, optional
+        The default is ['mri', 'mri_json_qa', 'fs_recon'].
+
+    Returns
+    -------
+    pd.DataFrame
+        Indexed by subject
+
+    '''
+    fnames = sorted(glob.glob(op.join(bids_root, 'derivatives', 'megQA', 'sub-*'+state_ext)))
+    rows = {op.basename(i)[:-len(state_ext)]:read_state(i, fields=fields) for i in fnames}
+    return pd.DataFrame.from_dict(rows, orient='index', columns=fields)
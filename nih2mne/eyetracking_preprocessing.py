@@ -59,9 +59,15 @@ def load_raw_data(raw_fname=None, eye_channel=['UADC009','UADC010','UADC013']):
     raw = mne.io.read_raw_ctf(raw_fname,preload=False, system_clock='ignore',
                               clean_names=True)   
     raw_eyes= raw.copy().pick_channels(eye_channel)
-    raw_eyes.load_data()
-
-    return raw_eyes
+    # Read only the eye channels from the meg4 (strided reads) instead of 
+    # mne's full trial blocks
+    from nih2mne.utilities.ctf_reader import Meg4Reader
+    ds = Meg4Reader(raw_fname)
+    data = ds.get_continuous(raw_eyes.ch_names)
+    out = mne.io.RawArray(data, raw_eyes.info, first_samp=raw_eyes.first_samp,
+                          verbose=False)
+    out.set_annotations(raw_eyes.annotations)
+    return out
     
 
 
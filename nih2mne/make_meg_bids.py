@@ -23,7 +23,9 @@ import json
 import shutil
 import matplotlib
 import matplotlib.pyplot as plt; 
-from multiprocessing import Pool
+from multiprocessing import get_context, get_all_start_methods
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 
 from mne_bids import write_anat, BIDSPath, write_raw_bids
 from nih2mne.calc_mnetrans import write_mne_fiducials 
@@ -34,6 +36,9 @@ from nih2mne.utilities.clear_mrk_path import (calc_extra_mark_filelist,
                                               clean_filepath_header)
 from nih2mne.utilities.mri_defacing import mri_deface
 from nih2mne.utilities.qa_fids import plot_fids_qa
+from nih2mne.utilities.bids_manifest import (make_manifest_entry, is_converted,
+                                             update_manifest, _file_hash)
+from nih2mne.utilities.fast_copy import linked_meg4_copy
 
 import nibabel as nib
 
@@ -45,6 +50,9 @@ root_logger = logging.getLogger()
 logger = logging.getLogger()
 err_logger = logging.getLogger()
 
+#Shared lock for write_raw_bids - set in the workers when running a pool
+_bids_write_lock = None
+
 # =============================================================================
 # make_meg_bids.py
 # 
@@ -136,7 +144,7 @@ def sessdir2taskrundict(session_dir=None, subject_in=None):
     return out_dict
 
 
-def get_eroom(meg_fname, tmpdir=None):
+def get_eroom(meg_fname, tmpdir=None, use_cache=True, prefetch_failover=False):
     '''
     Find the closest emptyroom.  
     Download it to a local temp folder.  
@@ -148,6 +156,13 @@ def get_eroom(meg_fname, tmpdir=None):
         Path to MEG file.
     tmpdir : str, optional
         Tempdir to download the emptyroom file.  Default is None.
+    use_cache : bool, optional
+        Extract to the shared emptyroom cache (see 
+        emptyroom_utilities.pull_eroom_cached) instead of the tmpdir.  
+        Default is True.
+    prefetch_failover : bool, optional
+        Extract the next closest emptyroom in parallel, in case the closest
+        archive is not valid.  Default is False.
 
     Returns
     -------
@@ -155,20 +170,14 @@ def get_eroom(meg_fname, tmpdir=None):
         Path to emptyroom file.
 
     '''
-    from nih2mne.utilities.emptyroom_utilities import get_closest_eroom, pull_eroom
-    er_fname = get_closest_eroom(meg_fname)
+    from nih2mne.utilities.emptyroom_utilities import fetch_eroom
     print('Pulling and untar/unzip emptyroom')
-    pull_eroom(er_fname, tmpdir=tmpdir)
-    er_fname = op.join(tmpdir, op.basename(er_fname)).replace('.tgz','.ds')
-    #Sometimes the compiled emptyroom file is not a functional file - add failover
-    if op.exists(er_fname):
-        logger.info(f'Using {er_fname} for emptyroom')
-        return er_fname
-    else:
-        er_fname = get_closest_eroom(meg_fname, failover=True)
-        pull_eroom(er_fname, tmpdir=tmpdir)
-        er_fname = op.join(tmpdir, op.basename(er_fname)).replace('.tgz','.ds')
-        return er_fname 
+    #Sometimes the compiled emptyroom file is not a functional file - the 
+    #next closest emptyroom is used as a failover
+    er_fname = fetch_eroom(meg_fname, tmpdir=None if use_cache else tmpdir,
+                           prefetch_failover=prefetch_failover)
+    logger.info(f'Using {er_fname} for emptyroom')
+    return er_fname 
 
 def _check_markerfile(ds_fname):
     '''
@@ -229,9 +238,10 @@ def _clear_ClassFile(meg_fname):
         f.writelines(lines)
 
         
-def anonymize_meg(meg_fname, tmpdir=None):
+def anonymize_meg(meg_fname, tmpdir=None, method='newDs'):
     '''
-    Run the standard anonymization from the CTF tools
+    Run the standard anonymization from the CTF tools or the python 
+    anonymization (does not require the CTF tools)
     
 
     Parameters
@@ -241,6 +251,8 @@ def anonymize_meg(meg_fname, tmpdir=None):
     tmpdir : str
         Path to the temporary directory.  Should be automatically generated
         by input function
+    method : str
+        newDs | native.  The default is newDs
 
     Returns
     -------
@@ -249,6 +261,9 @@ def anonymize_meg(meg_fname, tmpdir=None):
     '''
     if tmpdir == None:
         raise ValueError
+    if method == 'native':
+        from nih2mne.utilities.ctf_anonymize import anonymize_ds
+        return anonymize_ds(meg_fname, tmpdir, include_list=include_list_general)
     out_fname = op.join(tmpdir, op.basename(meg_fname))
     cmd = f'newDs -anon {meg_fname} {out_fname}'
     try:
@@ -258,6 +273,18 @@ def anonymize_meg(meg_fname, tmpdir=None):
         err_logger.error(f'Error with CTF tools anonymization: {str(e)}')
     return out_fname
 
+def _get_anonymize_method(method='auto'):
+    '''Use the CTF tools if available for method=auto, otherwise use the
+    python anonymization'''
+    if method in ['auto', None]:
+        return 'newDs' if shutil.which('newDs') is not None else 'native'
+    if method not in ['newDs', 'native']:
+        raise ValueError(f'anonymize_method must be auto, newDs or native: {method}')
+    if (method == 'newDs') and (shutil.which('newDs') is None):
+        raise ValueError('''CTF tools are not detected on this system.  Use 
+                         anonymize_method=native or load the CTF tools''')
+    return method
+
 def anonymize_finalize(meg_fname):
     '''This is assumed to be the tempdir directory of the meg
     Clean up extra text files that may have IDs in the history or path etc'''
@@ -292,6 +319,8 @@ def process_meg_bids(dset_dict=None, subject_in=None, bids_id=None,
                      bids_dir=None, session=1, 
                      anonymize=False, tmpdir=None, ignore_eroom=None, 
                      crop_trailing_zeros=False, eventID_csv=None, 
+                     n_workers=1, log_dir=None, incremental=False, 
+                     link_meg4=False, anonymize_method='newDs', 
                      ):
     '''
     Process the MEG component of the data into bids.
@@ -324,34 +353,153 @@ def process_meg_bids(dset_dict=None, subject_in=None, bids_id=None,
     eventID_csv: csv file
         Provide the eventID to event value mapping file.
         This can be generated using standardize_eventID_list.py
+    n_workers: int
+        Number of runs to convert in parallel.  The default of 1 processes
+        the runs serially in the current process.
+    log_dir: str, optional
+        Directory for the per-run logs when n_workers > 1.  If not set, the
+        workers (new processes) only log to the root logger.
+    incremental: BOOL
+        Skip runs that are listed in the conversion manifest with the same
+        input files and options.
+    link_meg4: BOOL
+        Reflink/hardlink the meg4 data into the bids tree instead of copying.
+        !Hardlinked files share the data with the source dataset
+    anonymize_method: str
+        newDs (CTF tools) or native (python - does not require the CTF tools).
+        native performs the crop and anonymization in a single pass
+
+    Returns
+    -------
+    errors : dict
+        Input datasets that failed to convert with the error message.  A 
+        failed run does not stop the other runs.
 
     '''
-    # error_count=0
+    session = str(int(session)) # Remove preceeding zeros
+    run_list = []
     for task, task_sublist in dset_dict.items():
         for run, meg_fname in enumerate(task_sublist, start=1):
-            session = str(int(session)) # Remove preceeding zeros
             run = str(run).zfill(2)
             
             _bids_path = BIDSPath(subject=bids_id, root=bids_dir, 
                                   session=session, run=run, task=task,
                                   suffix = 'meg', extension='.ds')
-            
-            _proc_meg_bids(meg_fname = meg_fname, 
-                           bids_path = _bids_path,
-                           anonymize = anonymize, 
-                           tmpdir = tmpdir, 
-                           ignore_eroom = ignore_eroom, 
-                           crop_trailing_zeros = crop_trailing_zeros, 
-                           eventID_csv = eventID_csv, 
-                               )
+            run_list.append(dict(meg_fname = meg_fname, 
+                                 bids_path = _bids_path,
+                                 anonymize = anonymize, 
+                                 tmpdir = tmpdir, 
+                                 ignore_eroom = ignore_eroom, 
+                                 crop_trailing_zeros = crop_trailing_zeros, 
+                                 eventID_csv = eventID_csv, 
+                                 incremental = incremental, 
+                                 link_meg4 = link_meg4, 
+                                 anonymize_method = anonymize_method, 
+                                 ))
+    
+    errors = {}
+    if (n_workers in [None, 1]) or (len(run_list) < 2):
+        results = []
+        for run_kwargs in run_list:
+            try:
+                _proc_meg_bids(**run_kwargs)
+                error = None
+            except Exception as e:
+                error = f'{type(e).__name__}: {str(e)}'
+            results.append((run_kwargs['meg_fname'], run_kwargs['bids_path'], error))
+    else:
+        n_workers = min(int(n_workers), len(run_list))
+        logger.info(f'Processing {len(run_list)} MEG runs with {n_workers} workers')
+        for run_kwargs in run_list:
+            run_kwargs['subjid'] = subject_in
+            run_kwargs['log_dir'] = log_dir
+        # make_bids runs the MRI branch in a thread.  Forking while that thread
+        # holds a lock (logging, nibabel) can deadlock the worker, so the 
+        # workers are started from a clean forkserver/spawn process
+        ctx = get_context('forkserver' if 'forkserver' in get_all_start_methods() 
+                          else 'spawn')
+        with ctx.Pool(processes=n_workers, initializer=_init_meg_worker, 
+                      initargs=(ctx.Lock(),)) as pool:
+            results = pool.map(_proc_meg_bids_worker, run_list, chunksize=1)
+    for meg_fname, bids_path, error in results:
+        if error is not None:
+            logger.error(f'Failed MNE BIDS: {meg_fname} : {error}')
+            err_logger.error(f'Failed MNE BIDS: {meg_fname} : {error}')
+            errors[meg_fname] = error
+    return errors
+
+def _init_meg_worker(lock):
+    '''Pool initializer - share the bids write lock with the worker'''
+    global _bids_write_lock
+    _bids_write_lock = lock
+
+def _proc_meg_bids_worker(run_kwargs):
+    '''
+    Pool worker for a single MEG run.  Each run gets its own temp directory
+    and log file so that the outputs do not collide or interleave.
+    Errors are caught and returned so that a single failed run does not stop
+    the other runs.
+
+    Parameters
+    ----------
+    run_kwargs : dict
+        _proc_meg_bids keywords + subjid and log_dir
+
+    Returns
+    -------
+    meg_fname : str
+    bids_path : BIDSPath
+    error : str | None
+        None if the run completed
+
+    '''
+    global logger
+    global err_logger
+    run_kwargs = run_kwargs.copy()
+    subjid = run_kwargs.pop('subjid')
+    log_dir = run_kwargs.pop('log_dir')
+    bids_path = run_kwargs['bids_path']
+    run_id = f'{subjid}_task-{bids_path.task}_run-{bids_path.run}'
+    if log_dir is not None:
+        logger = get_subj_logger(run_id, log_dir=log_dir, loglevel=logging.INFO)
+        err_logger = get_subj_logger(run_id+'_err', log_dir=log_dir, 
+                                     loglevel=logging.WARN)
+    if run_kwargs['tmpdir'] is not None:
+        run_tmpdir = op.join(run_kwargs['tmpdir'], 
+                             f'task-{bids_path.task}_run-{bids_path.run}')
+        os.makedirs(run_tmpdir, exist_ok=True)
+        run_kwargs['tmpdir'] = run_tmpdir
+    try:
+        _proc_meg_bids(**run_kwargs)
+        error = None
+    except Exception as e:
+        logger.error(f'Error processing {run_kwargs["meg_fname"]}')
+        err_logger.error(f'Error processing {run_kwargs["meg_fname"]}: {str(e)}')
+        error = f'{type(e).__name__}: {str(e)}'
+    return run_kwargs['meg_fname'], bids_path, error
 
 #%%%    
 def _proc_meg_bids(meg_fname=None, bids_path=None,
                     anonymize=False, tmpdir=None, ignore_eroom=None, 
                     crop_trailing_zeros=False, eventID_csv=None, 
+                    incremental=False, link_meg4=False, anonymize_method='newDs', 
                    ):
     error_count=0
     base_meg_fname = op.basename(meg_fname) #gen basename for legacy reasons
+    
+    #Skip check on the current inputs.  The recorded entry is recomputed after
+    #the processing, since _check_markerfile can add a MarkerFile to the input
+    src_meg_fname = meg_fname
+    manifest_options = dict(anonymize=anonymize, 
+                            anonymize_method=anonymize_method if anonymize else None, 
+                            crop_trailing_zeros=crop_trailing_zeros, 
+                            eventID_csv=_eventID_csv_fingerprint(eventID_csv))
+    manifest_entry = make_manifest_entry(src_meg_fname, bids_path, 
+                                         options=manifest_options)
+    if incremental and is_converted(bids_path.root, src_meg_fname, manifest_entry):
+        logger.info(f'Skipping unchanged run: {src_meg_fname} already converted to {bids_path}')
+        return
+    
     try:
         _clear_ClassFile(meg_fname) #Remove Trials that fail CTFtools
     except:
@@ -360,16 +508,34 @@ def _proc_meg_bids(meg_fname=None, bids_path=None,
                      file to write permissions and retry: 
                          {str(op.join(meg_fname, 'ClassFile.cls'))}''')
     
-    if crop_trailing_zeros==True:
-        # This is necessary for trial based acq that is terminated early
-        from nih2mne.utilities.data_crop_wrapper import return_cropped_ds
-        meg_fname = return_cropped_ds(meg_fname)
-    
-    if anonymize==True:
-        _check_markerfile(meg_fname)
-        #Anonymize file and ref new dset off of the output fname
-        meg_fname = anonymize_meg(meg_fname, tmpdir=tmpdir) 
-        anonymize_finalize(meg_fname) #Scrub or remove extra text files
+    link_staged = False
+    if (anonymize_method == 'native') and (anonymize or crop_trailing_zeros) \
+            and (tmpdir is not None):
+        # Crop and anonymize in a single pass.  Unchanged meg4 files are only
+        # linked to the source data with link_meg4, otherwise the staged meg4
+        # files are private copies and are linked into the bids tree
+        from nih2mne.utilities.ctf_anonymize import crop_anonymize_ds
+        meg_fname = crop_anonymize_ds(meg_fname, tmpdir, anonymize=anonymize, 
+                                      crop_trailing_zeros=crop_trailing_zeros,
+                                      include_list=include_list_general,
+                                      link_unchanged=link_meg4)
+        if anonymize==True:
+            anonymize_finalize(meg_fname) #Scrub or remove extra text files
+        link_staged = True
+    else:
+        if crop_trailing_zeros==True:
+            # This is necessary for trial based acq that is terminated early
+            from nih2mne.utilities.data_crop_wrapper import return_cropped_ds
+            meg_fname = return_cropped_ds(meg_fname)
+        
+        if anonymize==True:
+            _check_markerfile(meg_fname)
+            #Anonymize file and ref new dset off of the output fname
+            meg_fname = anonymize_meg(meg_fname, tmpdir=tmpdir, 
+                                      method=anonymize_method) 
+            anonymize_finalize(meg_fname) #Scrub or remove extra text files
+    manifest_entry = make_manifest_entry(src_meg_fname, bids_path, 
+                                         options=manifest_options)
     
     raw = mne.io.read_raw_ctf(meg_fname, system_clock='ignore', 
                               clean_names=True)  
@@ -384,10 +550,21 @@ def _proc_meg_bids(meg_fname=None, bids_path=None,
         evts_vals=None
         evts_ids=None
     
-    write_raw_bids(raw, bids_path, overwrite=True, 
-                   events=evts_vals, event_id=evts_ids)
+    #The sidecar tsv files are shared across runs - serialize the writes
+    with (_bids_write_lock if _bids_write_lock is not None else nullcontext()), \
+         (linked_meg4_copy() if (link_meg4 or link_staged) else nullcontext()):
+        write_raw_bids(raw, bids_path, overwrite=True, 
+                       events=evts_vals, event_id=evts_ids)
+        update_manifest(bids_path.root, src_meg_fname, manifest_entry)
     logger.info(f'Successful MNE BIDS: {meg_fname} to {bids_path}')
 
+def _eventID_csv_fingerprint(eventID_csv):
+    '''Path and hash of the eventID csv for the conversion manifest'''
+    if eventID_csv in [None, False]:
+        return None
+    return dict(fname=op.abspath(eventID_csv), 
+                sha1=_file_hash(eventID_csv))
+
     
     
 #%%%    
@@ -463,10 +640,14 @@ def make_trans_mat(mri=None, subjid=None, tmp_subjects_dir=None,
         print(f'error in trans calculation {subjid}')
     return str(trans_fname)
     
-def convert_brik(mri_fname, outdir=None):
+def convert_brik(mri_fname, outdir=None, preserve_dtype=True):
     '''Convert the afni file to nifti
     The outdir should be the tempdir/mri_temp folder
-    Returns the converted afni file for input to bids'''
+    Returns the converted afni file for input to bids
+    
+    By default the on-disk datatype and scaling are preserved and the data is
+    streamed into a .nii.gz (see _stream_brik_to_nifti).  Set 
+    preserve_dtype=False for the previous float64 .nii output.'''
     if op.splitext(mri_fname)[-1] not in ['.BRIK', '.HEAD', '.gz']:
         raise(TypeError('Must be an afni BRIK or HEAD file to convert'))
     if op.splitext(mri_fname)[-1]=='.gz':
@@ -486,11 +667,77 @@ def convert_brik(mri_fname, outdir=None):
     outname = basename.split('+')[0]+'.nii'
     outname = op.join(outdir, outname)   
     
+    if preserve_dtype:
+        return _stream_brik_to_nifti(in_brk, outname+'.gz')
+    
     # Load BRIk / Convert To NIfti / Save
     mr_dset = nib.load(in_brk)
     mr_nii = nib.Nifti1Image(mr_dset.get_fdata(), mr_dset.affine)
     mr_nii.to_filename(outname)
     return outname
+
+def _stream_brik_to_nifti(in_brk, outname, slab_size=16):
+    '''
+    Write the afni volume to nifti without loading the full dataset.  
+    
+    The stored (unscaled) data is read from the BRIK slab by slab along the 
+    3rd axis and written directly to the output.  The afni brick scale factor
+    is written to the nifti scl_slope.  If the sub-bricks have different 
+    scale factors (not representable in nifti), the scaled data is written as 
+    float32.
+
+    Parameters
+    ----------
+    in_brk : str
+        Afni .BRIK or .BRIK.gz
+    outname : str
+        Output .nii or .nii.gz
+    slab_size : int, optional
+        Number of slices read at a time. The default is 16.
+
+    Returns
+    -------
+    outname : str
+
+    '''
+    mr_dset = nib.load(in_brk)
+    afni_hdr = mr_dset.header
+    shape = afni_hdr.get_data_shape()
+    raw_dtype = afni_hdr.get_data_dtype()
+    scaling = mr_dset.dataobj.scaling
+    
+    if scaling is None:
+        slope, out_dtype = None, raw_dtype.newbyteorder('=')
+        proxy = nib.arrayproxy.ArrayProxy(in_brk, (shape, raw_dtype, 
+                                                    afni_hdr.get_data_offset()))
+    elif np.allclose(scaling, scaling.flat[0]):
+        slope, out_dtype = float(scaling.flat[0]), raw_dtype.newbyteorder('=')
+        proxy = nib.arrayproxy.ArrayProxy(in_brk, (shape, raw_dtype, 
+                                                    afni_hdr.get_data_offset()))
+    else:
+        slope, out_dtype = None, np.dtype(np.float32)
+        proxy = mr_dset.dataobj
+    
+    hdr = nib.Nifti1Header()
+    hdr.set_data_shape(shape)
+    hdr.set_data_dtype(out_dtype)
+    hdr.set_qform(mr_dset.affine, code='unknown')
+    hdr.set_sform(mr_dset.affine, code='aligned')
+    hdr.set_xyzt_units('mm')
+    if slope is not None:
+        hdr.set_slope_inter(slope, 0.0)
+    
+    # Nifti data is fortran ordered: slabs along the 3rd axis for each volume
+    with nib.openers.Opener(outname, 'wb') as f:
+        hdr.write_to(f)
+        nib.volumeutils.seek_tell(f, hdr.get_data_offset(), write0=True)
+        for vol_idx in np.ndindex(*shape[3:]):
+            for start in range(0, shape[2], slab_size):
+                slicer = (slice(None), slice(None), 
+                          slice(start, start+slab_size)) + vol_idx
+                slab = np.asarray(proxy[slicer], dtype=out_dtype)
+                f.write(slab.tobytes(order='F'))
+    return outname
     
     
 #Currently only supports 1 session of MRI
@@ -877,6 +1124,87 @@ def _get_conversion_dict(input_path=None, subject_in=None, bids_id=None,
     return conversion_dict
 
             
+def _make_mri_bids(args, subjid, bids_id, temp_dir):
+    '''
+    MRI branch of make_bids: nifti conversion, fiducials, defacing (if 
+    anonymizing), and the bids anat + json outputs.  This shares no state with
+    the MEG branch and is run concurrently.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        make_bids arguments
+    subjid : str
+        Input subject ID - used for the temp directory
+    bids_id : str
+        BIDS subject ID
+    temp_dir : Path
+        Top level temp directory
+
+    Returns
+    -------
+    nii_mri : str
+        Nifti MRI used for the bids conversion
+
+    '''
+    #Create temp dir for MRI
+    global temp_subjects_dir
+    temp_subjects_dir = temp_dir / 'subjects_tmp' 
+    temp_subjects_dir.mkdir(parents=True, exist_ok=True)
+    temp_mri_prep = temp_dir / 'mri_tmp' / subjid
+    if op.exists(temp_mri_prep): shutil.rmtree(temp_mri_prep)
+    temp_mri_prep.mkdir(parents=True)
+    
+    #    
+    #Check for Afni and convert the mri to nifti
+    #
+    if args.mri_brik:
+        host = os.uname().nodename
+        
+        #Convert the mri to nifti
+        nii_mri = convert_brik(args.mri_brik, outdir=temp_mri_prep)
+        logger.info(f'Converted {args.mri_brik} to {nii_mri}')
+        
+        #Extract FIDS from Afni Head and convert to RAS
+        coords_lps = coords_from_oblique_afni(args.mri_brik)
+        coords_ras = {}
+        for key in coords_lps.keys():
+            tmp = np.array(coords_lps[key])
+            tmp[0:2]*=-1
+            coords_ras[key]=tmp
+          
+    #
+    # Proc Brainsight Data
+    #
+    if args.mri_bsight:
+        if (args.mri_bsight.endswith('.nii')) or (args.mri_bsight.endswith('.nii.gz')):
+            nii_mri = args.mri_bsight
+        else:
+            raise ValueError(f'mri_bsight entry does not end with (nii or nii.gz): {args.mri_bsight}')
+    
+    
+    #
+    #   Anonymize/Deface MRI if set
+    #
+    if args.anonymize==True:
+        nii_mri = mri_deface(nii_mri, topdir=temp_mri_prep)
+  
+    #
+    # Finish MRI prep
+    #
+    t1_bids_path = process_mri_bids(bids_dir=args.bids_dir,
+                                 bids_id=bids_id, 
+                                 nii_mri = nii_mri,
+                                 session=args.bids_session)
+    if args.mri_bsight_elec != None:
+        process_mri_json(elec_fname=args.mri_bsight_elec,
+                             mri_fname = str(t1_bids_path))
+    elif args.mri_brik != None:
+        process_mri_json(elec_fname=args.mri_bsight_elec,
+                             mri_fname = str(t1_bids_path), 
+                             ras_coords=coords_ras)
+    return nii_mri
+
 # =============================================================================
 # Commandline Options
 # =============================================================================
@@ -889,13 +1217,12 @@ def make_bids(args):
     #Initialize
     if not op.exists(args.bids_dir): os.mkdir(args.bids_dir)
     
-    if args.anonymize==True:
-        try:
-            assert shutil.which('newDs') is not None  #Check for CTF tools
-        except ProcessLookupError as e:
-            print('''CTF tools are not detected on this system.  These are required
-                  to anonymize the data''')
+    if (args.anonymize==True) or (args.autocrop_zeros==True):
+        #Use the CTF tools if present, otherwise anonymize/crop in python
+        anonymize_method = _get_anonymize_method(getattr(args, 'anonymize_method', 'auto'))
     else:
+        anonymize_method = None
+    if args.anonymize!=True:
         if (args.subjid_input != None) and (args.bids_id == None):
             args.bids_id = args.subjid_input
         notanon_fname = op.join(args.bids_dir, 'NOT_ANONYMIZED!!!.txt')
@@ -952,17 +1279,19 @@ def make_bids(args):
     #
     #   Process MEG
     #
-    if args.anonymize:
-        #Create temp dir for MEG anonymization
+    if args.anonymize or (anonymize_method == 'native'):
+        #Create temp dir for MEG anonymization/cropping
         temp_meg_dir = temp_dir / 'meg_tmp' 
         temp_meg_dir.mkdir(parents=True, exist_ok=True)
         temp_meg_prep = temp_dir / 'meg_tmp' / subjid
         if op.exists(temp_meg_prep): shutil.rmtree(temp_meg_prep)
         temp_meg_prep.mkdir(parents=True)
         kwargs={'tmpdir':temp_meg_prep}
-        bids_id = args.bids_id
     else:
         kwargs={}
+    if args.anonymize:
+        bids_id = args.bids_id
+    else:
         if hasattr(args, 'bids_id'):
             bids_id = args.bids_id
         else:
@@ -975,88 +1304,61 @@ def make_bids(args):
             sorted_renamed_megdict = _gen_taskrundict(meg_list=args.meg_dataset_list)
     if hasattr(args, 'meg_input_dir'):
         if not (args.meg_input_dir in ['None',None, False,'']):
-            sorted_renamed_megdict = sessdir2taskrundict(session_dir=args.bids_session, 
+            sorted_renamed_megdict = sessdir2taskrundict(session_dir=args.meg_input_dir, 
                                            subject_in=args.subjid_input)
+            sorted_renamed_megdict = {task:[op.join(args.meg_input_dir, i) for i in dsets] 
+                                      for task, dsets in sorted_renamed_megdict.items()}
             # sorted_renamed_megdict = _gen_taskrundict(meg_list=meg_list)
     
     
-    process_meg_bids(dset_dict=sorted_renamed_megdict,
-                                subject_in=subjid,
-                                 bids_dir=args.bids_dir,
-                                 bids_id = args.bids_id, 
-                                 session=args.bids_session, 
-                                 anonymize=args.anonymize,
-                                 ignore_eroom=args.ignore_eroom,
-                                 crop_trailing_zeros=args.autocrop_zeros,
-                                 eventID_csv=args.eventID_csv,
-                                 **kwargs)
-    
     #
-    #   Prep MRI
+    #   Prep MRI - run alongside the MEG processing
+    #   MRI processing is mostly I/O and external programs (mri_deface), so a
+    #   thread is used.  This also works inside the daemonic batch workers
     #
-    if args.ignore_mri_checks != True:
-        #Create temp dir for MRI
-        global temp_subjects_dir
-        temp_subjects_dir = temp_dir / 'subjects_tmp' 
-        temp_subjects_dir.mkdir(parents=True, exist_ok=True)
-        temp_mri_prep = temp_dir / 'mri_tmp' / subjid
-        if op.exists(temp_mri_prep): shutil.rmtree(temp_mri_prep)
-        temp_mri_prep.mkdir(parents=True)
-        
-        #    
-        #Check for Afni and convert the mri to nifti
-        #
-        if args.mri_brik:
-            host = os.uname().nodename
-            
-            #Convert the mri to nifti
-            nii_mri = convert_brik(args.mri_brik, outdir=temp_mri_prep)
-            logger.info(f'Converted {args.mri_brik} to {nii_mri}')
-            
-            #Extract FIDS from Afni Head and convert to RAS
-            coords_lps = coords_from_oblique_afni(args.mri_brik)
-            coords_ras = {}
-            for key in coords_lps.keys():
-                tmp = np.array(coords_lps[key])
-                tmp[0:2]*=-1
-                coords_ras[key]=tmp
-              
-        #
-        # Proc Brainsight Data
-        #
-        if args.mri_bsight:
-            if (args.mri_bsight.endswith('.nii')) or (args.mri_bsight.endswith('.nii.gz')):
-                nii_mri = args.mri_bsight
-            else:
-                raise ValueError(f'mri_bsight entry does not end with (nii or nii.gz): {args.mri_bsight}')
-        
+    meg_error, mri_error, nii_mri = None, None, None
+    with ThreadPoolExecutor(max_workers=1) as mri_executor:
+        if args.ignore_mri_checks != True:
+            mri_future = mri_executor.submit(_make_mri_bids, args, subjid, 
+                                             bids_id, temp_dir)
+        else:
+            mri_future = None
         
         #
-        #   Anonymize/Deface MRI if set
-        #
-        if args.anonymize==True:
-            nii_mri = mri_deface(nii_mri, topdir=temp_mri_prep)
-      
-        #
-        # Finish MRI prep
+        #   Process MEG
         #
-        t1_bids_path = process_mri_bids(bids_dir=args.bids_dir,
-                                     bids_id=bids_id, 
-                                     nii_mri = nii_mri,
-                                     session=args.bids_session)
-        if args.mri_bsight_elec != None:
-            process_mri_json(elec_fname=args.mri_bsight_elec,
-                                 mri_fname = str(t1_bids_path))
-        elif args.mri_brik != None:
-            process_mri_json(elec_fname=args.mri_bsight_elec,
-                                 mri_fname = str(t1_bids_path), 
-                                 ras_coords=coords_ras)
-
-            
-        
+        try:
+            meg_run_errors = process_meg_bids(dset_dict=sorted_renamed_megdict,
+                                        subject_in=subjid,
+                                         bids_dir=args.bids_dir,
+                                         bids_id = args.bids_id, 
+                                         session=args.bids_session, 
+                                         anonymize=args.anonymize,
+                                         ignore_eroom=args.ignore_eroom,
+                                         crop_trailing_zeros=args.autocrop_zeros,
+                                         eventID_csv=args.eventID_csv,
+                                         n_workers=getattr(args, 'n_workers', 1),
+                                         log_dir=logger_dir,
+                                         incremental=getattr(args, 'incremental', False),
+                                         link_meg4=getattr(args, 'link_meg4', False),
+                                         anonymize_method=anonymize_method,
+                                         **kwargs)
+            if len(meg_run_errors) > 0:
+                raise RuntimeError(f'{len(meg_run_errors)} MEG run(s) did not convert: ' + 
+                                   '; '.join(f'{key} : {val}' for key, val in meg_run_errors.items()))
+        except Exception as e:
+            logger.error(f'MEG processing error: {str(e)}')
+            err_logger.error(f'MEG processing error: {str(e)}')
+            meg_error = e
         
+        if mri_future is not None:
+            try:
+                nii_mri = mri_future.result()
+            except Exception as e:
+                logger.error(f'MRI processing error: {str(e)}')
+                err_logger.error(f'MRI processing error: {str(e)}')
+                mri_error = e
 
-    
     #
     # Check results            
     #
@@ -1087,11 +1389,17 @@ def make_bids(args):
     #
     # Plot QA images
     #
-    if args.ignore_mri_checks != True:
+    if (args.ignore_mri_checks != True) and (mri_error is None):
         out_fids_qa_image = op.join(logger_dir, f'{args.subjid_input}_fids_qa.png')
         plot_fids_qa(subjid=args.bids_id, bids_root=args.bids_dir, 
                      outfile=out_fids_qa_image)
     
+    #Errors are raised after the other branch has finished
+    if meg_error is not None:
+        raise meg_error
+    if mri_error is not None:
+        raise mri_error
+    
     #
     # Downstream Processing
     #
@@ -1167,7 +1475,9 @@ def make_bids(args):
     
 
 
-def main():
+def _make_parser():
+    '''Commandline parser for make_meg_bids.  Also used by the csv batch 
+    processing in make_meg_bids_fromcsv'''
     import argparse
     parser = argparse.ArgumentParser('''
         Convert MEG dataset to default Bids format using the MEG hash ID or 
@@ -1182,7 +1492,8 @@ def main():
     parser.add_argument('-anonymize', 
                         help='''Strip out subject ID information from the MEG
                         data.  Currently this does not anonymize the MRI.
-                        Requires the CTF tools.''',
+                        Uses the CTF tools (newDs) or the python anonymization
+                        - see -anonymize_method.''',
                         default=False,
                         action='store_true')
     group1 = parser.add_argument_group('Afni Coreg')
@@ -1245,6 +1556,33 @@ def main():
                         This can be produced by running: standardize_eventID_list.py
                         ''', 
                         default=None)    
+    group3.add_argument('-n_workers', 
+                        help='''Number of MEG runs to convert in parallel.
+                        Each run is processed in a separate worker with its 
+                        own temp directory and log file''', 
+                        type=int,
+                        default=1)
+    group3.add_argument('-incremental', 
+                        help='''Skip MEG runs that have already been converted
+                        with the same inputs and options.  This is tracked in 
+                        the bids_dir/code/nih2mne_conversion_manifest.json''', 
+                        action='store_true', 
+                        default=False)
+    group3.add_argument('-link_meg4', 
+                        help='''Reflink or hardlink the .meg4 data into the 
+                        bids_dir instead of copying (falls back to a copy if
+                        not on the same filesystem).  !Hardlinked files share
+                        the data with the input dataset''', 
+                        action='store_true', 
+                        default=False)
+    group3.add_argument('-anonymize_method', 
+                        help='''Method for -anonymize and -autocrop_zeros.
+                        newDs: CTF tools.  native: python anonymization of the 
+                        header files and single pass cropping (does not require
+                        the CTF tools).  auto (default): newDs if available, 
+                        else native''', 
+                        choices=['auto', 'newDs', 'native'],
+                        default='auto')
     group4 = parser.add_argument_group('UNDER Construction - BIDS PostProcessing')
     group4.add_argument('-project',
                         help='''Output project name for the mri processing from mri_prep''', 
@@ -1262,7 +1600,24 @@ def main():
                         )
     
     
-    args=parser.parse_args()
+    return parser
+
+def _parse_cmdline(argv=None):
+    '''
+    Parse and check the make_meg_bids commandline options
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        Commandline options.  The default of None reads from sys.argv
+
+    Returns
+    -------
+    args : argparse.Namespace
+
+    '''
+    parser = _make_parser()
+    args=parser.parse_args(argv)
     args = _clean_python_args(args)    
 
     
@@ -1271,7 +1626,10 @@ def main():
         
     if args.anonymize==True and args.bids_id is None:
         parser.error("-anonymize requires -bids_id")
-        
+    return args
+    
+def main():
+    args = _parse_cmdline()
     make_bids(args)
         
 def _clean_python_args(args):
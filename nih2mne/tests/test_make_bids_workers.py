@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+make_bids with the MEG worker pool and the concurrent MRI branch.  Uses the
+synthetic CTF datasets, so this does not require the test_data download.
+"""
+import os, os.path as op
+import numpy as np
+import nibabel as nib
+import nih2mne
+from nih2mne.make_meg_bids import _parse_cmdline, make_bids
+from nih2mne.utilities.tests.ctf_fixtures import make_ds
+
+elec_fname = op.join(nih2mne.__path__[0], 'tests', 'bsight_test_updated_good_coordsys.txt')
+
+def test_make_bids_meg_workers_with_mri(tmp_path):
+    meg_dir = op.join(tmp_path, 'meg')
+    for run, task in [(1, 'rest'), (2, 'flanker')]:
+        make_ds(op.join(meg_dir, f'ABABABAB_{task}_20010101_00{run}.ds'),
+                n_samples=600, n_trials=2)
+    mri_fname = op.join(tmp_path, 'T1.nii')
+    nib.save(nib.Nifti1Image(np.zeros((32, 32, 32), dtype=np.int16),
+                             np.diag([8., 8., 8., 1.])), mri_fname)
+    bids_dir = op.join(tmp_path, 'bids')
+    args = _parse_cmdline(['-bids_dir', bids_dir, '-subjid_input', 'ABABABAB',
+                           '-bids_id', 'S01', '-meg_input_dir', meg_dir,
+                           '-ignore_eroom', '-n_workers', '2',
+                           '-mri_bsight', mri_fname, '-mri_bsight_elec', elec_fname])
+    make_bids(args)
+
+    meg_out = op.join(bids_dir, 'sub-S01', 'ses-1', 'meg')
+    for task in ['rest', 'flanker']:
+        assert op.exists(op.join(meg_out, f'sub-S01_ses-1_task-{task}_run-01_meg.ds'))
+        assert op.exists(op.join(tmp_path, 'bids_prep_logs',
+                                 f'ABABABAB_task-{task}_run-01_log.txt'))
+    anat_out = op.join(bids_dir, 'sub-S01', 'ses-1', 'anat')
+    assert sorted(os.listdir(anat_out)) == ['sub-S01_ses-1_T1w.json',
+                                            'sub-S01_ses-1_T1w.nii.gz']
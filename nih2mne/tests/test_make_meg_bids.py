@@ -8,6 +8,7 @@ import logging
 from ..calc_mnetrans import coords_from_afni
 import glob
 from mne_bids import BIDSPath
+import mne_bids
 
 import nibabel as nib
 import pytest 
@@ -181,6 +182,50 @@ def test_process_meg_bids(tmp_path):
         print(i)
         assert op.exists(bids_dir / f'sub-{bids_id}' / 'ses-1' /'meg' / i)
         
+def test_process_meg_bids_parallel(tmp_path):
+    bids_dir = tmp_path / 'bids_dir'
+    meg_dir = op.join(data_path, '20010101')
+    subject_in = 'ABABABAB'
+    bids_id = 'S01'
+    
+    dset_dict = sessdir2taskrundict(session_dir=meg_dir, subject_in=subject_in)
+    dset_dict = {i:[op.join(meg_dir, j[0])] for i,j in dset_dict.items()}
+    #Add a failing run to confirm the other runs are still processed
+    dset_dict['missing'] = [op.join(meg_dir, 'ABABABAB_missing_20010101_001.ds')]
+    
+    errors = process_meg_bids(dset_dict = dset_dict,
+                              subject_in = subject_in,
+                              bids_dir = bids_dir,
+                              bids_id = bids_id, 
+                              session = '1', 
+                              anonymize = False,
+                              ignore_eroom=True, 
+                              crop_trailing_zeros= False, 
+                              n_workers=3, 
+                              log_dir=tmp_path
+                              )
+    assert list(errors.keys()) == dset_dict['missing']
+    meg_dir_out = bids_dir / f'sub-{bids_id}' / 'ses-1' /'meg'
+    for task in ['airpuff', 'haririhammer']:
+        assert op.exists(meg_dir_out / f'sub-S01_ses-1_task-{task}_run-01_meg.ds')
+        assert op.exists(tmp_path / f'{subject_in}_task-{task}_run-01_log.txt')
+    import pandas as pd
+    scans = pd.read_csv(bids_dir / f'sub-{bids_id}' / 'ses-1' / f'sub-{bids_id}_ses-1_scans.tsv', 
+                        sep='\t')
+    assert len(scans) == 2
+
+def test_process_meg_bids_serial_errors(tmp_path):
+    #Serial processing returns the failed runs in the same way as the pool
+    missing = op.join(tmp_path, 'ABABABAB_missing_20010101_001.ds')
+    errors = process_meg_bids(dset_dict = {'missing':[missing]},
+                              subject_in = 'ABABABAB',
+                              bids_dir = tmp_path / 'bids_dir',
+                              bids_id = 'S01', 
+                              session = '1', 
+                              ignore_eroom=True, 
+                              n_workers=1)
+    assert list(errors.keys()) == [missing]
+        
 def test_process_mri_bids(tmp_path):
     out_dir = tmp_path / "bids_test_dir"
     out_dir.mkdir()
@@ -324,7 +369,40 @@ def test_convert_afni(tmp_path):
     
     assert np.allclose(g_truth_nii.affine, out_nii_dat.affine)
     assert np.allclose(g_truth_nii.get_fdata().squeeze(), out_nii_dat.get_fdata().squeeze())
-    
+
+def test_convert_afni_preserve_dtype(tmp_path):
+    #Small scaled int16 afni volume - more slices than a single slab
+    shape = (5, 6, 40)
+    dat = np.arange(np.prod(shape), dtype=np.int16).reshape(shape, order='F')
+    brik_fname = op.join(tmp_path, 'mri+orig.BRIK')
+    dat.astype('<i2').tofile(brik_fname)
+    attrs = [('integer', 'DATASET_RANK', '3 1 0 0 0 0 0 0'),
+             ('integer', 'DATASET_DIMENSIONS', '5 6 40 0 0'),
+             ('string', 'TYPESTRING', "'3DIM_HEAD_ANAT~"),
+             ('integer', 'SCENE_DATA', '0 0 0 -999 -999 -999 -999 -999'),
+             ('integer', 'ORIENT_SPECIFIC', '1 2 4'),
+             ('float', 'ORIGIN', '10 20 -30'),
+             ('float', 'DELTA', '-1 -1 1.2'),
+             ('float', 'IJK_TO_DICOM_REAL', '-1 0 0 10 0 -1 0 20 0 0 1.2 -30'),
+             ('integer', 'BRICK_TYPES', '1'),
+             ('float', 'BRICK_FLOAT_FACS', '0.5'),
+             ('string', 'BYTEORDER_STRING', "'LSB_FIRST~")]
+    entries = []
+    for attr_type, name, val in attrs:
+        count = len(val)-1 if attr_type=='string' else len(val.split())
+        entries.append(f'type = {attr_type}-attribute\nname = {name}\ncount = {count}\n{val}')
+    with open(brik_fname.replace('.BRIK','.HEAD'), 'w') as f:
+        f.write('\n\n'.join(entries) + '\n')
+    g_truth = nib.load(brik_fname)
+
+    out_fname = convert_brik(brik_fname, outdir=tmp_path)
+    assert out_fname == op.join(tmp_path, 'mri.nii.gz')
+    out_nii = nib.load(out_fname)
+    assert out_nii.get_data_dtype() == np.int16
+    assert out_nii.dataobj.slope == 0.5
+    assert np.allclose(g_truth.affine, out_nii.affine)
+    assert np.array_equal(g_truth.get_fdata(), out_nii.get_fdata())
+
 
 class make_args():
     def __init__(self, bids_dir, meg_input_dir, subjid_input, bids_id, mri_bsight, bsight_elec, mri_brik):
@@ -410,6 +488,24 @@ def test_proc_meg_bids(tmpdir):
     assert _bids_path.fpath.exists()
 
 
+def test_proc_meg_bids_link_meg4(tmpdir):
+    import os
+    out_bids_path = op.join(tmpdir, 'BIDS')
+    _bids_path = BIDSPath(subject='TEST', session='1', task='airpuff', 
+                          datatype='meg', suffix='meg', run='01',
+                          root = out_bids_path, extension='.ds'
+                          )
+    meg_fname = str(test_data.meg_airpuff_fname)
+    _proc_meg_bids(meg_fname=meg_fname, bids_path=_bids_path,
+                        anonymize=False, tmpdir=None, ignore_eroom=True, 
+                        crop_trailing_zeros=False, link_meg4=True
+                       )
+    in_meg4 = glob.glob(op.join(meg_fname, '*.meg4'))[0]
+    out_meg4 = str(_bids_path.fpath / (_bids_path.basename[:-3] + '.meg4'))
+    assert os.stat(in_meg4).st_size == os.stat(out_meg4).st_size
+    raw_bids = mne_bids.read_raw_bids(_bids_path)
+    assert raw_bids.n_times > 0
+
 def test_proc_mri_bids(tmpdir):
     out_bids_path = op.join(tmpdir, 'BIDS')
     _bids_path = BIDSPath(subject='TEST', session='1',  
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the JSON-lines QA state store
+"""
+import os, os.path as op
+import json
+import dill
+import numpy as np
+import pytest
+from nih2mne.dataQA import qa_state
+from nih2mne.dataQA.qa_state import (write_state, read_state, read_project_state,
+                                     register_migration, get_state_fname)
+from nih2mne.dataQA.bids_project_interface import (bids_project, subject_bids_info,
+                                                   _subject_bids_info)
+from nih2mne.utilities.tests.test_bids_index import make_bids_tree
+
+def test_state_roundtrip(tmp_path):
+    fname = op.join(tmp_path, 'sub-01.jsonl')
+    state = dict(subject='sub-01', mri_json_qa='GOOD',
+                 fs_recon=dict(fs_success=np.bool_(True)),
+                 meg_list=[dict(fname='a_meg.ds', BADS={'JUMPS':{'TSTEP':np.arange(3)}})])
+    write_state(state, fname)
+    out = read_state(fname)
+    assert out['fs_recon']['fs_success'] is True
+    assert out['meg_list'][0]['BADS']['JUMPS']['TSTEP'] == [0, 1, 2]
+
+    #Partial reads only decode the requested lines
+    with open(fname, 'a') as f:
+        f.write('{"field": "broken", "value": \n')
+    assert read_state(fname, fields=['mri_json_qa', 'subject']) == \
+        dict(subject='sub-01', mri_json_qa='GOOD')
+    with pytest.raises(json.JSONDecodeError):
+        read_state(fname)
+
+def test_state_migration(tmp_path, monkeypatch):
+    fname = op.join(tmp_path, 'sub-01.jsonl')
+    with open(fname, 'w') as f:
+        f.write(json.dumps(dict(schema_version=0, kind=qa_state.state_kind)) + '\n')
+        f.write(json.dumps(dict(field='mri_qa', value='GOOD')) + '\n')
+    with pytest.raises(ValueError):
+        read_state(fname)
+
+    monkeypatch.setattr(qa_state, '_migrations', {})
+    @register_migration(0)
+    def _rename_mri_qa(state):
+        state['mri_json_qa'] = state.pop('mri_qa')
+        return state
+    assert read_state(fname) == dict(mri_json_qa='GOOD')
+    assert read_state(fname, fields=['mri_json_qa']) == dict(mri_json_qa='GOOD')
+
+def test_subject_state_store(tmp_path):
+    bids_root = op.join(tmp_path, 'BIDS')
+    make_bids_tree(bids_root)
+    project = bids_project(bids_root=bids_root, n_workers=1)
+    state_fname = get_state_fname(bids_root, 'sub-01')
+    assert op.exists(state_fname)
+    assert not op.exists(state_fname.replace('.jsonl', '.pkl'))
+
+    subj = project.subjects['sub-01']
+    subj.meg_list[0].set_status('BAD')
+    subj.save(overwrite=True)
+    loaded = subject_bids_info(subject='sub-01', bids_root=bids_root)
+    assert loaded.meg_list[0].status == 'BAD'
+    assert [i.fname for i in loaded.meg_list] == [i.fname for i in subj.meg_list]
+    assert (loaded.mri, loaded.mri_json_qa, loaded.fs_recon) == \
+        (subj.mri, subj.mri_json_qa, subj.fs_recon)
+    assert loaded.qa_default_fname == state_fname
+
+    status = read_project_state(bids_root, fields=['mri_json_qa', 'fs_recon'])
+    assert list(status.index) == ['sub-01', 'sub-02']
+    assert status.loc['sub-01', 'mri_json_qa'] == 'GOOD'
+    assert status.loc['sub-02', 'fs_recon']['fs_started'] == False
+
+def test_migrate_pickle(tmp_path):
+    bids_root = op.join(tmp_path, 'BIDS')
+    make_bids_tree(bids_root)
+    subj = _subject_bids_info('sub-01', bids_root=bids_root)
+    subj.meg_list[1].set_status('GOOD')
+    pkl_fname = op.join(bids_root, 'derivatives', 'megQA', 'sub-01.pkl')
+    with open(pkl_fname, 'wb') as f:
+        dill.dump(subj, f)
+
+    loaded = subject_bids_info(subject='sub-01', bids_root=bids_root)
+    assert op.exists(get_state_fname(bids_root, 'sub-01'))
+    assert loaded.meg_list[1].status == 'GOOD'
+    assert loaded.meg_count == 2
+    assert loaded.mri == subj.mri
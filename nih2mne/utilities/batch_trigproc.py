@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Apply a trigger rule spec (see trigger_rules / trigger_code_gui) to all of the
+CTF datasets in an acquisition directory or BIDS root.
+
+The datasets are processed in a pool of workers, the MarkerFile.mrk in each
+dataset is replaced atomically and a single table of the per condition
+counts is written.  The counts can be checked against the expected counts
+in a qa config (see nih2mne/dataQA/config_template.yml).
+
+    batch_trigproc.py -topdir /data/MEG/ABABABAB -spec ~/megcore/trigproc/flanker_v1.yml -task flanker -n_workers 8
+
+@author: jstout
+"""
+import os, os.path as op
+import glob
+import pandas as pd
+from nih2mne.utilities.trigger_rules import load_rule_spec, process_datasets
+
+_skip_ds = ['hz.ds', 'hz2.ds']
+
+def get_task(meg_fname):
+    '''Task from a BIDS (task-X) or acquisition (SUBJ_TASK_DATE_RUN.ds) name'''
+    basename = op.basename(str(meg_fname).rstrip('/'))[:-3]
+    entities = [i[5:] for i in basename.split('_') if i.startswith('task-')]
+    if len(entities) > 0:
+        return entities[0]
+    parts = basename.split('_')
+    if len(parts) > 3:
+        return parts[1]
+    return None
+
+def find_datasets(topdir, task=None):
+    '''
+    CTF datasets under topdir.  Datasets inside other datasets (hz.ds) are 
+    not included.
+
+    Parameters
+    ----------
+    topdir : str
+        Acquisition directory or BIDS root
+    task : str, optional
+        Only return datasets for this task (case insensitive). The default is None.
+
+    Returns
+    -------
+    list
+        Sorted dataset paths
+
+    '''
+    dsets = glob.glob(op.join(topdir, '**', '*.ds'), recursive=True)
+    dsets = [i for i in dsets if op.isdir(i) and (op.basename(i) not in _skip_ds)]
+    dsets = [i for i in dsets if '.ds' not in op.dirname(op.relpath(i, topdir))]
+    if task is not None:
+        dsets = [i for i in dsets if str(get_task(i)).lower() == task.lower()]
+    return sorted(dsets)
+
+def make_summary(results):
+    '''
+    One row per dataset with the status and a column of counts per condition
+
+    Parameters
+    ----------
+    results : list
+        Output of trigger_rules.process_datasets
+
+    Returns
+    -------
+    pd.DataFrame
+
+    '''
+    rows = []
+    for idx, meg_fname, status, error, counts in results:
+        rows.append({'dataset':op.basename(meg_fname), 'task':get_task(meg_fname), 
+                     'status':status, 'error':error, **counts})
+    summary = pd.DataFrame(rows, columns=['dataset', 'task', 'status', 'error'] + \
+                           sorted({i for row in results for i in row[4]}))
+    return summary
+
+def qa_summary(summary, qa_dict):
+    '''
+    Compare the counts to the expected counts of the qa config.  A condition
+    passes if the count is greater or equal to the expected value.  Datasets
+    for tasks not in the config are Not Tested.
+
+    Parameters
+    ----------
+    summary : pd.DataFrame
+        Output of make_summary
+    qa_dict : dict
+        Expected counts {task: {condition: count}} (qa_config_reader.read_yml)
+
+    Returns
+    -------
+    summary : pd.DataFrame
+        Copy with a qa column (Pass/Fail/Not Tested) and the failed conditions
+
+    '''
+    summary = summary.copy()
+    qa_dict = {str(i).lower():j for i,j in qa_dict.items()}
+    qa_status, qa_failed = [], []
+    for idx, row in summary.iterrows():
+        expected = qa_dict.get(str(row.task).lower())
+        if (expected is None) or (row.status != 'success'):
+            qa_status.append('Not Tested')
+            qa_failed.append('')
+            continue
+        failed = [cond for cond, count in expected.items() 
+                  if pd.isna(row.get(cond)) or (row.get(cond) < count)]
+        qa_status.append('Fail' if len(failed) > 0 else 'Pass')
+        qa_failed.append(','.join(failed))
+    summary['qa'] = qa_status
+    summary['qa_failed'] = qa_failed
+    return summary
+
+def batch_trigproc(topdir, spec, task=None, n_workers=1, qa_config=None,
+                   summary_fname=None, write_mrk=True):
+    '''
+    Apply the rule spec to all datasets under topdir
+
+    Parameters
+    ----------
+    topdir : str
+        Acquisition directory or BIDS root
+    spec : str | dict
+        Rule spec yaml file or dictionary
+    task : str, optional
+        Only process datasets for this task. The default is None.
+    n_workers : int, optional
+        Number of datasets to process concurrently. The default is 1.
+    qa_config : str, optional
+        QA yaml with the expected counts per task. The default is None.
+    summary_fname : str, optional
+        Write the summary table to this csv. The default is None.
+    write_mrk : bool, optional
+        Write the MarkerFile.mrk into each dataset. The default is True.
+
+    Returns
+    -------
+    summary : pd.DataFrame
+
+    '''
+    if not isinstance(spec, dict):
+        spec = load_rule_spec(spec)
+    dsets = find_datasets(topdir, task=task)
+    if len(dsets) == 0:
+        raise ValueError(f'No datasets found in {topdir}')
+    print(f'Processing {len(dsets)} datasets')
+    results = process_datasets(spec, dsets, n_workers=n_workers, write_mrk=write_mrk)
+    summary = make_summary(results)
+    if qa_config is not None:
+        from nih2mne.dataQA.qa_config_reader import read_yml
+        summary = qa_summary(summary, read_yml(qa_config))
+    if summary_fname is not None:
+        summary.to_csv(summary_fname, index=False)
+    print(summary.drop(columns=['error']).to_string(index=False))
+    failed = summary[summary.status != 'success']
+    for idx, row in failed.iterrows():
+        print(f'{row.dataset}: {row.error}')
+    return summary
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='''Apply a trigger rule spec
+                                     (.yml from the trigger_code_gui) to all of the 
+                                     datasets in a folder and write the MarkerFiles''')
+    parser.add_argument('-topdir', required=True, 
+                        help='Acquisition directory or BIDS root')
+    parser.add_argument('-spec', required=True, 
+                        help='Trigger rule spec (.yml)')
+    parser.add_argument('-task', required=False, 
+                        help='Only process datasets from this task')
+    parser.add_argument('-n_workers', required=False, type=int, default=1,
+                        help='Number of datasets to process concurrently')
+    parser.add_argument('-qa_config', required=False, 
+                        help='''QA yaml of expected counts per task to check 
+                        the output - see nih2mne/dataQA/config_template.yml''')
+    parser.add_argument('-summary_fname', required=False, 
+                        default='trigproc_batch_summary.csv',
+                        help='Output summary csv of the event counts')
+    parser.add_argument('-no_write', required=False, action='store_true',
+                        help='Count the events without writing MarkerFiles')
+    args = parser.parse_args()
+    
+    summary = batch_trigproc(args.topdir, args.spec, task=args.task, 
+                             n_workers=args.n_workers, qa_config=args.qa_config,
+                             summary_fname=args.summary_fname, 
+                             write_mrk=not args.no_write)
+    if 'failed' in summary.status.values:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ import mne_bids
 import os.path as op
 from functools import partial
 import glob
+from nih2mne.utilities.bids_index import BidsIndex
 
 search_list = ['bem','fwd','volfwd','trans','stc','cov','src']
 
@@ -25,7 +26,7 @@ def get_project(bids_root, project=None):
     project : str, optional
         Project name.  If left blank it will try to determine the project.
         For this to work, there must only be 1 extra folder in derivatives
-        except for the freesurfer directory
+        except for the freesurfer and megQA directories
 
     Raises
     ------
@@ -56,7 +57,7 @@ def get_project(bids_root, project=None):
         return project_root
     #Check for possible project folders
     tmp_=glob.glob(op.join(deriv_root, '*'))
-    _=[tmp_.remove(i) for i in tmp_ if op.basename(i) == 'freesurfer']
+    tmp_=[i for i in tmp_ if op.basename(i) not in ['freesurfer', 'megQA']]
     if len(tmp_)==0:
         raise ValueError(f"Can't find the project folder in: {deriv_root}")
     elif len(tmp_)>1:
@@ -110,12 +111,19 @@ class data_getter():
         self._get_loader()  #Set the self.loader
         return self.loader(self.bids_path.fpath)
 
-def get_mri_dict(subject, bids_root=None, project=None, session='01', task=None):
+def get_mri_dict(subject, bids_root=None, project=None, session='01', task=None,
+                 index=None):
     project_root = get_project(bids_root, project)
-    subj_deriv = op.join(bids_root, 'derivatives',project_root, 'sub-'+subject)
-    deriv_bids_paths = mne_bids.find_matching_paths(project_root, [subject], tasks=[task], datatypes='meg', sessions=session, suffixes=search_list)
+    if index is None:
+        index = BidsIndex(op.dirname(op.dirname(project_root)))
+        index.refresh(subjects=['sub-'+subject])
+    deriv_fnames = index.files(root=op.basename(project_root), subject='sub-'+subject,
+                               session=session, task=task, datatype='meg',
+                               suffix=search_list)
     data_dict={}
-    for bids_path in deriv_bids_paths:
+    for fname in deriv_fnames:
+        bids_path = mne_bids.get_bids_path_from_fname(fname, check=False)
+        bids_path.update(datatype='meg')
         tmp_ = data_getter(bids_path)
         if tmp_.type != False:
             data_dict[tmp_.type]=tmp_
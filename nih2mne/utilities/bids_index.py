@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent metadata index of a BIDS project.
+
+The subjects, sessions, runs, tasks, file sizes, MEG header info (sfreq,
+duration, channel counts), event counts, derivative files and freesurfer
+status are stored in an SQLite database (derivatives/megQA by default).
+refresh() only stats the directories of the tree and re-lists the ones with a
+changed mtime, so an unchanged project is updated without touching the
+files.  CTF datasets are re-read if the dataset folder or MarkerFile.mrk
+changes.
+
+    index = BidsIndex(bids_root)
+    index.refresh()
+    index.subjects()
+    index.files(subject='sub-ON01', extension='.ds')
+    index.meg_table()
+
+Indexed: sub-* at the bids root and derivatives/<project>/sub-* (freesurfer
+and megQA excluded).  Paths are stored relative to the bids root.
+
+@author: jstout
+"""
+import os, os.path as op
+import json
+import sqlite3
+import hashlib
+import time
+import pandas as pd
+from nih2mne.utilities.events import read_ds_info, event_counts
+from nih2mne.utilities.user_cache import get_user_cache_dir
+
+INDEX_VERSION = 1
+index_name = 'nih2mne_bids_index.sqlite'
+_exclude_derivatives = ['freesurfer', 'megQA']
+# Entries modified this recently are re-read on the next refresh, since a
+# change in the same timestamp tick would not update the mtime
+_racy_ns = 2 * 10**9
+_datatypes = ['meg', 'anat', 'func', 'dwi', 'fmap', 'beh', 'eeg']
+_file_columns = ['path', 'dir', 'root', 'subject', 'session', 'task', 'run',
+                 'datatype', 'suffix', 'extension', 'size', 'mtime_ns']
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT,
+                                 mtime_ns INTEGER);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dir TEXT, root TEXT,
+                                  subject TEXT, session TEXT, task TEXT,
+                                  run TEXT, datatype TEXT, suffix TEXT,
+                                  extension TEXT, size INTEGER,
+                                  mtime_ns INTEGER);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS files_subject ON files (subject);
+CREATE TABLE IF NOT EXISTS meg (path TEXT PRIMARY KEY, signature TEXT,
+                                sfreq REAL, duration REAL, n_chans INTEGER,
+                                n_trials INTEGER, n_samples INTEGER,
+                                event_counts TEXT);
+CREATE TABLE IF NOT EXISTS freesurfer (subject TEXT PRIMARY KEY,
+                                       signature TEXT, fs_success INTEGER,
+                                       fs_started INTEGER, lhpial INTEGER,
+                                       rhpial INTEGER);
+'''
+
+def default_index_fname(bids_root):
+    '''derivatives/megQA of the bids root or the user temp dir if not writable'''
+    bids_root = op.abspath(bids_root)
+    qa_dir = op.join(bids_root, 'derivatives', 'megQA')
+    if os.access(qa_dir, os.W_OK) or \
+        (not op.exists(qa_dir) and os.access(bids_root, os.W_OK)):
+        return op.join(qa_dir, index_name)
+    index_dir = get_user_cache_dir('bids_index', env_var='bids_index_dir')
+    root_hash = hashlib.md5(bids_root.encode()).hexdigest()[:12]
+    return op.join(index_dir, f'{op.basename(bids_root)}_{root_hash}_{index_name}')
+
+def parse_bids_fname(rel_path):
+    '''
+    BIDS entities from a path relative to the bids root
+
+    Returns
+    -------
+    dict
+        root ("bids" or the derivatives project), subject, session, task, run,
+        datatype, suffix, extension
+
+    '''
+    parts = rel_path.split(os.sep)
+    root = parts[1] if (parts[0] == 'derivatives') and (len(parts) > 2) else 'bids'
+    fname = parts[-1]
+    stem, dot, ext = fname.partition('.')
+    entities = dict(i.split('-', 1) for i in stem.split('_') if '-' in i)
+    suffix = stem.split('_')[-1] if '_' in stem else None
+    datatype = parts[-2] if (len(parts) > 1) and (parts[-2] in _datatypes) else None
+    subject = entities.get('sub')
+    return dict(root=root,
+                subject=None if subject is None else 'sub-'+subject,
+                session=entities.get('ses'), task=entities.get('task'),
+                run=entities.get('run'), datatype=datatype, suffix=suffix,
+                extension=dot+ext if dot else '')
+
+def fs_recon_status(subjects_dir, subject):
+    '''Freesurfer status - same output as qa_mri_class.check_fs_recon'''
+    logfile = op.join(subjects_dir, subject, 'scripts', 'recon-all.log')
+    started = op.exists(logfile)
+    last_line = ''
+    if started:
+        #Only the end of the log is needed
+        with open(logfile, 'rb') as f:
+            f.seek(max(op.getsize(logfile) - 4096, 0))
+            lines = f.read().decode(errors='ignore').splitlines()
+        last_line = lines[-1] if len(lines) > 0 else ''
+    return dict(fs_success = 'finished without error' in last_line,
+                fs_started = started,
+                lhpial = op.exists(op.join(subjects_dir, subject, 'surf', 'lh.pial')),
+                rhpial = op.exists(op.join(subjects_dir, subject, 'surf', 'rh.pial')))
+
+def _is_racy(mtime_ns):
+    return time.time_ns() - mtime_ns < _racy_ns
+
+def _stat_signature(fnames):
+    '''[mtime_ns, size] of each path (None if missing or recently modified)'''
+    out = []
+    for fname in fnames:
+        try:
+            st = os.stat(fname)
+        except FileNotFoundError:
+            out.append(None)
+            continue
+        if _is_racy(st.st_mtime_ns):
+            return None
+        out.append([st.st_mtime_ns, st.st_size])
+    return json.dumps(out)
+
+def _dir_subject(rel_dir):
+    parts = rel_dir.split(os.sep)
+    idx = 2 if parts[0] == 'derivatives' else 0
+    return parts[idx] if len(parts) > idx else None
+
+class BidsIndex():
+    def __init__(self, bids_root, index_fname=None, subjects_dir=None):
+        '''
+        SQLite index of a BIDS project.  No connection is held between calls
+        so the object can be pickled and shared with worker processes.
+
+        Parameters
+        ----------
+        bids_root : str
+            Top level of the bids directory
+        index_fname : str, optional
+            Database file. The default is derivatives/megQA/nih2mne_bids_index.sqlite
+        subjects_dir : str, optional
+            Freesurfer subjects dir. The default is derivatives/freesurfer/subjects
+
+        '''
+        self.bids_root = op.abspath(bids_root)
+        self.index_fname = index_fname or default_index_fname(self.bids_root)
+        if subjects_dir is None:
+            subjects_dir = op.join(self.bids_root, 'derivatives', 'freesurfer', 'subjects')
+        self.subjects_dir = subjects_dir
+        os.makedirs(op.dirname(self.index_fname), exist_ok=True)
+        with self._connect() as con:
+            con.executescript(_schema)
+            version = con.execute("SELECT value FROM meta WHERE key='version'").fetchone()
+            if (version is not None) and (float(version[0]) != INDEX_VERSION):
+                for table in ['dirs', 'files', 'meg', 'freesurfer']:
+                    con.execute(f'DELETE FROM {table}')
+            con.execute("REPLACE INTO meta VALUES ('version', ?)", (str(INDEX_VERSION),))
+        con.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.index_fname, timeout=60)
+
+    def _abs(self, rel_path):
+        return op.join(self.bids_root, rel_path)
+
+    def _include_dir(self, rel_path):
+        parts = rel_path.split(os.sep)
+        if parts[-1].startswith('.'):
+            return False
+        if parts[0] == 'derivatives':
+            if len(parts) == 1:
+                return True
+            if parts[1] in _exclude_derivatives:
+                return False
+            return (len(parts) == 2) or parts[2].startswith('sub-')
+        return parts[0].startswith('sub-')
+
+    def _top_dirs(self, subjects=None):
+        '''Subject folders at the bids root and in each derivatives project'''
+        if subjects is None:
+            subjects = sorted(i for i in os.listdir(self.bids_root) if i.startswith('sub-'))
+        subjects = [i if i.startswith('sub-') else 'sub-'+i for i in subjects]
+        top = [i for i in subjects if op.isdir(self._abs(i))]
+        deriv = self._abs('derivatives')
+        if op.isdir(deriv):
+            for proj in sorted(os.listdir(deriv)):
+                if not self._include_dir(op.join('derivatives', proj)):
+                    continue
+                top += [op.join('derivatives', proj, i) for i in subjects
+                        if op.isdir(op.join(deriv, proj, i))]
+        return top, subjects
+
+    def _scan_dir(self, con, rel_dir, mtime_ns):
+        '''List a changed folder - returns the subfolders to walk'''
+        # The dataset size is set by _update_meg - keep it for unchanged datasets
+        prev_size = dict(con.execute('SELECT path, size FROM files WHERE dir=?', 
+                                     (rel_dir,)).fetchall())
+        con.execute('DELETE FROM files WHERE dir=?', (rel_dir,))
+        rows, subdirs = [], []
+        with os.scandir(self._abs(rel_dir)) as it:
+            for entry in it:
+                rel_path = op.join(rel_dir, entry.name)
+                is_ds = entry.name.endswith('.ds') and entry.is_dir()
+                if entry.is_dir() and not is_ds:
+                    if self._include_dir(rel_path):
+                        subdirs.append(rel_path)
+                    continue
+                st = entry.stat()
+                info = parse_bids_fname(rel_path)
+                rows.append((rel_path, rel_dir, info['root'], info['subject'],
+                             info['session'], info['task'], info['run'],
+                             info['datatype'], info['suffix'], info['extension'],
+                             prev_size.get(rel_path, 0) if is_ds else st.st_size, 
+                             st.st_mtime_ns))
+        con.executemany(f'INSERT INTO files VALUES ({",".join("?"*len(_file_columns))})',
+                        rows)
+        con.execute('REPLACE INTO dirs VALUES (?, ?, ?)',
+                    (rel_dir, op.dirname(rel_dir), -1 if _is_racy(mtime_ns) else mtime_ns))
+        return sorted(subdirs)
+
+    def _update_meg(self, con, rel_path):
+        '''Read the res4 header and MarkerFile of a changed dataset'''
+        ds_fname = self._abs(rel_path)
+        signature = _stat_signature([ds_fname, op.join(ds_fname, 'MarkerFile.mrk')])
+        prev = con.execute('SELECT signature FROM meg WHERE path=?', (rel_path,)).fetchone()
+        if (prev is not None) and (signature is not None) and (prev[0] == signature):
+            return False
+        try:
+            info = read_ds_info(ds_fname)
+            counts = json.dumps({str(i):int(j) for i,j in event_counts(ds_fname).items()})
+        except (OSError, ValueError) as e:
+            print(f'Could not read the header of {rel_path}: {str(e)}')
+            info, counts = dict(sfreq=None, duration=None, n_chans=None,
+                                n_trials=None, n_samples=None), None
+        size = sum(i.stat().st_size for i in os.scandir(ds_fname)
+                   if 'meg4' in i.name)
+        con.execute('REPLACE INTO meg VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (rel_path, signature, info['sfreq'], info['duration'],
+                     info['n_chans'], info['n_trials'], info['n_samples'], counts))
+        con.execute('UPDATE files SET size=? WHERE path=?', (size, rel_path))
+        return True
+
+    def _update_freesurfer(self, con, subject):
+        sdir = op.join(self.subjects_dir, subject)
+        signature = _stat_signature([op.join(sdir, 'scripts', 'recon-all.log'),
+                                     op.join(sdir, 'surf')])
+        prev = con.execute('SELECT signature FROM freesurfer WHERE subject=?',
+                           (subject,)).fetchone()
+        if (prev is not None) and (signature is not None) and (prev[0] == signature):
+            return False
+        status = fs_recon_status(self.subjects_dir, subject)
+        con.execute('REPLACE INTO freesurfer VALUES (?, ?, ?, ?, ?, ?)',
+                    (subject, signature, status['fs_success'], status['fs_started'],
+                     status['lhpial'], status['rhpial']))
+        return True
+
+    def refresh(self, subjects=None):
+        '''
+        Update the index.  Only the folders with a changed mtime are listed
+        and only the changed datasets are read.
+
+        Parameters
+        ----------
+        subjects : list, optional
+            Limit the update to these subjects. The default is all subjects.
+
+        Returns
+        -------
+        dict
+            Number of dirs_scanned, datasets_read and freesurfer_read
+
+        '''
+        stats = dict(dirs_scanned=0, datasets_read=0, freesurfer_read=0)
+        full_refresh = subjects is None
+        top, subjects = self._top_dirs(subjects)
+        con = self._connect()
+        with con:
+            old_dirs, children = {}, {}
+            for path, parent, mtime_ns in con.execute('SELECT * FROM dirs'):
+                old_dirs[path] = mtime_ns
+                children.setdefault(parent, []).append(path)
+            seen = set()
+            stack = list(reversed(top))
+            while len(stack) > 0:
+                rel_dir = stack.pop()
+                try:
+                    mtime_ns = os.stat(self._abs(rel_dir)).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                seen.add(rel_dir)
+                if old_dirs.get(rel_dir) == mtime_ns:
+                    subdirs = sorted(children.get(rel_dir, []))
+                else:
+                    subdirs = self._scan_dir(con, rel_dir, mtime_ns)
+                    stats['dirs_scanned'] += 1
+                stack += reversed(subdirs)
+
+            #Remove deleted folders of the refreshed subjects
+            for rel_dir in old_dirs:
+                if (rel_dir in seen) or \
+                    ((not full_refresh) and (_dir_subject(rel_dir) not in subjects)):
+                    continue
+                con.execute('DELETE FROM dirs WHERE path=?', (rel_dir,))
+                con.execute('DELETE FROM files WHERE dir=?', (rel_dir,))
+            con.execute('DELETE FROM meg WHERE path NOT IN (SELECT path FROM files)')
+
+            placeholders = ','.join('?'*len(subjects)) or "''"
+            ds_list = [i[0] for i in con.execute(
+                f"SELECT path FROM files WHERE extension='.ds' AND subject IN ({placeholders})",
+                subjects)]
+            for rel_path in ds_list:
+                stats['datasets_read'] += self._update_meg(con, rel_path)
+            for subject in subjects:
+                stats['freesurfer_read'] += self._update_freesurfer(con, subject)
+            if full_refresh:
+                con.execute(f'DELETE FROM freesurfer WHERE subject NOT IN ({placeholders})',
+                            subjects)
+        con.close()
+        return stats
+
+    # =========================================================================
+    # Queries
+    # =========================================================================
+    def _query(self, sql, params=()):
+        con = self._connect()
+        try:
+            return pd.read_sql_query(sql, con, params=params)
+        finally:
+            con.close()
+
+    def subjects(self):
+        '''Subject folders at the bids root'''
+        dframe = self._query("SELECT path FROM dirs WHERE parent='' "
+                             "AND path LIKE 'sub-%' ORDER BY path")
+        return dframe.path.tolist()
+
+    def sessions(self, subject):
+        '''Session labels of a subject at the bids root'''
+        dframe = self._query("SELECT path FROM dirs WHERE parent=? "
+                             "AND path LIKE ? ORDER BY path",
+                             (subject, op.join(subject, 'ses-%')))
+        return [op.basename(i).split('-', 1)[-1] for i in dframe.path]
+
+    def files(self, root='bids', absolute=True, **entities):
+        '''
+        Indexed files matching the entities
+
+        Parameters
+        ----------
+        root : str, optional
+            "bids" or a derivatives project name. None for all. The default is 'bids'.
+        absolute : bool, optional
+            Return full paths. The default is True.
+        **entities : str | list
+            subject, session, task, run, datatype, suffix, extension
+
+        Returns
+        -------
+        list
+
+        '''
+        conditions, params = [], []
+        if root is not None:
+            entities['root'] = root
+        for key, val in entities.items():
+            if key not in _file_columns:
+                raise ValueError(f'{key} is not an indexed entity')
+            if val is None:
+                continue
+            val = [val] if isinstance(val, str) else list(val)
+            conditions.append(f'{key} IN ({",".join("?"*len(val))})')
+            params += [str(i) for i in val]
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        paths = self._query(f'SELECT path FROM files {where} ORDER BY path',
+                            params).path.tolist()
+        if absolute:
+            paths = [self._abs(i) for i in paths]
+        return paths
+
+    def meg_table(self):
+        '''All MEG datasets with the header info and event counts'''
+        dframe = self._query('SELECT f.path, f.subject, f.session, f.task, f.run, '
+                             'f.size, m.sfreq, m.duration, m.n_chans, m.n_trials, '
+                             'm.n_samples, m.event_counts FROM files f '
+                             'JOIN meg m ON f.path = m.path ORDER BY f.path')
+        dframe['event_counts'] = dframe.event_counts.apply(
+            lambda x: {} if x is None else json.loads(x))
+        return dframe
+
+    def event_counts(self, meg_fname):
+        '''Indexed event counts of a dataset as a dict'''
+        rel_path = op.relpath(op.abspath(meg_fname), self.bids_root)
+        dframe = self._query('SELECT event_counts FROM meg WHERE path=?', (rel_path,))
+        if (len(dframe) == 0) or (dframe.event_counts[0] is None):
+            return None
+        return json.loads(dframe.event_counts[0])
+
+    def fs_recon(self, subject):
+        '''Indexed freesurfer status - same as qa_mri_class.check_fs_recon'''
+        dframe = self._query('SELECT * FROM freesurfer WHERE subject=?', (subject,))
+        if len(dframe) == 0:
+            return None
+        row = dframe.iloc[0]
+        return {key:bool(row[key]) for key in ['fs_success', 'fs_started',
+                                                'lhpial', 'rhpial']}
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Conversion manifest for the MEG BIDS processing.
+
+Records the state of each input dataset (res4/meg4/MarkerFile) and the
+options used for the conversion, so that reruns of make_meg_bids can skip
+runs that have not changed.
+
+@author: jstout
+"""
+
+import os, os.path as op
+import glob
+import json
+import hashlib
+import datetime
+import tempfile
+
+MANIFEST_VERSION = 1.0
+manifest_name = 'nih2mne_conversion_manifest.json'
+_hash_blocksize = 2**20
+
+
+def get_manifest_fname(bids_root):
+    '''Manifest is stored in the code folder of the bids root'''
+    return op.join(bids_root, 'code', manifest_name)
+
+def _file_hash(fname, partial=False):
+    '''
+    SHA1 hash of a file.
+
+    Parameters
+    ----------
+    fname : str
+        File to hash
+    partial : bool, optional
+        Only hash the first and last block of the file.  This is used for the
+        meg4 files, which can be several GB.  The default is False.
+
+    Returns
+    -------
+    str
+        hex digest
+
+    '''
+    sha = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        if partial and (op.getsize(fname) > 2*_hash_blocksize):
+            sha.update(f.read(_hash_blocksize))
+            f.seek(-_hash_blocksize, os.SEEK_END)
+            sha.update(f.read(_hash_blocksize))
+        else:
+            for block in iter(lambda: f.read(_hash_blocksize), b''):
+                sha.update(block)
+    return sha.hexdigest()
+
+def _file_fingerprint(fname, partial=False):
+    '''Size, mtime and hash of a file.  None if the file is missing'''
+    if not op.exists(fname):
+        return None
+    stat = os.stat(fname)
+    return dict(size=stat.st_size,
+                mtime=stat.st_mtime,
+                sha1=_file_hash(fname, partial=partial))
+
+def ds_fingerprint(meg_fname):
+    '''
+    Fingerprint of the files in a CTF dataset that define the conversion
+
+    Parameters
+    ----------
+    meg_fname : str
+        Path to CTF dataset
+
+    Returns
+    -------
+    out_dict : dict
+        {filename : {size, mtime, sha1}} for res4, meg4 (including the
+        continuation files) and MarkerFile
+
+    '''
+    base = op.basename(meg_fname.rstrip('/'))[:-3]
+    out_dict = {}
+    out_dict[base+'.res4'] = _file_fingerprint(op.join(meg_fname, base+'.res4'))
+    meg4_list = sorted(glob.glob(op.join(meg_fname, base+'.*meg4')))
+    for meg4 in meg4_list:
+        out_dict[op.basename(meg4)] = _file_fingerprint(meg4, partial=True)
+    out_dict['MarkerFile.mrk'] = _file_fingerprint(op.join(meg_fname, 'MarkerFile.mrk'))
+    return out_dict
+
+def make_manifest_entry(meg_fname, bids_path, options):
+    '''
+    Assemble the manifest entry for a single run
+
+    Parameters
+    ----------
+    meg_fname : str
+        Input CTF dataset
+    bids_path : mne_bids.BIDSPath
+        Output bids path
+    options : dict
+        Conversion options.  File paths (eg eventID_csv) should be provided
+        by the calling function with a hash so that changes are tracked.
+
+    Returns
+    -------
+    dict
+
+    '''
+    if bids_path.datatype is None:
+        # fpath cannot be resolved before writing unless the datatype is set
+        bids_path = bids_path.copy().update(datatype='meg')
+    return dict(inputs=ds_fingerprint(meg_fname),
+                options=options,
+                output=str(bids_path.fpath))
+
+def load_manifest(bids_root):
+    '''Load the manifest - returns an empty manifest if not present'''
+    manifest_fname = get_manifest_fname(bids_root)
+    if not op.exists(manifest_fname):
+        return dict(version=MANIFEST_VERSION, runs={})
+    with open(manifest_fname) as f:
+        manifest = json.load(f)
+    return manifest
+
+def is_converted(bids_root, meg_fname, entry):
+    '''
+    Check if the run has been converted with the same inputs and options
+
+    Parameters
+    ----------
+    bids_root : str
+        Top level of the bids directory
+    meg_fname : str
+        Input CTF dataset
+    entry : dict
+        Current state from make_manifest_entry
+
+    Returns
+    -------
+    bool
+
+    '''
+    prev_entry = load_manifest(bids_root)['runs'].get(op.abspath(meg_fname))
+    if prev_entry is None:
+        return False
+    for key in ['inputs', 'options', 'output']:
+        if prev_entry.get(key) != entry[key]:
+            return False
+    return op.exists(entry['output'])
+
+def update_manifest(bids_root, meg_fname, entry):
+    '''
+    Add/replace the run entry in the manifest.  The file is written to a temp
+    file and moved into place so that a crash does not leave a partial
+    manifest.  This is a read-modify-write and must be guarded by a lock when
+    run in parallel.
+
+    Parameters
+    ----------
+    bids_root : str
+        Top level of the bids directory
+    meg_fname : str
+        Input CTF dataset
+    entry : dict
+        Output of make_manifest_entry
+
+    Returns
+    -------
+    None.
+
+    '''
+    manifest = load_manifest(bids_root)
+    entry = dict(entry, converted=datetime.datetime.now().isoformat(timespec='seconds'))
+    manifest['runs'][op.abspath(meg_fname)] = entry
+    manifest_fname = get_manifest_fname(bids_root)
+    os.makedirs(op.dirname(manifest_fname), exist_ok=True)
+    fd, tmp_fname = tempfile.mkstemp(dir=op.dirname(manifest_fname), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_fname, manifest_fname)
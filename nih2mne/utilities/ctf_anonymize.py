@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Anonymize and/or crop a CTF dataset without the CTF tools (newDs).
+
+A staged copy of the dataset is created:
+    res4 - identifying GenRes strings and the run description are cleared
+           sample/trial counts are updated if cropped
+    infods - identifying CPersist string entries are cleared
+    meg4 - linked (reflink/hardlink/copy) if unchanged, otherwise the kept
+           data is streamed from the input in a single pass
+    hist/acq - not copied (free text history / redundant acquisition info)
+    other text files are copied and then scrubbed by anonymize_finalize
+
+@author: jstout
+"""
+
+import os, os.path as op
+import glob
+import shutil
+import numpy as np
+from struct import Struct
+from pyctf.ctf_res4 import (read_res4_structs, write_res4_structs, gr_runName,
+                            gr_runTitle, gr_collectDesc, gr_subjectId,
+                            gr_operator, gr_dataDesc, gr_rdlen, gr_numSamples,
+                            gr_numChannels, gr_numTrials, gr_sampleRate,
+                            gr_epochTime)
+from nih2mne.utilities.fast_copy import link_or_copy
+from nih2mne.utilities.data_crop_wrapper import get_term_time
+from nih2mne.utilities.ctf_reader import list_meg4, meg4_memmaps
+
+res4_scrub_fields = [gr_runName, gr_runTitle, gr_collectDesc, gr_subjectId,
+                     gr_operator, gr_dataDesc]
+# Any infods string entry containing these will be cleared
+infods_scrub_tags = ['PATIENT', 'SUBJECT', 'OPERATOR', 'NAME', 'UID',
+                     'ACCESSION', 'COMMENT', 'TITLE', 'BIRTH']
+default_include_list = ['BadChannels', 'ClassFile.cls', 'MarkerFile.mrk',
+                        'params.dsc', 'processing.cfg', '*.hc', '*.res4',
+                        '*.meg4', '*.infods']
+
+def anonymize_res4(res4_in, res4_out):
+    '''
+    Write a copy of the res4 with the identifying text fields cleared.
+    Date and time of acquisition are preserved.
+
+    Parameters
+    ----------
+    res4_in : str
+        Input res4 filename
+    res4_out : str
+        Output res4 filename
+
+    Returns
+    -------
+    None.
+
+    '''
+    r = read_res4_structs(res4_in)
+    _anonymize_res4_structs(r)
+    write_res4_structs(res4_out, r)
+
+def _anonymize_res4_structs(r):
+    '''Clear the identifying fields of a res4data container in place'''
+    genRes = list(r.genRes)
+    for idx in res4_scrub_fields:
+        genRes[idx] = b''
+    r.runDesc = b''
+    genRes[gr_rdlen] = len(r.runDesc) + 1  #Null terminated
+    r.genRes = genRes
+
+# =============================================================================
+# CPersist (infods) rewriting
+# Mirrors pyctf.CPersist.getCPersist, but copies the bytes to the output
+# =============================================================================
+CPERSISTHDR = b"WS1_"
+_be_int = Struct(">i")
+_fixed_size = {4:8, 5:4, 6:2, 7:2, 8:1, 14:4, 15:4, 16:4}
+
+def _copy_bytes(fin, fout, n):
+    val = fin.read(n)
+    if len(val) != n:
+        raise ValueError('Unexpected end of CPersist file')
+    fout.write(val)
+    return val
+
+def _copy_int(fin, fout):
+    return _be_int.unpack(_copy_bytes(fin, fout, 4))[0]
+
+def _copy_str(fin, fout):
+    count = _copy_int(fin, fout)
+    return _copy_bytes(fin, fout, count)
+
+def _scrub_tag(tag):
+    return any(i in tag.upper() for i in infods_scrub_tags)
+
+def _copy_cpersist(fin, fout):
+    if _copy_bytes(fin, fout, 4) != CPERSISTHDR:
+        raise ValueError('improper CPersist file')
+    while True:
+        tag = _copy_str(fin, fout).decode()
+        if tag == 'EndOfParameters':
+            return
+        tagtype = _copy_int(fin, fout)
+        value = None
+        if tagtype == 1:
+            if tag == 'DataManagerStart':
+                pass
+            elif tag == 'DatasetFiles':
+                _copy_int(fin, fout)
+                _copy_str(fin, fout)
+                _copy_bytes(fin, fout, 2)
+            elif tag == 'DisplaySets':
+                for i in range(_copy_int(fin, fout)):
+                    _copy_cpersist(fin, fout)
+                _copy_int(fin, fout)
+            else:
+                _copy_cpersist(fin, fout)
+        elif tagtype == 2:
+            _copy_cpersist(fin, fout)
+        elif tagtype == 3:
+            _copy_str(fin, fout)
+        elif tagtype == 10:
+            count = _be_int.unpack(fin.read(4))[0]
+            value = fin.read(count)
+            if _scrub_tag(tag):
+                value = b''
+            fout.write(_be_int.pack(len(value)) + value)
+        elif tagtype == 11:
+            for i in range(_copy_int(fin, fout)):
+                _copy_str(fin, fout)
+        elif tagtype in _fixed_size:
+            value = _copy_bytes(fin, fout, _fixed_size[tagtype])
+        else:
+            raise ValueError(f'Unhandled CPersist tag type {tagtype}: {tag}')
+        if tag == '_eeg_info':
+            for i in range(_be_int.unpack(value)[0]):
+                _copy_cpersist(fin, fout)
+
+def anonymize_infods(infods_in, infods_out):
+    '''
+    Write a copy of the infods file with the identifying string entries
+    cleared.
+
+    Parameters
+    ----------
+    infods_in : str
+        Input infods filename
+    infods_out : str
+        Output infods filename
+
+    Returns
+    -------
+    None.
+
+    '''
+    with open(infods_in, 'rb') as fin, open(infods_out, 'wb') as fout:
+        _copy_cpersist(fin, fout)
+        #Copy anything trailing the parameters block
+        shutil.copyfileobj(fin, fout)
+
+def anonymize_ds(meg_fname, tmpdir, include_list=default_include_list):
+    '''
+    Create an anonymized copy of the dataset in tmpdir.  The meg4 data is
+    linked to the input when possible.  MarkerFile/ClassFile paths still
+    need to be scrubbed (make_meg_bids.anonymize_finalize).
+
+    Parameters
+    ----------
+    meg_fname : str
+        Input CTF dataset
+    tmpdir : str
+        Output directory.  The dataset keeps the same basename
+    include_list : list, optional
+        Files to copy (glob patterns allowed).
+
+    Returns
+    -------
+    out_fname : str
+        Anonymized dataset path
+
+    '''
+    return crop_anonymize_ds(meg_fname, tmpdir, anonymize=True, 
+                             crop_trailing_zeros=False, 
+                             include_list=include_list)
+
+def crop_anonymize_ds(meg_fname, tmpdir, anonymize=False, 
+                      crop_trailing_zeros=False, 
+                      include_list=default_include_list, channel_idx=100,
+                      link_unchanged=False):
+    '''
+    Write a cropped and/or anonymized copy of the dataset in one pass.  
+    
+    Cropping finds the run termination (20 consecutive zeros - see 
+    data_crop_wrapper.get_term_time) on channel_idx.  Single trial (continuous)
+    datasets are cropped to the termination sample.  Trial based datasets 
+    keep all trials up to and including the trial with the termination.
+    Unchanged meg4 files are reflinked/copied, or hardlinked to the input with 
+    link_unchanged.
+
+    Parameters
+    ----------
+    meg_fname : str
+        Input CTF dataset
+    tmpdir : str
+        Output directory.  The dataset keeps the same basename
+    anonymize : bool, optional
+        Clear the identifying header info. The default is False.
+    crop_trailing_zeros : bool, optional
+        Crop the zeros at the end of a terminated run. The default is False.
+    include_list : list, optional
+        Files to copy if anonymizing.  All files except hist/acq are copied 
+        if not anonymizing.
+    channel_idx : int, optional
+        Channel used to find the termination. The default is 100.
+    link_unchanged : bool, optional
+        Allow hardlinks of the unchanged meg4 files to the input (see 
+        fast_copy.link_or_copy).  Hardlinks share the data with the source 
+        dataset.  Otherwise the files are reflinked or copied (copy_file_range).
+        The default is False.
+
+    Returns
+    -------
+    out_fname : str
+        Output dataset path
+
+    '''
+    meg_fname = str(meg_fname).rstrip('/')
+    base = op.basename(meg_fname)[:-3]
+    out_fname = op.join(tmpdir, op.basename(meg_fname))
+    if op.exists(out_fname): shutil.rmtree(out_fname)
+    os.makedirs(out_fname)
+    
+    r = read_res4_structs(op.join(meg_fname, base+'.res4'))
+    genRes = list(r.genRes)
+    n_trials = genRes[gr_numTrials]
+    n_chans = genRes[gr_numChannels]
+    n_samples = genRes[gr_numSamples]
+    sfreq = genRes[gr_sampleRate]
+    meg4_list = list_meg4(meg_fname)
+    mmaps = meg4_memmaps(meg4_list, n_chans, n_samples)
+    
+    keep_trials, keep_samples = n_trials, n_samples
+    if crop_trailing_zeros:
+        ch_idx = min(channel_idx, n_chans - 1)
+        data = np.concatenate([mm[:, ch_idx, :].ravel() for mm in mmaps])
+        idx_crop, crop_time = get_term_time(data, sfreq)
+        if crop_time != False:
+            if n_trials == 1:
+                keep_samples = int(idx_crop)
+            else:
+                keep_trials = int(np.ceil(idx_crop / n_samples))
+    genRes[gr_numSamples] = keep_samples
+    genRes[gr_numTrials] = keep_trials
+    genRes[gr_epochTime] = keep_samples * keep_trials / sfreq
+    r.genRes = genRes
+    if anonymize:
+        _anonymize_res4_structs(r)
+    write_res4_structs(op.join(out_fname, base+'.res4'), r)
+    
+    #Stream the kept data - trials are not split across meg4 files
+    trial_offset = 0
+    for meg4, mm in zip(meg4_list, mmaps):
+        out_meg4 = op.join(out_fname, op.basename(meg4))
+        file_trials = min(mm.shape[0], keep_trials - trial_offset)
+        trial_offset += mm.shape[0]
+        if file_trials <= 0:
+            break
+        if (file_trials == mm.shape[0]) and (keep_samples == n_samples):
+            link_or_copy(meg4, out_meg4, hardlink=link_unchanged)
+            continue
+        with open(out_meg4, 'wb') as f:
+            f.write(b"MEG41CP\x00")
+            for trial in range(file_trials):
+                for chan in range(n_chans):
+                    f.write(mm[trial, chan, :keep_samples].tobytes())
+    del mmaps
+    
+    #Copy the remaining files
+    if anonymize:
+        fname_list = []
+        for pattern in include_list:
+            fname_list.extend(glob.glob(op.join(meg_fname, pattern)))
+    else:
+        fname_list = glob.glob(op.join(meg_fname, '*'))
+    for fname in sorted(set(fname_list)):
+        if fname.endswith(('.res4', 'meg4', '.hist', '.acq')):
+            continue
+        out_file = op.join(out_fname, op.basename(fname))
+        if anonymize and fname.endswith('.infods'):
+            try:
+                anonymize_infods(fname, out_file)
+            except ValueError:
+                #Cannot verify the contents - do not include
+                if op.exists(out_file): os.remove(out_file)
+                print(f'Could not parse {fname}: it will not be included')
+        elif op.isdir(fname):
+            shutil.copytree(fname, out_file)
+        else:
+            shutil.copy(fname, out_file)
+    return out_fname
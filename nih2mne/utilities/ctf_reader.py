@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memory mapped reader for CTF datasets.
+
+The .meg4 (and continuation .1_meg4, .2_meg4 ...) files are mapped as big
+endian int32 arrays (trial, channel, sample) using the res4 geometry.  Indexing
+only reads the requested channels/samples from disk and the gains are applied
+to the selection.  This avoids loading the full dataset to inspect a few
+channels (trigger/ADC channels, termination checks).
+
+    ds = Meg4Reader('subj_task_20010101_001.ds')
+    ds[0, 'UADC001', :]          # trial 0 of UADC001 (scaled)
+    ds.get_continuous(['UPPT001'])  # trials concatenated in time
+    ds.raw_view(0)               # zero copy int32 (channel, sample) view
+    trig = ds.read_channels(['UADC001','UPPT001'])  # single pass subset
+
+A subset of the pyctf.dsopen interface is provided so that it can be used
+in place of pyctf.dsopen in the trigger code.
+
+@author: jstout
+"""
+
+import os.path as op
+import numpy as np
+from pyctf.ctf_res4 import (read_res4_structs, fmtChanName, gr_numSamples,
+                            gr_numChannels, gr_numTrials, gr_sampleRate,
+                            gr_preTrig, sr_type, sr_properGain, sr_qGain,
+                            sr_ioGain)
+
+MEG4HDR = b"MEG41CP\x00"
+
+def list_meg4(meg_fname):
+    '''meg4 + continuation files in order (.meg4, .1_meg4, .2_meg4 ...)'''
+    meg_fname = str(meg_fname).rstrip('/')
+    base = op.join(meg_fname, op.basename(meg_fname)[:-3])
+    meg4_list = [base+'.meg4']
+    while op.exists(f'{base}.{len(meg4_list)}_meg4'):
+        meg4_list.append(f'{base}.{len(meg4_list)}_meg4')
+    return meg4_list
+
+def meg4_memmaps(meg4_list, n_chans, n_samples):
+    '''Memmap each meg4 file as big endian int32 (trial, channel, sample)'''
+    mmaps = []
+    for meg4 in meg4_list:
+        n_trials = (op.getsize(meg4) - len(MEG4HDR)) // (4 * n_chans * n_samples)
+        mmaps.append(np.memmap(meg4, dtype='>i4', mode='r', offset=len(MEG4HDR),
+                               shape=(n_trials, n_chans, n_samples)))
+    return mmaps
+
+class Meg4Reader():
+    def __init__(self, dsname):
+        '''
+        Memory mapped CTF dataset
+
+        Parameters
+        ----------
+        dsname : str
+            Path to CTF dataset
+
+        '''
+        dsname = str(dsname).rstrip('/')
+        if not dsname.endswith('.ds'):
+            raise ValueError(f'{dsname} is not a dataset name')
+        self.dsname = dsname
+        self.r = read_res4_structs(op.join(dsname, op.basename(dsname)[:-3]+'.res4'))
+        genRes = self.r.genRes
+        self.n_chans = genRes[gr_numChannels]
+        self.n_samples = genRes[gr_numSamples]
+        self.n_trials = genRes[gr_numTrials]
+        self.sfreq = genRes[gr_sampleRate]
+        self.pretrig = genRes[gr_preTrig]
+        self.ch_names = [fmtChanName(i) for i in self.r.chanName]
+        self.channel = {name:idx for idx,name in enumerate(self.ch_names)}
+        self.ch_types = [i[0][sr_type] for i in self.r.sensRes]
+        sr = [i[0] for i in self.r.sensRes]
+        self.gains = np.array([1. / (i[sr_properGain] * i[sr_qGain] * i[sr_ioGain])
+                               for i in sr])
+
+        self._mmaps = meg4_memmaps(list_meg4(dsname), self.n_chans, self.n_samples)
+        # (file, trial within file) for each trial
+        self._trial_map = [(file_idx, trial) for file_idx, mm in enumerate(self._mmaps)
+                           for trial in range(mm.shape[0])]
+        if len(self._trial_map) < self.n_trials:
+            raise ValueError(f'meg4 data is shorter than the res4 trial count: {dsname}')
+        self._trial_map = self._trial_map[:self.n_trials]
+
+    @property
+    def shape(self):
+        return (self.n_trials, self.n_chans, self.n_samples)
+
+    def pick(self, ch):
+        '''Convert channel name(s)/index(es) to an index or index array'''
+        if isinstance(ch, slice):
+            return np.arange(self.n_chans)[ch]
+        if isinstance(ch, (str, np.str_)):
+            return self.channel[ch]
+        if np.ndim(ch) == 0:
+            return int(ch)
+        return np.array([self.pick(i) for i in ch], dtype=int)
+
+    def raw_view(self, trial):
+        '''Zero copy big endian int32 (channel, sample) view of a trial'''
+        file_idx, file_trial = self._trial_map[trial]
+        return self._mmaps[file_idx][file_trial]
+
+    def get_raw(self, trial, ch, samples=slice(None)):
+        '''
+        Unscaled int32 data.  Only the requested channels/samples are read.
+
+        Parameters
+        ----------
+        trial : int | slice | list
+        ch : int | str | list | slice
+            Channel index(es) or name(s)
+        samples : slice, optional
+            Sample selection. The default is all samples.
+
+        Returns
+        -------
+        np.ndarray (native int32)
+            Dimensions follow numpy indexing: (trial, channel, sample) with
+            integer selections removed
+
+        '''
+        ch_idx = self.pick(ch)
+        if np.ndim(trial) == 0 and not isinstance(trial, slice):
+            out = self.raw_view(trial)[ch_idx, samples]
+        else:
+            trials = np.arange(self.n_trials)[trial]
+            out = np.stack([self.raw_view(i)[ch_idx, samples] for i in trials])
+        return out.astype(np.int32)
+
+    def __getitem__(self, key):
+        '''ds[trial, ch, samples] - scaled data for the selection'''
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (3 - len(key))
+        trial, ch, samples = key
+        raw = self.get_raw(trial, ch, samples)
+        gain = self.gains[self.pick(ch)]
+        if (np.ndim(gain) == 1) and (np.ndim(samples) == 0) and not isinstance(samples, slice):
+            return raw * gain
+        if np.ndim(gain) == 1:
+            gain = gain[:, np.newaxis]
+        return raw * gain
+
+    def read_channels(self, ch):
+        '''
+        Read a set of channels into memory in a single pass over the meg4 
+        files.  Only the selected channel rows of each trial are read.
+
+        Parameters
+        ----------
+        ch : list
+            Channel indices or names
+
+        Returns
+        -------
+        ChannelSubset
+            Same interface as the reader, restricted to the channels
+
+        '''
+        ch_idx = np.unique(np.atleast_1d(self.pick(ch)))
+        data = np.empty((self.n_trials, len(ch_idx), self.n_samples), dtype=np.int32)
+        for trial in range(self.n_trials):
+            data[trial] = self.raw_view(trial)[ch_idx]
+        return ChannelSubset(self, data, ch_idx)
+
+    def get_continuous(self, ch, start=0, stop=None):
+        '''
+        Channel data with the trials concatenated in time
+
+        Parameters
+        ----------
+        ch : int | str | list
+            Channel index(es) or name(s)
+        start : int, optional
+            First sample (of the concatenated data). The default is 0.
+        stop : int, optional
+            Stop sample (exclusive). The default is None (end of data).
+
+        Returns
+        -------
+        np.ndarray
+            (n_samples,) for a single channel or (n_chans, n_samples)
+
+        '''
+        n_total = self.n_trials * self.n_samples
+        start, stop, _ = slice(start, stop).indices(n_total)
+        segments = []
+        for trial in range(start // self.n_samples,
+                           -(-stop // self.n_samples) if stop > start else 0):
+            t0 = max(start - trial*self.n_samples, 0)
+            t1 = min(stop - trial*self.n_samples, self.n_samples)
+            segments.append(self[trial, ch, t0:t1])
+        if len(segments) == 0:
+            return self[0, ch, 0:0]
+        return np.concatenate(segments, axis=-1)
+
+    # =========================================================================
+    # pyctf.dsopen compatible subset
+    # =========================================================================
+    def getSampleRate(self):
+        return self.sfreq
+
+    def getNumberOfTrials(self):
+        return self.n_trials
+
+    def getNumberOfSamples(self):
+        return self.n_samples
+
+    def getNumberOfChannels(self):
+        return self.n_chans
+
+    def getChannelIndex(self, name):
+        return self.channel[name]
+
+    def getTimePt(self, samp):
+        return float(np.squeeze(samp) - self.pretrig) / self.sfreq
+
+    def getDsRawData(self, tr, ch):
+        return self[tr, ch, :]
+
+    def getDsData(self, tr, ch):
+        tmp = self[tr, ch, :]
+        return tmp - tmp.mean()
+
+
+class ChannelSubset(Meg4Reader):
+    def __init__(self, reader, data, ch_idx):
+        '''
+        In memory copy of a subset of channels - see Meg4Reader.read_channels
+
+        Parameters
+        ----------
+        reader : Meg4Reader
+        data : np.ndarray
+            int32 (trial, channel, sample)
+        ch_idx : np.ndarray
+            Channel indices of the data in the dataset
+
+        '''
+        self.dsname = reader.dsname
+        self.r = reader.r
+        self.n_trials, self.n_chans, self.n_samples = data.shape
+        self.sfreq = reader.sfreq
+        self.pretrig = reader.pretrig
+        self.ch_names = [reader.ch_names[i] for i in ch_idx]
+        self.channel = {name:idx for idx,name in enumerate(self.ch_names)}
+        self.ch_types = [reader.ch_types[i] for i in ch_idx]
+        self.gains = reader.gains[ch_idx]
+        self.data = data
+
+    def raw_view(self, trial):
+        return self.data[trial]
@@ -51,11 +51,12 @@ def return_cropped_ds(fname):
     '''
     assert fname.endswith('.ds')
     install_check()
-    raw = mne.io.read_raw_ctf(fname, system_clock='ignore', preload=True)
+    from nih2mne.utilities.ctf_reader import Meg4Reader
+    ds = Meg4Reader(fname)
 
     channel_idx = 100
-    data = raw._data[channel_idx]
-    _, crop_time = get_term_time(data, raw.info['sfreq'])
+    data = ds.get_continuous(channel_idx)
+    _, crop_time = get_term_time(data, ds.sfreq)
     if crop_time == False:
         return fname
         # raise RuntimeError('Could not find a terminated timepoint')
@@ -8,10 +8,23 @@ Created on Thu Oct 19 16:47:59 2023
 import datetime
 import os, os.path as op
 import glob
-import subprocess
 import copy
+import json
+import bisect
+import shutil
+import tempfile
+import tarfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from nih2mne.utilities.user_cache import get_user_cache_dir
 
-def compile_erooms(eroom_location='/data/MEGmodules/extras/EmptyRoom'):
+default_eroom_location = '/data/MEGmodules/extras/EmptyRoom'
+# Local cache of the date index and extracted emptyroom datasets is in the
+# user cache folder.  Override with the eroom_cache_dir environment variable
+default_cache_max_gb = 20
+_index_name = 'eroom_index.json'
+
+def compile_erooms(eroom_location=default_eroom_location):
     '''Simple list of files in the eroom_location folder and converts these
     to datetime objects'''
     eroom_list = glob.glob(op.join(eroom_location, '*.tgz'))
@@ -38,6 +51,76 @@ def convert_meg_datetime(meg_fname):
     i=meg_fname.split('_')[2]
     return datetime.datetime(int(i[0:4]), int(i[4:6]), int(i[6:8]))
 
+def _get_cache_dir(cache_dir=None):
+    if cache_dir is None:
+        cache_dir = get_user_cache_dir('eroom_cache', env_var='eroom_cache_dir')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def _write_json_atomic(fname, data):
+    fd, tmp_fname = tempfile.mkstemp(dir=op.dirname(fname), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_fname, fname)
+
+def load_eroom_index(eroom_location=default_eroom_location, cache_dir=None):
+    '''
+    Sorted (date, filename) index of the emptyroom repository.  The index is
+    stored in the cache_dir and only rebuilt when the modification time of
+    the eroom_location folder changes (files added/removed).
+
+    Parameters
+    ----------
+    eroom_location : str, optional
+        Emptyroom repository. The default is default_eroom_location.
+    cache_dir : str, optional
+        Cache folder. The default is the user cache folder.
+
+    Returns
+    -------
+    dates : list of datetime.datetime
+        Sorted emptyroom dates
+    fnames : list of str
+        Emptyroom tgz files matching dates
+
+    '''
+    eroom_location = op.abspath(eroom_location)
+    index_fname = op.join(_get_cache_dir(cache_dir), _index_name)
+    dir_mtime = os.stat(eroom_location).st_mtime
+    index = {}
+    if op.exists(index_fname):
+        try:
+            with open(index_fname) as f:
+                index = json.load(f)
+        except ValueError:
+            index = {}
+    entry = index.get(eroom_location)
+    if (entry is None) or (entry['mtime'] != dir_mtime):
+        eroom_list = glob.glob(op.join(eroom_location, '*.tgz'))
+        pairs = sorted((convert_meg_datetime(i).isoformat(), i) for i in eroom_list)
+        entry = dict(mtime=dir_mtime, erooms=pairs)
+        index[eroom_location] = entry
+        _write_json_atomic(index_fname, index)
+    dates = [datetime.datetime.fromisoformat(i) for i,j in entry['erooms']]
+    fnames = [j for i,j in entry['erooms']]
+    return dates, fnames
+
+def _closest_indices(dates, megdate, n_closest=2):
+    '''Indices of the n closest dates (sorted list) - closest first'''
+    right = bisect.bisect_left(dates, megdate)
+    left = right - 1
+    out = []
+    while (len(out) < n_closest) and ((left >= 0) or (right < len(dates))):
+        if right >= len(dates):
+            out.append(left); left -= 1
+        elif left < 0:
+            out.append(right); right += 1
+        elif (megdate - dates[left]) <= (dates[right] - megdate):
+            out.append(left); left -= 1
+        else:
+            out.append(right); right += 1
+    return out
+
 def get_closest_eroom(meg_fname, eroom_dict=None, eroom_location=None, 
                       failover=False):
     '''
@@ -64,24 +147,219 @@ def get_closest_eroom(meg_fname, eroom_dict=None, eroom_location=None,
     if eroom_dict==None:
         if (eroom_location==None) and ('eroom_location' in os.environ):
             eroom_location=os.environ['eroom_location']
-            eroom_dict = compile_erooms(eroom_location)
         elif(eroom_location==None) and ('eroom_location' not in os.environ):
-            eroom_dict = compile_erooms()
-        else:
-            eroom_dict = compile_erooms(eroom_location)
-    assert len(eroom_dict) > 0
+            eroom_location=default_eroom_location
+        dates, fnames = load_eroom_index(eroom_location)
+    else:
+        dates = sorted(eroom_dict.keys())
+        fnames = [eroom_dict[i] for i in dates]
+    assert len(dates) > 0
     megdate = convert_meg_datetime(meg_fname)
-    res = min(eroom_dict.keys(), key=lambda curr: abs(curr - megdate))
+    idxs = _closest_indices(dates, megdate, n_closest=2)
     if failover==True:
-        eroom_dict.pop(res)
-        res = min(eroom_dict.keys(), key=lambda curr: abs(curr - megdate))
-    closest_eroom = eroom_dict[res]
-    return closest_eroom
+        assert len(idxs) > 1, 'No failover emptyroom available'
+        return fnames[idxs[1]]
+    return fnames[idxs[0]]
+
+def _check_member_name(name):
+    '''Prevent writing outside of the output folder'''
+    parts = op.normpath(name).split(os.sep)
+    if op.isabs(name) or ('..' in parts):
+        raise ValueError(f'Unsafe path in emptyroom archive: {name}')
+
+def _validate_eroom_ds(ds_fname):
+    '''Check that the res4 is readable and the meg4 data matches its size'''
+    from pyctf.ctf_res4 import (read_res4_structs, gr_numSamples, 
+                                gr_numChannels, gr_numTrials)
+    base = op.join(ds_fname, op.basename(ds_fname)[:-3])
+    if not op.exists(base+'.res4'):
+        raise ValueError(f'No res4 file in {ds_fname}')
+    meg4_list = glob.glob(base+'.*meg4')
+    if len(meg4_list)==0:
+        raise ValueError(f'No meg4 file in {ds_fname}')
+    genRes = read_res4_structs(base+'.res4').genRes
+    expected = 4*genRes[gr_numSamples]*genRes[gr_numChannels]*genRes[gr_numTrials]
+    data_size = sum(op.getsize(i) - 8 for i in meg4_list)
+    if data_size != expected:
+        raise ValueError(f'meg4 data size ({data_size}) does not match the res4 ({expected}): {ds_fname}')
 
 def pull_eroom(eroom_fname, tmpdir=None):
-    cmd=f'tar -xf {eroom_fname} -C {tmpdir}'
-    subprocess.run(cmd.split(), check=True)
+    '''
+    Extract the emptyroom dataset from the archive.  The archive is read as a
+    stream and only the members of the dataset folder (same basename as the 
+    tgz) are written.  Member sizes are checked as they are written and the
+    res4/meg4 are validated at the end.  On failure the partial dataset is 
+    removed and a ValueError is raised.
+
+    Parameters
+    ----------
+    eroom_fname : str
+        Emptyroom tgz file
+    tmpdir : str
+        Output folder
+
+    Returns
+    -------
+    er_fname : str
+        Extracted emptyroom dataset
 
+    '''
+    ds_name = op.basename(eroom_fname).replace('.tgz','.ds')
+    er_fname = op.join(tmpdir, ds_name)
+    try:
+        with tarfile.open(eroom_fname, mode='r|gz') as tar:
+            for member in tar:
+                name = member.name.lstrip('./')
+                if not (name == ds_name or name.startswith(ds_name+'/')):
+                    continue
+                _check_member_name(name)
+                out_name = op.join(tmpdir, name)
+                if member.isdir():
+                    os.makedirs(out_name, exist_ok=True)
+                elif member.isfile():
+                    os.makedirs(op.dirname(out_name), exist_ok=True)
+                    with tar.extractfile(member) as fsrc, open(out_name, 'wb') as fdst:
+                        shutil.copyfileobj(fsrc, fdst, 2**20)
+                        n_written = fdst.tell()
+                    if n_written != member.size:
+                        raise ValueError(f'Truncated member {name} in {eroom_fname}')
+        if not op.exists(er_fname):
+            raise ValueError(f'{ds_name} not found in {eroom_fname}')
+        _validate_eroom_ds(er_fname)
+    except (tarfile.TarError, EOFError, zlib.error, ValueError) as e:
+        if op.exists(er_fname): shutil.rmtree(er_fname, ignore_errors=True)
+        raise ValueError(f'Could not extract {eroom_fname}: {e}') from e
+    return er_fname
+
+def _dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        total += sum(op.getsize(op.join(root, i)) for i in files)
+    return total
+
+def _evict_cache(cache_dir, max_gb=default_cache_max_gb, keep=None):
+    '''Remove the least recently used extractions until under max_gb'''
+    entries = [op.join(cache_dir, i) for i in os.listdir(cache_dir)]
+    entries = [i for i in entries if op.isdir(i) and not op.basename(i).startswith('.')]
+    sizes, mtimes = {}, {}
+    for entry in entries:
+        try:
+            mtimes[entry] = os.stat(entry).st_mtime
+            sizes[entry] = _dir_size(entry)
+        except FileNotFoundError:
+            #Removed by a concurrent process
+            sizes[entry] = 0
+            mtimes[entry] = 0
+    total = sum(sizes.values())
+    for entry in sorted(entries, key=lambda x: mtimes[x]):
+        if total <= max_gb * 1e9:
+            break
+        if entry == keep:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= sizes[entry]
+
+def pull_eroom_cached(eroom_fname, cache_dir=None, 
+                      max_gb=default_cache_max_gb):
+    '''
+    Extract the emptyroom archive into the local cache and return the dataset.
+    Subsequent requests for the same archive reuse the extraction.  The least
+    recently used extractions are removed when the cache exceeds max_gb.
+
+    Parameters
+    ----------
+    eroom_fname : str
+        Emptyroom tgz file
+    cache_dir : str, optional
+        Cache folder. The default is the user cache folder.
+    max_gb : float, optional
+        Size limit of the cache. The default is default_cache_max_gb.
+
+    Returns
+    -------
+    er_fname : str
+        Path to the extracted emptyroom dataset.  A ValueError is raised if 
+        the archive does not contain a valid dataset (see pull_eroom).
+
+    '''
+    cache_dir = _get_cache_dir(cache_dir)
+    base = op.basename(eroom_fname).replace('.tgz','')
+    entry = op.join(cache_dir, base)
+    er_fname = op.join(entry, base+'.ds')
+    if not op.exists(er_fname):
+        # Extract to a staging folder and move into place - concurrent pulls
+        # of the same archive keep the first completed extraction
+        staging = tempfile.mkdtemp(dir=cache_dir, prefix='.staging_')
+        try:
+            pull_eroom(eroom_fname, tmpdir=staging)
+            if op.exists(entry) and not op.exists(er_fname): 
+                shutil.rmtree(entry, ignore_errors=True)
+            try:
+                os.rename(staging, entry)
+            except OSError:
+                pass
+        finally:
+            if op.exists(staging): shutil.rmtree(staging, ignore_errors=True)
+    os.utime(entry) #Mark as recently used
+    _evict_cache(cache_dir, max_gb=max_gb, keep=entry)
+    return er_fname
 
+def fetch_eroom(meg_fname, eroom_location=None, tmpdir=None, cache_dir=None,
+                prefetch_failover=False):
+    '''
+    Extract the closest emptyroom to the meg dataset.  If the closest archive 
+    fails validation, the next closest (failover) is used.
+
+    Parameters
+    ----------
+    meg_fname : str
+        CTF dataset name - expects date in the name.
+    eroom_location : str, optional
+        Emptyroom repository.  See get_closest_eroom
+    tmpdir : str, optional
+        Extract into this folder.  The default is None, which uses the 
+        emptyroom cache (pull_eroom_cached).
+    cache_dir : str, optional
+        Cache folder. The default is the user cache folder.
+    prefetch_failover : bool, optional
+        Extract the failover archive in parallel with the closest archive.  
+        This removes the serial wait on a failed extraction at the cost of an 
+        extra extraction.  Both extractions have finished when the function 
+        returns. The default is False.
+
+    Returns
+    -------
+    er_fname : str
+        Extracted emptyroom dataset
+
+    '''
+    candidates = [get_closest_eroom(meg_fname, eroom_location=eroom_location)]
+    try:
+        candidates.append(get_closest_eroom(meg_fname, eroom_location=eroom_location, 
+                                            failover=True))
+    except AssertionError:
+        pass
+    
+    if tmpdir is None:
+        def _pull(eroom_fname):
+            return pull_eroom_cached(eroom_fname, cache_dir=cache_dir)
+    else:
+        def _pull(eroom_fname):
+            return pull_eroom(eroom_fname, tmpdir=tmpdir)
     
+    def _first_valid(pulls):
+        errors = []
+        for pull in pulls:
+            try:
+                return pull()
+            except ValueError as e:
+                errors.append(str(e))
+        raise ValueError('No valid emptyroom could be extracted: ' + '; '.join(errors))
     
+    if not prefetch_failover:
+        return _first_valid([lambda i=i: _pull(i) for i in candidates])
+    #The executor is joined on exit - the failover extraction is not left 
+    #running in the background after returning
+    with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+        futures = [executor.submit(_pull, i) for i in candidates]
+        return _first_valid([i.result for i in futures])
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Header-only event access for CTF datasets and BIDS runs.
+
+The events are read from the MarkerFile.mrk (and bad.segments) of a .ds and
+only the fixed size res4 header is read for the sample rate and trial
+geometry.  BIDS runs without a MarkerFile use the *_events.tsv.  The
+annotations and counts are the same as mne.io.read_raw_ctf(...).annotations
+without parsing the channel records or opening the meg4 data.
+
+    annot = read_annotations('subj_task_20010101_001.ds')
+    counts = event_counts('sub-ABC_ses-1_task-flanker_run-01_events.tsv')
+    info = read_ds_info('subj_task_20010101_001.ds')
+
+@author: jstout
+"""
+import os.path as op
+import numpy as np
+import pandas as pd
+import mne
+from pyctf.ctf_res4 import (RES41HDR, RES42HDR, GenRes, gr_numSamples,
+                            gr_numChannels, gr_numTrials, gr_sampleRate,
+                            gr_preTrig)
+from nih2mne.utilities.markerfile import read_markerfile
+
+def read_ds_info(dsname):
+    '''
+    Read the res4 general header - the channel records are not parsed
+
+    Parameters
+    ----------
+    dsname : str
+        CTF dataset
+
+    Returns
+    -------
+    dict
+        sfreq, n_samples (per trial), n_trials, n_chans, pretrig, duration (s)
+
+    '''
+    dsname = str(dsname).rstrip('/')
+    res4_fname = op.join(dsname, op.basename(dsname)[:-3]+'.res4')
+    with open(res4_fname, 'rb') as f:
+        hdr = f.read(8)
+        if hdr[:-1] not in [RES41HDR, RES42HDR]:
+            raise ValueError(f'Invalid res4 file: {res4_fname}')
+        gr = GenRes.unpack(f.read(GenRes.size))
+    info = {'sfreq':float(gr[gr_sampleRate]),
+            'n_samples':int(gr[gr_numSamples]),
+            'n_trials':int(gr[gr_numTrials]),
+            'n_chans':int(gr[gr_numChannels]),
+            'pretrig':int(gr[gr_preTrig])}
+    info['duration'] = info['n_trials'] * info['n_samples'] / info['sfreq']
+    return info
+
+def bids_events_fname(meg_fname):
+    '''*_events.tsv of a BIDS meg run (sub-X_..._run-01_meg.ds)'''
+    meg_fname = str(meg_fname).rstrip('/')
+    if not meg_fname.endswith('_meg.ds'):
+        return None
+    return meg_fname[:-len('_meg.ds')] + '_events.tsv'
+
+def _read_bad_segments(dsname, info):
+    '''bad.segments as bad_{trial} annotations - same as mne'''
+    fname = op.join(dsname, 'bad.segments')
+    if not op.exists(fname):
+        return [], [], []
+    start_time = -info['pretrig'] / info['sfreq']
+    onsets, durations, desc = [], [], []
+    with open(fname) as f:
+        for line in f.readlines():
+            tmp = line.strip().split()
+            if len(tmp) < 3:
+                continue
+            desc.append(f'bad_{tmp[0]}')
+            onsets.append(float(tmp[1]) - start_time)
+            durations.append(float(tmp[2]) - float(tmp[1]))
+    return onsets, durations, desc
+
+def _read_ds_annotations(dsname):
+    info = read_ds_info(dsname)
+    onsets, durations, desc = _read_bad_segments(dsname, info)
+    onsets, durations = np.array(onsets), np.array(durations)
+    mrk_fname = op.join(dsname, 'MarkerFile.mrk')
+    if op.exists(mrk_fname):
+        mrk = read_markerfile(mrk_fname)
+        trial_duration = info['n_samples'] / info['sfreq']
+        mrk_onsets = mrk.onset.values + mrk.trial.values * trial_duration \
+            + info['pretrig'] / info['sfreq']
+        onsets = np.concatenate([onsets, mrk_onsets])
+        durations = np.concatenate([durations, np.zeros(len(mrk))])
+        desc = desc + mrk.condition.tolist()
+    #Drop annotations outside of the data - as in raw.set_annotations
+    keep = (onsets + durations >= 0) & (onsets <= info['duration'])
+    return mne.Annotations(onset=onsets[keep], duration=durations[keep],
+                           description=np.array(desc, dtype=str)[keep])
+
+def _read_tsv_annotations(tsv_fname):
+    dframe = pd.read_csv(tsv_fname, sep='\t', na_values=['n/a'],
+                         keep_default_na=False)
+    if 'trial_type' in dframe.columns:
+        desc = dframe.trial_type.fillna('n/a').astype(str).values
+    else:
+        desc = np.repeat('n/a', len(dframe))
+    durations = dframe.duration.fillna(0).values.astype(float) \
+        if 'duration' in dframe.columns else np.zeros(len(dframe))
+    return mne.Annotations(onset=dframe.onset.values.astype(float),
+                           duration=durations, description=desc)
+
+def read_annotations(fname):
+    '''
+    Annotations of a CTF dataset or BIDS run without loading the raw data
+
+    Parameters
+    ----------
+    fname : str
+        CTF dataset (raw or BIDS) or BIDS *_events.tsv.  A BIDS dataset
+        without a MarkerFile.mrk uses the *_events.tsv of the run.
+
+    Returns
+    -------
+    mne.Annotations
+        Onsets are relative to the first sample (orig_time=None)
+
+    '''
+    fname = str(fname).rstrip('/')
+    if fname.endswith('.tsv'):
+        return _read_tsv_annotations(fname)
+    if not fname.endswith('.ds'):
+        raise ValueError(f'{fname} is not a CTF dataset or events.tsv')
+    tsv_fname = bids_events_fname(fname)
+    if (not op.exists(op.join(fname, 'MarkerFile.mrk'))) and \
+        (tsv_fname is not None) and op.exists(tsv_fname):
+        return _read_tsv_annotations(tsv_fname)
+    return _read_ds_annotations(fname)
+
+def event_counts(fname):
+    '''
+    Number of events for each condition - same as
+    pd.DataFrame(raw.annotations).description.value_counts()
+
+    Parameters
+    ----------
+    fname : str
+        CTF dataset or BIDS *_events.tsv
+
+    Returns
+    -------
+    pd.Series
+
+    '''
+    annot = read_annotations(fname)
+    return pd.Series(annot.description, name='description').value_counts()
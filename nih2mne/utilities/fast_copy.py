@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Zero-copy placement of the CTF meg4 data into the BIDS tree.
+
+write_raw_bids copies the full .ds folder (including the multi-GB .meg4
+files) into the BIDS directory.  The meg4 data is not modified during the
+conversion, so it can be reflinked or hardlinked instead of copied.  All
+other files are copied as usual.
+
+Order of preference for the meg4 files:
+    reflink (copy on write clone - btrfs/xfs)
+    hardlink (same filesystem - shares the inode with the source file)
+    copy_file_range (in kernel / server side copy)
+    shutil.copy2
+
+!Hardlinks share the data with the source dataset.  Modifying the meg4 in
+the BIDS tree will also modify the source data.
+
+@author: jstout
+"""
+
+import os, os.path as op
+import shutil
+import stat
+import contextlib
+
+FICLONE = 0x40049409  # linux/fs.h _IOW(0x94, 9, int)
+_meg4_ext = ('.meg4',) + tuple(f'.{i}_meg4' for i in range(1, 21))
+
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+def _copy_file_range(src, dst):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        while remaining > 0:
+            n_copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                          min(remaining, 2**30))
+            if n_copied == 0:
+                break
+            remaining -= n_copied
+    if remaining > 0:
+        raise OSError(f'copy_file_range did not complete: {src}')
+    shutil.copystat(src, dst)
+
+def link_or_copy(src, dst, hardlink=True):
+    '''
+    Place src at dst without copying the data if possible.
+
+    Parameters
+    ----------
+    src : str
+        Source file
+    dst : str
+        Destination file (must not exist)
+    hardlink : bool, optional
+        Allow a hardlink.  If False, dst never shares the data with src 
+        (reflink, copy_file_range or copy). The default is True.
+
+    Returns
+    -------
+    method : str
+        reflink | hardlink | copy_file_range | copy
+
+    '''
+    try:
+        _reflink(src, dst)
+        shutil.copystat(src, dst)
+        return 'reflink'
+    except (OSError, ImportError):
+        if op.exists(dst): os.remove(dst)
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+    if hasattr(os, 'copy_file_range'):
+        try:
+            _copy_file_range(src, dst)
+            return 'copy_file_range'
+        except OSError:
+            if op.exists(dst): os.remove(dst)
+    shutil.copy2(src, dst)
+    return 'copy'
+
+def _copy_function(src, dst):
+    '''Copy function for shutil.copytree - only the meg4 files are linked'''
+    if src.endswith(_meg4_ext):
+        link_or_copy(src, dst)
+    else:
+        shutil.copy2(src, dst)
+        # Set user read/write as in mne_bids - this is not done on the linked
+        # files to prevent changing the permissions of the source data
+        os.chmod(dst, os.stat(dst).st_mode | stat.S_IRUSR | stat.S_IWUSR)
+    return dst
+
+def copyfile_ctf_linked(src, dest):
+    '''
+    Drop in replacement for mne_bids.copyfiles.copyfile_ctf that links the
+    meg4 files.
+
+    Parameters
+    ----------
+    src : path-like
+        Path to the source raw .ds folder.
+    dest : path-like
+        Path to the destination of the new bids folder.
+
+    Returns
+    -------
+    None.
+
+    '''
+    shutil.copytree(src, dest, copy_function=_copy_function)
+    os.chmod(dest, os.stat(dest).st_mode | stat.S_IRWXU)
+    file_types = ('.acq', '.eeg', '.dat', '.hc', '.hist', '.infods', '.bak',
+                  '.newds', '.res4') + _meg4_ext
+    # Rename files in dest with the name of the dest directory
+    fnames = [f for f in os.listdir(dest) if f.endswith(file_types)]
+    bids_folder_name = op.splitext(op.split(dest)[-1])[0]
+    for fname in fnames:
+        ext = op.splitext(fname)[-1]
+        os.replace(op.join(dest, fname), op.join(dest, bids_folder_name + ext))
+
+@contextlib.contextmanager
+def linked_meg4_copy():
+    '''
+    Context manager to link the meg4 data during write_raw_bids
+
+    with linked_meg4_copy():
+        write_raw_bids(raw, bids_path)
+    '''
+    import mne_bids.write
+    orig_copyfile_ctf = mne_bids.write.copyfile_ctf
+    mne_bids.write.copyfile_ctf = copyfile_ctf_linked
+    try:
+        yield
+    finally:
+        mne_bids.write.copyfile_ctf = orig_copyfile_ctf
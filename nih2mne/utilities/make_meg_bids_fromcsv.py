@@ -12,6 +12,7 @@ import os.path as op
 import os 
 import numpy as np
 import subprocess
+from multiprocessing import Pool, Lock
 
 dirpath = op.join(nih2mne.__path__[0], 'templates', 'bids_entry_template.csv')
 csv_cmdline_mapping = dict(bids_dir='bids_dir',
@@ -32,6 +33,9 @@ mapping_dtypes = dict(bids_dir=str,
                         subjid_input=str, 
                         bids_id=str)
 
+#Template columns that do not match the make_meg_bids option name
+batch_cmdline_mapping = {'-afni_brik':'-mri_brik'}
+
 # =============================================================================
 # 
 # =============================================================================
@@ -138,6 +142,99 @@ def make_serial_proc(csvfile, run=False, return_cmd=False):
         for current_cmd in cmd_chain:
             subprocess.run(current_cmd.split())
         
+def make_row_argv(row, anonymize=False, additional_args=None):
+    '''
+    Convert a csv row into make_meg_bids commandline options for the 
+    in-process batch conversion
+
+    Parameters
+    ----------
+    row : pd.Series
+        Single entry from read_csv_entries
+    anonymize : bool, optional
+        Add the -anonymize flag. The default is False.
+    additional_args : str, optional
+        Extra make_meg_bids flags applied to every row. The default is None.
+
+    Returns
+    -------
+    argv : list of str
+
+    '''
+    argv = make_cmd(row).split()[1:]
+    argv = [batch_cmdline_mapping.get(i, i) for i in argv]
+    if anonymize==True:
+        argv.append('-anonymize')
+    if additional_args not in [None, '']:
+        argv.extend(additional_args.split())
+    return argv
+
+def _init_batch_worker(lock):
+    '''Import the processing code once per worker and share the bids write
+    lock, since all of the rows can write to the same bids_dir'''
+    from nih2mne import make_meg_bids
+    make_meg_bids._bids_write_lock = lock
+
+def _batch_worker(row_info):
+    '''Run make_bids on a single csv row.  All errors are caught so that the
+    remaining subjects continue processing'''
+    from nih2mne.make_meg_bids import _parse_cmdline, make_bids
+    idx, argv = row_info
+    try:
+        args = _parse_cmdline(argv)
+        args.n_workers = 1  #Pool workers cannot start a nested pool
+        make_bids(args)
+        status, error = 'success', ''
+    except (Exception, SystemExit) as e:
+        # Includes SystemExit from the argument parser
+        status, error = 'failed', f'{type(e).__name__}: {str(e)}'
+    return idx, status, error
+
+def make_batch_proc(csvfile, n_workers=1, summary_fname='megbids_batch_summary.csv', 
+                    anonymize=False, additional_args=None):
+    '''
+    Convert all csv entries in long running worker processes.  This calls 
+    make_bids directly instead of launching make_meg_bids.py for each row.
+    
+    Parameters
+    ----------
+    csvfile : csv text file
+        CSV file with data entries.
+    n_workers : int, optional
+        Number of subjects to convert concurrently. The default is 1.
+    summary_fname : str, optional
+        Output csv with the success/failure of each row. 
+        The default is megbids_batch_summary.csv. If None, nothing is written.
+    anonymize : bool, optional
+        Anonymize all entries. The default is False.
+    additional_args : str, optional
+        Extra make_meg_bids flags applied to every row. The default is None.
+
+    Returns
+    -------
+    summary : pd.DataFrame
+        Row by row status of the conversion
+
+    '''
+    dframe = read_csv_entries(csvfile)
+    row_list = [(idx, make_row_argv(row, anonymize=anonymize, 
+                                    additional_args=additional_args)) 
+                for idx, row in dframe.iterrows()]
+    n_workers = max(1, min(int(n_workers), len(row_list)))
+    with Pool(processes=n_workers, initializer=_init_batch_worker, 
+              initargs=(Lock(),)) as pool:
+        results = pool.map(_batch_worker, row_list, chunksize=1)
+    
+    summary = pd.DataFrame(results, columns=['row','status','error'])
+    summary['subjid_input'] = dframe.get('subjid_input')
+    summary['bids_id'] = dframe.get('bids_id')
+    summary['cmd'] = [' '.join(i[1]) for i in row_list]
+    summary = summary[['row', 'subjid_input', 'bids_id', 'status', 'error', 'cmd']]
+    if summary_fname is not None:
+        summary.to_csv(summary_fname, index=False)
+    print(summary[['row', 'subjid_input', 'bids_id', 'status', 'error']].to_string(index=False))
+    return summary
+        
 def main():
     import argparse
     template = op.join(op.dirname(__file__),'..', 'templates', 'bids_entry_template.csv')
@@ -151,6 +248,16 @@ def main():
     parser.add_argument('-run_bids_loop', required=False,
                         action='store_true',
                         help='''Send the bids loop to a subprocess for computing''')
+    parser.add_argument('-run_bids_batch', required=False,
+                        action='store_true',
+                        help='''Run make_bids for all entries inside a pool of 
+                        python workers and write a success/failure table''')
+    parser.add_argument('-n_workers', required=False, type=int, default=1,
+                        help='''Number of subjects to process concurrently 
+                        with -run_bids_batch''')
+    parser.add_argument('-summary_fname', required=False, 
+                        default='megbids_batch_summary.csv',
+                        help='''Output summary csv for -run_bids_batch''')
     parser.add_argument('-write_swarmf', required=False,
                         action='store_true', help='''Write a swarm file from
                         the csv.  Default name is megbids_swarm.sh unless set''')
@@ -173,6 +280,11 @@ def main():
         make_serial_proc(csvfile, run=False)
     if args.run_bids_loop:
         make_serial_proc(csvfile, run=True)
+    if args.run_bids_batch:
+        make_batch_proc(csvfile, n_workers=args.n_workers, 
+                        summary_fname=args.summary_fname,
+                        anonymize=args.anonymize, 
+                        additional_args=args.additional_args)
     if (args.write_swarmf and args.swarmfile_fname):
         make_swarm_file(csvfile, swarmfile=args.swarmfile_fname, write=True)
     elif args.write_swarmf:
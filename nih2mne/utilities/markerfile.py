@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Read and write CTF MarkerFile.mrk files without opening the dataset.
+
+read_markerfile parses all of the marker classes into a dataframe
+(trial, onset, condition).  write_markerfile formats all classes with
+vectorized string building and writes the file in a single buffered write
+to a temporary file that is renamed into place.  The output is the same as
+markerfile_write.main.
+
+    dframe = read_markerfile('subj_task_20010101_001.ds/MarkerFile.mrk')
+    write_markerfile(dframe, ds_filename='subj_task_20010101_001.ds')
+
+@author: jstout
+"""
+import os, os.path as op
+import datetime
+import shutil
+import uuid
+import numpy as np
+import pandas as pd
+from nih2mne.utilities.markerfile_write import (return_header1, return_header2,
+                                                create_stim_mark_block,
+                                                create_next_color)
+
+def read_markerfile(mrk_fname):
+    '''
+    Parse a MarkerFile.mrk
+
+    Parameters
+    ----------
+    mrk_fname : str
+        MarkerFile.mrk or the dataset folder containing it
+
+    Returns
+    -------
+    pd.DataFrame
+        trial, onset (time from sync point), condition - in file order
+
+    '''
+    mrk_fname = str(mrk_fname)
+    if op.isdir(mrk_fname):
+        mrk_fname = op.join(mrk_fname, 'MarkerFile.mrk')
+    with open(mrk_fname) as f:
+        lines = f.read().splitlines()
+
+    names, blocks = [], []
+    idx = lines.index('NUMBER OF MARKERS:')
+    n_classes = int(lines[idx + 1])
+    for _ in range(n_classes):
+        idx = lines.index('NAME:', idx)
+        name = lines[idx + 1]
+        idx = lines.index('NUMBER OF SAMPLES:', idx)
+        n_samples = int(lines[idx + 1])
+        idx = lines.index('LIST OF SAMPLES:', idx) + 2  #skip the column header
+        names.append(name)
+        blocks.append(lines[idx:idx + n_samples])
+        idx += n_samples
+
+    counts = [len(i) for i in blocks]
+    values = ' '.join(' '.join(i) for i in blocks).split()
+    values = np.array(values, dtype=float).reshape(-1, 2)
+    return pd.DataFrame({'trial':values[:, 0].astype(int),
+                         'onset':values[:, 1],
+                         'condition':np.repeat(np.array(names, dtype=object), counts)})
+
+def format_markerfile(dframe, ds_filename, stim_column='condition',
+                      time_column='onset', trial_column=None):
+    '''
+    MarkerFile text for the dataframe.  Each unique value in the stim_column
+    is a marker class (order of appearance) with a pseudo-random color.
+
+    Parameters
+    ----------
+    dframe : pd.DataFrame
+        Events
+    ds_filename : str
+        Dataset path written in the header
+    stim_column : str, optional
+        Marker names. The default is 'condition'.
+    time_column : str, optional
+        Times from the sync point. The default is 'onset'.
+    trial_column : str, optional
+        Trial numbers. The default is None (all markers in trial 0 - same as
+        markerfile_write.main).
+
+    Returns
+    -------
+    str
+
+    '''
+    events = dframe[dframe[stim_column].notna()]
+    stim_names = events[stim_column].unique()
+    times = events[time_column].values
+    if trial_column is None:
+        trials = np.zeros(len(events), dtype=int)
+    else:
+        trials = events[trial_column].values.astype(int)
+    #Row positions of each class in order of appearance
+    class_idxs = events.groupby(stim_column, sort=False).indices
+
+    text = [return_header1(ds_filename), return_header2(stim_names)]
+    for classid, stim_name in enumerate(stim_names, start=1):
+        idxs = class_idxs[stim_name]
+        #repr of the python floats is the same as str of the numpy values
+        time_strs = map(repr, times[idxs].tolist())
+        text.append(create_stim_mark_block(classgroupid=3, name=stim_name,
+                                           color=create_next_color(),
+                                           classid=classid,
+                                           number_of_samples=len(idxs),
+                                           comment='Autocomment', editable='No'))
+        if np.all(trials[idxs] == trials[idxs[0]]):
+            prefix = f'\t\t\t{trials[idxs[0]]}\t\t\t\t\t+'
+            text.append(prefix + ('\n'+prefix).join(time_strs) + '\n\n')
+        else:
+            prefixes = map('\t\t\t{}\t\t\t\t\t+'.format, trials[idxs].tolist())
+            text.append('\n'.join(map(str.__add__, prefixes, time_strs)) + '\n\n')
+    text.append('\n')
+    return ''.join(text)
+
+def write_markerfile(dframe=None, ds_filename=None, mrk_output_file=None,
+                     stim_column='condition', trial_column=None, backup=True):
+    '''
+    Write the MarkerFile in one write to a temporary file and rename it into
+    place.  A failure never leaves a partial MarkerFile.
+
+    Parameters
+    ----------
+    dframe : pd.DataFrame
+        Events
+    ds_filename : str
+        CTF dataset
+    mrk_output_file : str, optional
+        The default is ds_filename/MarkerFile.mrk.
+    stim_column : str, optional
+        Marker names. The default is 'condition'.
+    trial_column : str, optional
+        Trial numbers. The default is None (trial 0).
+    backup : bool, optional
+        Keep the existing MarkerFile as MarkerFile.mrkBAK_{DATE_TIME}.
+        The default is True.
+
+    Returns
+    -------
+    mrk_output_file : str
+
+    '''
+    if mrk_output_file is None:
+        mrk_output_file = op.join(op.abspath(ds_filename), 'MarkerFile.mrk')
+    text = format_markerfile(dframe, ds_filename, stim_column=stim_column,
+                             trial_column=trial_column)
+    tmp_fname = op.join(op.dirname(mrk_output_file), 
+                        f'.MarkerFile.mrk.{os.getpid()}_{uuid.uuid4().hex[:8]}')
+    try:
+        with open(tmp_fname, 'x') as f:
+            f.write(text)
+        if backup and op.exists(mrk_output_file):
+            bak_fname = mrk_output_file+'BAK_{}'.format(datetime.datetime.today().strftime('%m%d%Y_%H:%M'))
+            if op.exists(bak_fname):
+                os.remove(bak_fname)
+            try:
+                os.link(mrk_output_file, bak_fname)
+            except OSError:
+                shutil.copy2(mrk_output_file, bak_fname)
+        os.replace(tmp_fname, mrk_output_file)
+    finally:
+        if op.exists(tmp_fname):
+            os.remove(tmp_fname)
+    return mrk_output_file
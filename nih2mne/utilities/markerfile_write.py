@@ -118,46 +118,14 @@ def main(dframe=None, ds_filename=None, mrk_output_file=None,
 
     If a marker file is present in the MEG folder, the file will be moved to 
     a backup copy called MarkerFile.mrkBAK_{DATE_TIME}
-    '''
-    if mrk_output_file==None:
-        mrk_output_file=os.path.join(os.path.abspath(ds_filename), 'MarkerFile.mrk')
-    if os.path.exists(mrk_output_file):
-        import shutil, datetime
-        shutil.move(mrk_output_file, mrk_output_file+'BAK_{}'.format(datetime.datetime.today().strftime('%m%d%Y_%H:%M')))
-    rfmt=dframe
-    
-    #classgroupid=3  #Current understanding is that this index must start at 3
-    classid=1 #Start the index for the CTF stims
-    
-    stim_names=rfmt[stim_column].dropna().unique()  ######  This may need to be changed name wise ---------------
-    
-    #Add filename header
-    hdr1=return_header1(ds_filename)
-    append_file(mrk_output_file, textwrite=hdr1)
-    
-    #Add marker number to the header
-    hdr2=return_header2(stim_names) 
-    append_file(mrk_output_file, textwrite=hdr2)
-    
-    #Iterate over stimuli and append to mrk file
-    if stim_column != None:
-        classid = append_stim_vector(dframe, column_name=stim_column, classid=classid, 
-                           mrk_output_file=mrk_output_file)
-    
-    # #Process Targets
-    # if target_column != None:
-    #     classid = append_stim_vector(dframe, column_name=target_column, classid=classid, 
-    #                         mrk_output_file=mrk_output_file)
-    
-    # #Process Responses
-    # if response_column != None:
-    #     classid = append_stim_vector(dframe, column_name=response_column, classid=classid, 
-    #                         mrk_output_file=mrk_output_file)
-    
-    append_file(mrk_output_file, textwrite='\n') #Requires two returns at the end of file    
     
+    The file is formatted in memory and written in a single write to a 
+    temporary file that is renamed into place (see markerfile.write_markerfile)
+    '''
+    from nih2mne.utilities.markerfile import write_markerfile
+    write_markerfile(dframe=dframe, ds_filename=ds_filename, 
+                     mrk_output_file=mrk_output_file, stim_column=stim_column)
     
-
 if __name__=='__main__':    
     import argparse
     parser = argparse.ArgumentParser()
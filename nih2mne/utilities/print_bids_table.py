@@ -3,20 +3,27 @@ import glob
 
 import os, os.path as op
 import mne_bids
+from nih2mne.utilities.bids_index import BidsIndex
 
 def get_sessions(subjid):
     return [i for i in os.listdir(subjid) if i[0:3]=='ses']
 
-def get_megs(subjid, ses='1', extension='.ds', bids_dir=None):
-    '''Return all MEG scans'''
-    candidate_ses = glob.glob(f'{subjid}/ses-*')
-    candidate_ses = [i.split('-')[-1] for i in candidate_ses]
+def get_megs(subjid, ses='1', extension='.ds', bids_dir=None, index=None):
+    '''Return all MEG scans - from the project index if provided'''
+    if index is not None:
+        candidate_ses = index.sessions(subjid)
+    else:
+        candidate_ses = glob.glob(f'{bids_dir}/{subjid}/ses-*')
+        candidate_ses = [i.split('-')[-1] for i in candidate_ses]
     if '-' in ses:
         ses==ses.split('-')[-1]
     if ses not in candidate_ses:
         ses='0'+ses
         if ses not in candidate_ses:
             return None
+    if index is not None:
+        return index.files(subject=subjid, session=ses, datatype='meg', 
+                           extension=extension)
     ses='ses-'+ses
     megs = glob.glob(f'{bids_dir}/{subjid}/{ses}/meg/*{extension}')
     return megs
@@ -26,17 +33,15 @@ def get_tag_output(fname, tag='task'):
     return tmp.split(f'{tag}-')[-1].split('_')[0]
 
 def get_bids_table(bids_dir, ses='1'):
-    init_dir = os.getcwd()
-    os.chdir(bids_dir)
-    subjids = glob.glob('sub-*')
+    index = BidsIndex(bids_dir)
+    index.refresh()
     dsets=[]
-    for sub in subjids:
-        dsets+=get_megs(sub, ses=ses, bids_dir=bids_dir)
+    for sub in index.subjects():
+        dsets+=get_megs(sub, ses=ses, bids_dir=bids_dir, index=index)
     dframe=pd.DataFrame(dsets, columns=['fname'])
     dframe['task']=dframe.fname.apply(get_tag_output, tag='task')
     dframe['run']=dframe.fname.apply(get_tag_output, tag='run')
     dframe['subjid']=dframe.fname.apply(get_tag_output, tag='sub')
-    os.chdir(init_dir)
     return dframe
                                      
 def gui_interface(bids_dir=None, out_fname=None, session='1'):
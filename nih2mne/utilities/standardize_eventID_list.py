@@ -7,7 +7,7 @@ Created on Tue Jul  2 11:06:33 2024
 """
 
 import pandas as pd
-import mne
+from nih2mne.utilities.events import read_annotations
 import os, os.path as op
 import glob
 
@@ -43,8 +43,7 @@ def write_standardized_event_list(meg_dir, task=None):
         
         id_list = []
         for dset in task_dsets:
-            raw = mne.io.read_raw_ctf(dset, system_clock='ignore')
-            id_list.extend(list(raw.annotations.description)[:])
+            id_list.extend(list(read_annotations(dset).description))
         
         id_list = sorted(set(id_list)) #Sort unique entries
         id_list = pd.DataFrame(zip(id_list,range(1, 1+len(id_list))), 
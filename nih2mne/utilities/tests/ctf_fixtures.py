@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Small synthetic CTF datasets for the tests that do not need the full
+test_data download.  Channels: 4 MEG, 1 reference, UADC001, UADC002, UPPT001
+
+"""
+import os, os.path as op
+import numpy as np
+from pyctf import ctf_res4 as R
+
+ch_names = [b'MLC11-1609', b'MLC12-1609', b'MRC11-1609', b'MRC12-1609',
+            b'BR1-1609', b'UADC001-1609', b'UADC002-1609', b'UPPT001']
+ch_types = [R.TYPE_MEG]*4 + [R.TYPE_REF_MAG, R.TYPE_UADC, R.TYPE_UADC, R.TYPE_UPPT]
+adc_gain = 1e-5  # Volts per bit
+
+def _write_res4(res4_fname, n_samples, n_trials, sfreq, subject):
+    n_chans = len(ch_names)
+    run_name = f'{subject}_rest_20010101_001.ds'.encode()
+    run_desc = f'Run description for {subject}'.encode()
+    genRes = [b'Acq', b'DSQ-2010', b'', 0, b'10:11:12', b'01/01/2001',
+              n_samples, n_chans, sfreq, n_samples*n_trials/sfreq,
+              n_trials, 0, n_trials, 0, n_trials, b'', 0, 0, 0, 1, 0,
+              run_name, f'Title {subject}'.encode(), b'inst',
+              f'Collected for {subject}'.encode(), subject.encode(),
+              b'operator', b'sensors', len(run_desc)+1]
+    r = R.res4data()
+    r.genRes = genRes
+    r.runDesc = run_desc
+    r.filterInfo = []
+    r.chanName = ch_names
+    r.sensRes = []
+    for i, ch_type in enumerate(ch_types):
+        if ch_type in [R.TYPE_MEG, R.TYPE_REF_MAG]:
+            sr = (ch_type, 1, 0, 1e8, 1.0, 1.0, 0.0, 1, 0, 0)
+        else:
+            sr = (ch_type, 1, 0, 1/adc_gain, 1.0, 1.0, 0.0, 0, 0, 0)
+        coil = (0.01*i, 0.02, 0.1, 0., 0., 1., 1, 1e-4)
+        r.sensRes.append((sr, [coil]*R.MAX_COILS, [coil]*R.MAX_COILS))
+    r.coeffInfo = [(ch_names[i], b'G1BR', 1, b'BR1-1609', *([0.01]+[0.]*49))
+                   for i, ch_type in enumerate(ch_types) if ch_type == R.TYPE_MEG]
+    R.write_res4_structs(res4_fname, r)
+
+def make_ds(ds_fname, n_samples=6000, n_trials=1, sfreq=600., seed=0,
+            trials_per_file=None, subject='ABABABAB', data=None):
+    '''
+    Write a synthetic CTF dataset
+
+    Parameters
+    ----------
+    ds_fname : str
+        Output path ending in .ds
+    n_samples : int
+        Samples per trial
+    n_trials : int
+        Number of trials
+    sfreq : float
+        Sampling frequency
+    seed : int
+        Random seed for the non-zero random data
+    trials_per_file : int, optional
+        Split the meg4 into continuation files (.1_meg4 ...)
+    subject : str
+        Subject ID written into the header fields
+    data : np.ndarray, optional
+        int32 data (n_trials, n_chans, n_samples).  Random if not set
+
+    Returns
+    -------
+    ds_fname : str
+    data : np.ndarray
+
+    '''
+    os.makedirs(ds_fname)
+    base = op.join(ds_fname, op.basename(ds_fname)[:-3])
+    _write_res4(base+'.res4', n_samples, n_trials, sfreq, subject)
+    if data is None:
+        rng = np.random.default_rng(seed)
+        shape = (n_trials, len(ch_names), n_samples)
+        data = rng.integers(1, 1000, size=shape) * rng.choice([-1, 1], size=shape)
+    data = np.asarray(data).astype('>i4')
+    trials_per_file = trials_per_file or n_trials
+    for file_idx, trial in enumerate(range(0, n_trials, trials_per_file)):
+        meg4 = base + ('.meg4' if file_idx == 0 else f'.{file_idx}_meg4')
+        with open(meg4, 'wb') as f:
+            f.write(b'MEG41CP\x00')
+            f.write(data[trial:trial+trials_per_file].tobytes())
+    with open(op.join(ds_fname, 'ClassFile.cls'), 'w') as f:
+        f.write(f'PATH OF DATASET:\n{ds_fname}\n\n')
+    with open(base+'.hist', 'w') as f:
+        f.write(f'Collected {subject}\n')
+    return ds_fname, data
+
+def make_trigger_ds(ds_fname):
+    '''Single trial dataset with parallel port codes 1,3,1,3 (UPPT001), a 
+    projector pulse 10 samples after each code (UADC001) and one response 
+    (UADC002) 300 samples after the first code'''
+    data = np.random.default_rng(0).integers(1, 1000, size=(1, 8, 6000))
+    data[0, 5:] = 10
+    data[0, 7] = 0
+    for onset, code in [(1000, 1), (2000, 3), (3000, 1), (4000, 3)]:
+        data[0, 7, onset:onset+10] = code * 100000
+        #Projector 10 samples after the parallel port
+        data[0, 5, onset+10] = 30000
+        data[0, 5, onset+11:onset+100] = 50000
+    #Response to the first stim_a only
+    data[0, 6, 1300] = 30000
+    data[0, 6, 1301:1400] = 50000
+    return make_ds(ds_fname, n_samples=6000, data=data)[0]
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the project wide trigger processing
+"""
+import os, os.path as op
+import yaml
+from nih2mne.utilities import batch_trigproc as bt
+from nih2mne.utilities.trigger_rules import save_rule_spec
+from nih2mne.utilities.tests.ctf_fixtures import make_trigger_ds
+from nih2mne.utilities.tests.test_trigger_rules import spec
+
+def test_get_task():
+    assert bt.get_task('/data/ABABABAB_flanker_20010101_001.ds') == 'flanker'
+    assert bt.get_task('sub-01_ses-1_task-flanker_run-01_meg.ds/') == 'flanker'
+    assert bt.get_task('hz.ds') is None
+
+def test_batch_trigproc(tmp_path):
+    topdir = op.join(tmp_path, 'ABABABAB', '20010101')
+    os.makedirs(topdir)
+    for run in [1, 2]:
+        make_trigger_ds(op.join(topdir, f'ABABABAB_flanker_20010101_00{run}.ds'))
+    make_trigger_ds(op.join(topdir, 'ABABABAB_rest_20010101_003.ds'))
+    os.makedirs(op.join(topdir, 'ABABABAB_flanker_20010101_001.ds', 'hz.ds'))
+    assert len(bt.find_datasets(tmp_path)) == 3
+    assert len(bt.find_datasets(tmp_path, task='FLANKER')) == 2
+    
+    spec_fname = save_rule_spec(spec, op.join(tmp_path, 'flanker_v1.yml'))
+    qa_fname = op.join(tmp_path, 'qa.yml')
+    with open(qa_fname, 'w') as f:
+        yaml.dump({'flanker':{'stim_a':2, 'stim_a_resp':2}}, f)
+    summary_fname = op.join(tmp_path, 'summary.csv')
+    summary = bt.batch_trigproc(tmp_path, spec_fname, task='flanker', n_workers=2,
+                                qa_config=qa_fname, summary_fname=summary_fname)
+    assert op.exists(summary_fname)
+    assert list(summary.status) == ['success', 'success']
+    assert list(summary.stim_b) == [2, 2]
+    assert list(summary.qa) == ['Fail', 'Fail']
+    assert list(summary.qa_failed) == ['stim_a_resp', 'stim_a_resp']
+    
+    #Rerun replaces the MarkerFile and keeps a backup - no temporary files remain
+    bt.batch_trigproc(tmp_path, spec_fname, task='flanker')
+    ds_files = os.listdir(op.join(topdir, 'ABABABAB_flanker_20010101_002.ds'))
+    assert 'MarkerFile.mrk' in ds_files
+    assert len([i for i in ds_files if i.startswith('MarkerFile.mrkBAK')]) == 1
+    assert not any(i.startswith('.MarkerFile') for i in ds_files)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the BIDS project metadata index
+"""
+import os, os.path as op
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from nih2mne.utilities.bids_index import BidsIndex
+from nih2mne.utilities.events import event_counts
+from nih2mne.utilities.markerfile import write_markerfile
+from nih2mne.utilities.print_bids_table import get_bids_table
+from nih2mne.utilities.bids_helpers import get_mri_dict
+from nih2mne.utilities.tests.ctf_fixtures import make_ds
+
+def _touch(fname, text=''):
+    os.makedirs(op.dirname(fname), exist_ok=True)
+    with open(fname, 'w') as f:
+        f.write(text)
+
+def _backdate(top, seconds=60):
+    '''Set the mtimes in the past - recent changes are always re-read'''
+    mtime = time.time() - seconds
+    for root, dirs, files in os.walk(top):
+        for i in dirs + files:
+            os.utime(op.join(root, i), (mtime, mtime))
+
+def _backdate_paths(paths, seconds=30):
+    mtime = time.time() - seconds
+    for i in paths:
+        os.utime(i, (mtime, mtime))
+
+def make_bids_tree(bids_root):
+    for subject in ['sub-01', 'sub-02']:
+        meg_dir = op.join(bids_root, subject, 'ses-1', 'meg')
+        os.makedirs(meg_dir)
+        for run in ['01', '02']:
+            ds_fname, _ = make_ds(op.join(meg_dir, f'{subject}_ses-1_task-rest_run-{run}_meg.ds'),
+                                  n_samples=600, n_trials=2)
+            dframe = pd.DataFrame({'onset':np.arange(10)*0.1,
+                                   'condition':['stim', 'resp']*5})
+            write_markerfile(dframe, ds_filename=ds_fname, backup=False)
+    _touch(op.join(bids_root, 'sub-01', 'ses-1', 'anat', 'sub-01_ses-1_T1w.nii.gz'))
+    _touch(op.join(bids_root, 'sub-01', 'ses-1', 'anat', 'sub-01_ses-1_T1w.json'),
+           '{"AnatomicalLandmarkCoordinates": {"NAS":[0,0,0], "LPA":[0,0,0], "RPA":[0,0,0]}}')
+    deriv_meg = op.join(bids_root, 'derivatives', 'nihmeg', 'sub-01', 'ses-01', 'meg')
+    for suffix in ['fwd', 'trans', 'src']:
+        _touch(op.join(deriv_meg, f'sub-01_ses-01_task-rest_run-01_{suffix}.fif'))
+    _touch(op.join(bids_root, 'derivatives', 'freesurfer', 'subjects', 'sub-01',
+                   'scripts', 'recon-all.log'), 'recon-all -s sub-01 finished without error\n')
+    _backdate(bids_root)
+
+def test_bids_index_refresh(tmp_path):
+    bids_root = op.join(tmp_path, 'BIDS')
+    make_bids_tree(bids_root)
+    index = BidsIndex(bids_root)
+    assert index.index_fname == op.join(bids_root, 'derivatives', 'megQA',
+                                        'nih2mne_bids_index.sqlite')
+    stats = index.refresh()
+    assert stats['datasets_read'] == 4
+    assert index.subjects() == ['sub-01', 'sub-02']
+    assert index.sessions('sub-01') == ['1']
+    megs = index.files(subject='sub-01', extension='.ds')
+    assert [op.basename(i) for i in megs] == ['sub-01_ses-1_task-rest_run-01_meg.ds',
+                                              'sub-01_ses-1_task-rest_run-02_meg.ds']
+    assert index.files(subject='sub-01', datatype='anat', extension=['.nii', '.nii.gz']) \
+        == [op.join(bids_root, 'sub-01', 'ses-1', 'anat', 'sub-01_ses-1_T1w.nii.gz')]
+    assert len(index.files(root='nihmeg', suffix=['fwd', 'src'])) == 2
+    assert index.fs_recon('sub-01') == dict(fs_success=True, fs_started=True,
+                                            lhpial=False, rhpial=False)
+    assert index.fs_recon('sub-02')['fs_started'] == False
+
+    meg_table = index.meg_table()
+    assert len(meg_table) == 4
+    assert (meg_table.sfreq == 600.).all() and (meg_table.duration == 2.0).all()
+    assert (meg_table['size'] > 0).all()
+    assert index.event_counts(megs[0]) == event_counts(megs[0]).to_dict() \
+        == {'stim':5, 'resp':5}
+
+    #Unchanged tree - only the directories are checked
+    stats = index.refresh()
+    assert stats == dict(dirs_scanned=0, datasets_read=0, freesurfer_read=0)
+
+    #New MarkerFile / new file / removed subject
+    write_markerfile(pd.DataFrame({'onset':[0.1], 'condition':['stim']}),
+                     ds_filename=megs[0], backup=False)
+    _touch(op.join(bids_root, 'sub-01', 'ses-1', 'anat', 'sub-01_ses-1_T2w.nii'))
+    shutil.rmtree(op.join(bids_root, 'sub-02'))
+    anat_dir = op.join(bids_root, 'sub-01', 'ses-1', 'anat')
+    _backdate_paths([megs[0], op.join(megs[0], 'MarkerFile.mrk'), anat_dir,
+                     op.join(anat_dir, 'sub-01_ses-1_T2w.nii')])
+    stats = index.refresh()
+    assert stats['dirs_scanned'] == 1
+    assert stats['datasets_read'] == 1
+    assert index.event_counts(megs[0]) == {'stim':1}
+    assert index.subjects() == ['sub-01']
+    assert len(index.files(subject='sub-02')) == 0
+    assert len(index.meg_table()) == 2
+    assert len(index.files(subject='sub-01', datatype='anat',
+                           extension=['.nii', '.nii.gz'])) == 2
+    
+    #New file next to an unchanged dataset - the dataset size is kept
+    meg_dir = op.dirname(megs[1])
+    events_tsv = megs[1].replace('_meg.ds', '_events.tsv')
+    _touch(events_tsv, 'onset\tduration\ttrial_type\n')
+    _backdate_paths([events_tsv, meg_dir])
+    stats = index.refresh()
+    assert (stats['dirs_scanned'] == 1) and (stats['datasets_read'] == 0)
+    assert index.files(subject='sub-01', suffix='events') == [events_tsv]
+    assert (index.meg_table()['size'] > 0).all()
+
+def test_bids_index_consumers(tmp_path):
+    bids_root = op.join(tmp_path, 'BIDS')
+    make_bids_tree(bids_root)
+    dframe = get_bids_table(bids_root, ses='1')
+    assert len(dframe) == 4
+    assert sorted(dframe.subjid.unique()) == ['01', '02']
+    assert dframe.run.tolist() == ['01', '02', '01', '02']
+
+    data_dict = get_mri_dict('01', bids_root=bids_root, session='01', task='rest')
+    assert sorted(data_dict.keys()) == ['fwd', 'src', 'trans']
+    assert op.exists(data_dict['fwd'].bids_path.fpath)
+
+def test_bids_project_uses_index(tmp_path):
+    from nih2mne.dataQA.bids_project_interface import bids_project
+    bids_root = op.join(tmp_path, 'BIDS')
+    make_bids_tree(bids_root)
+    project = bids_project(bids_root=bids_root)
+    assert list(project.subjects.keys()) == ['sub-01', 'sub-02']
+    subj = project.subjects['sub-01']
+    assert subj.meg_count == 2
+    assert subj.mri.endswith('sub-01_ses-1_T1w.nii.gz')
+    assert subj.mri_json_qa == 'GOOD'
+    assert subj.fs_recon['fs_success'] == True
+    assert project.fs_recon['notStarted'] == ['sub-02']
+    assert project.subjects['sub-02'].mri is None
+
+def test_bids_project_parallel_load(tmp_path):
+    from nih2mne.dataQA.bids_project_interface import bids_project
+    bids_root = op.join(tmp_path, 'BIDS')
+    make_bids_tree(bids_root)
+    for subject in ['sub-03', 'sub-04', 'sub-05']:
+        _touch(op.join(bids_root, subject, 'ses-1', 'anat', f'{subject}_ses-1_T1w.nii'))
+    os.makedirs(op.join(bids_root, 'sub-06'))
+    _touch(op.join(bids_root, 'derivatives', 'megQA', 'sub-04.pkl'), 'corrupt')
+    progress = []
+    project = bids_project(bids_root=bids_root, n_workers=4,
+                           progress_callback=lambda *args: progress.append(args))
+    assert list(project.subjects.keys()) == ['sub-01', 'sub-02', 'sub-03', 'sub-05', 'sub-06']
+    assert project.error_subjects == ['sub-04']
+    assert sorted(i[0] for i in progress) == list(range(1, 7))
+    assert all(i[1] == 6 for i in progress)
+    assert sorted(i[2] for i in progress) == ['sub-01', 'sub-02', 'sub-03', 'sub-04', 'sub-05', 'sub-06']
+    
+    #Reload from the saved subject info in a single worker
+    serial = bids_project(bids_root=bids_root, n_workers=1)
+    assert list(serial.subjects.keys()) == list(project.subjects.keys())
+    assert serial.fs_recon == project.fs_recon
+    assert [i.meg_count for i in serial.subjects.values()] == [2, 2, 0, 0, 0]
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the conversion manifest used in incremental bids conversion
+"""
+import os, os.path as op
+import json
+from mne_bids import BIDSPath
+from nih2mne.utilities.bids_manifest import (ds_fingerprint, make_manifest_entry,
+                                             is_converted, update_manifest,
+                                             get_manifest_fname)
+
+def _make_fake_ds(topdir):
+    meg_fname = op.join(topdir, 'ABABABAB_rest_20010101_001.ds')
+    base = op.join(meg_fname, 'ABABABAB_rest_20010101_001')
+    os.mkdir(meg_fname)
+    for ext, content in [('.res4', b'res4'), ('.meg4', b'MEG41CP\x00'+b'\x00'*100),
+                         ('.1_meg4', b'MEG41CP\x00'+b'\x01'*100)]:
+        with open(base+ext, 'wb') as f:
+            f.write(content)
+    with open(op.join(meg_fname, 'MarkerFile.mrk'), 'w') as f:
+        f.write('PATH OF DATASET:\n')
+    return meg_fname
+
+def test_ds_fingerprint(tmp_path):
+    meg_fname = _make_fake_ds(tmp_path)
+    fp = ds_fingerprint(meg_fname)
+    assert sorted(fp.keys()) == ['ABABABAB_rest_20010101_001.1_meg4',
+                                 'ABABABAB_rest_20010101_001.meg4',
+                                 'ABABABAB_rest_20010101_001.res4',
+                                 'MarkerFile.mrk']
+    assert fp['ABABABAB_rest_20010101_001.meg4']['size'] == 108
+
+def test_manifest_incremental(tmp_path):
+    meg_fname = _make_fake_ds(tmp_path)
+    bids_root = op.join(tmp_path, 'bids_dir')
+    bids_path = BIDSPath(subject='S01', session='1', task='rest', run='01',
+                         root=bids_root, suffix='meg', extension='.ds')
+    options = dict(anonymize=False, crop_trailing_zeros=False, eventID_csv=None)
+    entry = make_manifest_entry(meg_fname, bids_path, options)
+    assert not is_converted(bids_root, meg_fname, entry)
+
+    update_manifest(bids_root, meg_fname, entry)
+    with open(get_manifest_fname(bids_root)) as f:
+        manifest = json.load(f)
+    assert op.abspath(meg_fname) in manifest['runs']
+    #Output has not been written
+    assert not is_converted(bids_root, meg_fname, entry)
+    assert entry['output'] == op.join(bids_root, 'sub-S01', 'ses-1', 'meg', 
+                                      'sub-S01_ses-1_task-rest_run-01_meg.ds')
+    os.makedirs(entry['output'])
+    assert is_converted(bids_root, meg_fname, entry)
+
+    #Changed options
+    entry2 = make_manifest_entry(meg_fname, bids_path, dict(options, anonymize=True))
+    assert not is_converted(bids_root, meg_fname, entry2)
+
+    #Changed markerfile
+    with open(op.join(meg_fname, 'MarkerFile.mrk'), 'a') as f:
+        f.write('NUMBER OF MARKERS:\n')
+    entry3 = make_manifest_entry(meg_fname, bids_path, options)
+    assert not is_converted(bids_root, meg_fname, entry3)
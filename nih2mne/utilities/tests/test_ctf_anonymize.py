@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the python CTF anonymization
+"""
+import os, os.path as op
+import glob
+import pytest
+import numpy as np
+from struct import Struct
+import mne
+import nih2mne
+from pyctf.CPersist import getCPersist
+from pyctf.ctf_res4 import readRes4
+from nih2mne.utilities.ctf_anonymize import anonymize_infods, anonymize_ds
+
+test_data = nih2mne.test_data()
+be_int = Struct('>i')
+
+def _cp_str(val):
+    return be_int.pack(len(val)) + val
+
+def _cp_entry(tag, tagtype, payload):
+    return _cp_str(tag) + be_int.pack(tagtype) + payload
+
+def test_anonymize_infods(tmp_path):
+    nested = b'WS1_' + _cp_entry(b'_PATIENT_ID', 10, _cp_str(b'ABABABAB')) + \
+        _cp_str(b'EndOfParameters')
+    content = b'WS1_' + \
+        _cp_entry(b'_PATIENT_NAME_FIRST', 10, _cp_str(b'Jane')) + \
+        _cp_entry(b'_PATIENT_BIRTHDATE', 10, _cp_str(b'19000101000000')) + \
+        _cp_entry(b'_DATASET_STATUS', 10, _cp_str(b'ACQUIRED')) + \
+        _cp_entry(b'_DATASET_VERSION', 5, be_int.pack(2)) + \
+        _cp_entry(b'_DATASET_KEYWORDS', 11, be_int.pack(1) + _cp_str(b'rest')) + \
+        _cp_entry(b'_PATIENT_INFO', 2, nested) + \
+        _cp_str(b'EndOfParameters')
+    infods_in = op.join(tmp_path, 'in.infods')
+    infods_out = op.join(tmp_path, 'out.infods')
+    with open(infods_in, 'wb') as f:
+        f.write(content)
+    anonymize_infods(infods_in, infods_out)
+    with open(infods_out, 'rb') as f:
+        out = getCPersist(f)
+    assert out['_PATIENT_NAME_FIRST'] == b''
+    assert out['_PATIENT_BIRTHDATE'] == b''
+    assert out['_PATIENT_INFO']['_PATIENT_ID'] == b''
+    assert out['_DATASET_STATUS'] == b'ACQUIRED'
+    assert out['_DATASET_VERSION'] == 2
+    assert out['_DATASET_KEYWORDS'] == [b'rest']
+
+@pytest.mark.skipif(not test_data.is_present(), reason='Test data not present')
+def test_anonymize_ds(tmp_path):
+    meg_fname = str(test_data.meg_airpuff_fname)
+    out_fname = anonymize_ds(meg_fname, tmp_path)
+    assert not glob.glob(op.join(out_fname, '*.hist'))
+    r = readRes4(glob.glob(op.join(out_fname, '*.res4'))[0])
+    assert r.runDesc == b''
+    raw_in = mne.io.read_raw_ctf(meg_fname, system_clock='ignore')
+    raw_out = mne.io.read_raw_ctf(out_fname, system_clock='ignore')
+    assert raw_out.info['subject_info']['his_id'] == ''
+    assert raw_out.info['meas_date'] == raw_in.info['meas_date']
+    assert np.array_equal(raw_in.get_data(stop=1000), raw_out.get_data(stop=1000))
+
+def test_crop_anonymize_ds(tmp_path):
+    from nih2mne.utilities.ctf_anonymize import crop_anonymize_ds
+    from nih2mne.utilities.tests.ctf_fixtures import make_ds
+    #Continuous
+    data = np.random.randint(1, 1000, size=(1, 8, 6000))
+    data[:, :, 4000:] = 0
+    meg_fname, _ = make_ds(op.join(tmp_path, 'ABABABAB_rest_20010101_001.ds'), 
+                           data=data)
+    out_fname = crop_anonymize_ds(meg_fname, op.join(tmp_path, 'out'), anonymize=True,
+                                  crop_trailing_zeros=True)
+    raw_in = mne.io.read_raw_ctf(meg_fname, system_clock='ignore')
+    raw_out = mne.io.read_raw_ctf(out_fname, system_clock='ignore')
+    assert abs(raw_out.n_times - 4000) <= 1
+    assert np.array_equal(raw_out.get_data(), raw_in.get_data(stop=raw_out.n_times))
+    assert raw_out.info['subject_info']['his_id'] == ''
+    assert not glob.glob(op.join(out_fname, '*.hist'))
+    
+    #Trial based acquisition with continuation files
+    data = np.random.randint(1, 1000, size=(6, 8, 600))
+    data[3, :, 300:] = 0
+    data[4:] = 0
+    meg_fname, _ = make_ds(op.join(tmp_path, 'ABABABAB_task_20010101_002.ds'), 
+                           n_samples=600, n_trials=6, trials_per_file=2, data=data)
+    out_fname = crop_anonymize_ds(meg_fname, op.join(tmp_path, 'out'), 
+                                  crop_trailing_zeros=True)
+    raw_in = mne.io.read_raw_ctf(meg_fname, system_clock='ignore')
+    raw_out = mne.io.read_raw_ctf(out_fname, system_clock='ignore')
+    assert raw_out.n_times == 2400
+    assert np.array_equal(raw_out.get_data(), raw_in.get_data(stop=2400))
+    assert sorted(glob.glob(op.join(out_fname, '*meg4'))) == \
+        [op.join(out_fname, 'ABABABAB_task_20010101_002.1_meg4'), 
+         op.join(out_fname, 'ABABABAB_task_20010101_002.meg4')]
+    #Unchanged meg4 files are copied unless linking is requested
+    assert not op.samefile(op.join(out_fname, 'ABABABAB_task_20010101_002.meg4'),
+                           op.join(meg_fname, 'ABABABAB_task_20010101_002.meg4'))
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the memory mapped CTF reader
+"""
+import os.path as op
+import numpy as np
+import mne
+from nih2mne.utilities.ctf_reader import Meg4Reader
+from nih2mne.utilities.tests.ctf_fixtures import make_ds, adc_gain
+
+def test_meg4reader_multifile(tmp_path):
+    ds_fname, data = make_ds(op.join(tmp_path, 'ABABABAB_rest_20010101_001.ds'),
+                             n_samples=600, n_trials=3, trials_per_file=2)
+    ds = Meg4Reader(ds_fname)
+    assert ds.shape == data.shape
+    assert ds.ch_names[5] == 'UADC001'
+
+    #Unscaled and scaled selections
+    assert np.array_equal(ds.get_raw(slice(None), 'UADC001'), data[:, 5, :])
+    assert np.array_equal(ds.raw_view(2), data[2])
+    assert np.allclose(ds[2, 'UADC001', 10:20], data[2, 5, 10:20] * adc_gain)
+    assert ds[:, [5, 6]].shape == (3, 2, 600)
+
+    #Continuous data crossing the meg4 file boundary matches mne
+    raw = mne.io.read_raw_ctf(ds_fname, system_clock='ignore', clean_names=True,
+                              preload=True, verbose=False)
+    assert np.allclose(ds.get_continuous(list(range(8))), raw._data)
+    assert np.allclose(ds.get_continuous(['UADC001', 'UADC002'], 1100, 1300),
+                       raw.get_data(['UADC001', 'UADC002'], 1100, 1300))
+
+def test_read_channels(tmp_path):
+    ds_fname, data = make_ds(op.join(tmp_path, 'ABABABAB_rest_20010101_001.ds'),
+                             n_samples=600, n_trials=3, trials_per_file=2)
+    ds = Meg4Reader(ds_fname)
+    trig = ds.read_channels(['UPPT001', 'UADC001'])
+    assert trig.ch_names == ['UADC001', 'UPPT001']
+    assert trig.data.shape == (3, 2, 600)
+    assert np.array_equal(trig.data, data[:, [5, 7], :])
+    assert np.allclose(trig.get_continuous('UADC001'), ds.get_continuous('UADC001'))
+    assert np.allclose(trig.getDsRawData(1, 'UPPT001'), ds.getDsRawData(1, 'UPPT001'))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the emptyroom index, extraction and cache
+"""
+import os, os.path as op
+import datetime
+import tarfile
+import pytest
+from nih2mne.utilities import emptyroom_utilities as eu
+from nih2mne.utilities.tests.ctf_fixtures import make_ds
+
+def _make_eroom_repo(topdir, dates, truncate=[]):
+    repo = op.join(topdir, 'EmptyRoom')
+    os.makedirs(repo, exist_ok=True)
+    for date in dates:
+        base = f'ABABABAB_EmptyRoom_{date}_01'
+        ds, _ = make_ds(op.join(topdir, base+'.ds'), n_samples=100)
+        tgz = op.join(repo, base+'.tgz')
+        with tarfile.open(tgz, 'w:gz') as tar:
+            tar.add(ds, arcname=base+'.ds')
+            tar.add(op.join(ds, base+'.hist'), arcname='extra_file.txt')
+        if date in truncate:
+            with open(tgz, 'r+b') as f:
+                f.truncate(op.getsize(tgz) // 2)
+    return repo
+
+def test_get_closest_eroom(tmp_path):
+    repo = _make_eroom_repo(tmp_path, ['20200101', '20200110', '20200301'])
+    cache_dir = op.join(tmp_path, 'cache')
+    os.environ['eroom_cache_dir'] = cache_dir
+    try:
+        meg_fname = 'ABABABAB_rest_20200108_001.ds'
+        closest = eu.get_closest_eroom(meg_fname, eroom_location=repo)
+        assert op.basename(closest) == 'ABABABAB_EmptyRoom_20200110_01.tgz'
+        failover = eu.get_closest_eroom(meg_fname, eroom_location=repo, failover=True)
+        assert op.basename(failover) == 'ABABABAB_EmptyRoom_20200101_01.tgz'
+        assert op.exists(op.join(cache_dir, eu._index_name))
+        #Index is rebuilt when the repository changes
+        _make_eroom_repo(op.join(tmp_path, 'new'), ['20200107'])
+        os.rename(op.join(tmp_path, 'new', 'EmptyRoom', 'ABABABAB_EmptyRoom_20200107_01.tgz'),
+                  op.join(repo, 'ABABABAB_EmptyRoom_20200107_01.tgz'))
+        dates, fnames = eu.load_eroom_index(repo)
+        assert dates == sorted(dates) and len(dates) == 4
+        closest = eu.get_closest_eroom(meg_fname, eroom_location=repo)
+        assert op.basename(closest) == 'ABABABAB_EmptyRoom_20200107_01.tgz'
+    finally:
+        os.environ.pop('eroom_cache_dir')
+    #Dictionary input
+    eroom_dict = {datetime.datetime(2020,1,1):'a.tgz', datetime.datetime(2020,6,1):'b.tgz'}
+    assert eu.get_closest_eroom(meg_fname, eroom_dict=eroom_dict) == 'a.tgz'
+
+def test_pull_eroom(tmp_path):
+    repo = _make_eroom_repo(tmp_path, ['20200101', '20200110'], truncate=['20200110'])
+    outdir = op.join(tmp_path, 'out')
+    os.makedirs(outdir)
+    good, bad = sorted(os.listdir(repo))
+    er_fname = eu.pull_eroom(op.join(repo, good), tmpdir=outdir)
+    assert op.basename(er_fname) == good.replace('.tgz', '.ds')
+    assert sorted(os.listdir(outdir)) == [op.basename(er_fname)]
+    with pytest.raises(ValueError):
+        eu.pull_eroom(op.join(repo, bad), tmpdir=outdir)
+    assert not op.exists(op.join(outdir, bad.replace('.tgz', '.ds')))
+
+@pytest.mark.parametrize("prefetch_failover", [False, True])
+def test_fetch_eroom_failover(tmp_path, prefetch_failover):
+    repo = _make_eroom_repo(tmp_path, ['20200101', '20200110'], truncate=['20200110'])
+    er_fname = eu.fetch_eroom('ABABABAB_rest_20200108_001.ds', eroom_location=repo,
+                              cache_dir=op.join(tmp_path, 'cache'),
+                              prefetch_failover=prefetch_failover)
+    assert op.basename(er_fname) == 'ABABABAB_EmptyRoom_20200101_01.ds'
+
+def test_fetch_eroom_prefetch_joined(tmp_path):
+    repo = _make_eroom_repo(tmp_path, ['20200101', '20200110'])
+    outdir = op.join(tmp_path, 'out')
+    os.makedirs(outdir)
+    er_fname = eu.fetch_eroom('ABABABAB_rest_20200108_001.ds', eroom_location=repo,
+                              tmpdir=outdir, prefetch_failover=True)
+    assert op.basename(er_fname) == 'ABABABAB_EmptyRoom_20200110_01.ds'
+    #The failover extraction has finished before returning
+    assert sorted(os.listdir(outdir)) == ['ABABABAB_EmptyRoom_20200101_01.ds',
+                                          'ABABABAB_EmptyRoom_20200110_01.ds']
+
+def test_pull_eroom_cached(tmp_path):
+    repo = _make_eroom_repo(tmp_path, ['20200101', '20200110'])
+    cache_dir = op.join(tmp_path, 'cache')
+    tgz1, tgz2 = sorted(os.listdir(repo))
+    er_fname = eu.pull_eroom_cached(op.join(repo, tgz1), cache_dir=cache_dir)
+    assert op.exists(er_fname)
+    assert er_fname.startswith(cache_dir)
+    #Second pull reuses the extraction
+    mtime = os.stat(op.join(er_fname, os.listdir(er_fname)[0])).st_mtime
+    os.utime(op.dirname(er_fname), (0, 0))
+    assert eu.pull_eroom_cached(op.join(repo, tgz1), cache_dir=cache_dir) == er_fname
+    assert os.stat(op.join(er_fname, os.listdir(er_fname)[0])).st_mtime == mtime
+    #LRU eviction - only one dataset fits in the cache
+    size = eu._dir_size(op.dirname(er_fname))
+    os.utime(op.dirname(er_fname), (0, 0))
+    er_fname2 = eu.pull_eroom_cached(op.join(repo, tgz2), cache_dir=cache_dir,
+                                     max_gb=1.5*size/1e9)
+    assert op.exists(er_fname2)
+    assert not op.exists(er_fname)
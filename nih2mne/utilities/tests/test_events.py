@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the header-only events API
+"""
+import os.path as op
+import numpy as np
+import pandas as pd
+import mne
+import pyctf.ctf_res4 as R
+from nih2mne.utilities.markerfile import write_markerfile
+from nih2mne.utilities.events import (read_annotations, read_ds_info,
+                                      event_counts, bids_events_fname)
+from nih2mne.utilities.tests.ctf_fixtures import make_ds
+
+def _set_pretrig(ds_fname, pretrig):
+    res4_fname = op.join(ds_fname, op.basename(ds_fname)[:-3]+'.res4')
+    r = R.read_res4_structs(res4_fname)
+    r.genRes = list(r.genRes)
+    r.genRes[R.gr_preTrig] = pretrig
+    R.write_res4_structs(res4_fname, r)
+
+def test_read_annotations_matches_mne(tmp_path):
+    ds_fname, _ = make_ds(op.join(tmp_path, 'ABABABAB_task_20010101_001.ds'),
+                          n_samples=600, n_trials=4)
+    _set_pretrig(ds_fname, 60)
+    rng = np.random.default_rng(0)
+    dframe = pd.DataFrame({'onset':rng.uniform(0, 0.89, 200).round(4),
+                           'condition':rng.choice(['stim', 'resp', 'probe'], 200),
+                           'trial':rng.integers(0, 4, 200)})
+    write_markerfile(dframe, ds_filename=ds_fname, trial_column='trial')
+    with open(op.join(ds_fname, 'bad.segments'), 'w') as f:
+        f.write('1\t0.1\t0.3\n3\t0.5\t0.6\n')
+
+    info = read_ds_info(ds_fname)
+    assert info['sfreq'] == 600.
+    assert info['pretrig'] == 60
+    assert info['duration'] == 4.0
+
+    raw = mne.io.read_raw_ctf(ds_fname, system_clock='ignore', verbose=False)
+    annot = read_annotations(ds_fname)
+    assert len(annot) == len(raw.annotations) == 202
+    assert np.array_equal(annot.description, raw.annotations.description)
+    assert np.allclose(annot.onset, raw.annotations.onset - raw.first_time,
+                       atol=1/raw.info['sfreq'])
+    assert np.allclose(annot.duration, raw.annotations.duration,
+                       atol=1/raw.info['sfreq'])
+    expected = pd.DataFrame(raw.annotations).description.value_counts()
+    assert event_counts(ds_fname).equals(expected)
+
+def test_read_annotations_bids_tsv(tmp_path):
+    meg_fname = op.join(tmp_path, 'sub-ON01_ses-1_task-flanker_run-01_meg.ds')
+    ds_fname, _ = make_ds(meg_fname, n_samples=600, n_trials=1)
+    tsv_fname = bids_events_fname(ds_fname)
+    assert tsv_fname.endswith('sub-ON01_ses-1_task-flanker_run-01_events.tsv')
+    pd.DataFrame({'onset':[0.1, 0.2, 0.5], 'duration':[0., 0., 0.],
+                  'trial_type':['left', 'right', 'left'], 'value':[1, 2, 1],
+                  'sample':[60, 120, 300]}).to_csv(tsv_fname, sep='\t', index=False)
+
+    #No MarkerFile in the BIDS dataset - events.tsv is used
+    annot = read_annotations(ds_fname)
+    assert list(annot.description) == ['left', 'right', 'left']
+    assert np.allclose(annot.onset, [0.1, 0.2, 0.5])
+    assert event_counts(tsv_fname).to_dict() == {'left':2, 'right':1}
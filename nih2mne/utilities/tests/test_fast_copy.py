@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the meg4 linking during the bids conversion
+"""
+import os, os.path as op
+from nih2mne.utilities.fast_copy import link_or_copy, copyfile_ctf_linked
+
+def _make_fake_ds(topdir):
+    meg_fname = op.join(topdir, 'ABABABAB_rest_20010101_001.ds')
+    base = op.join(meg_fname, 'ABABABAB_rest_20010101_001')
+    os.mkdir(meg_fname)
+    for ext in ['.res4', '.meg4', '.1_meg4', '.hc', '.infods']:
+        with open(base+ext, 'wb') as f:
+            f.write(ext.encode()*100)
+    with open(op.join(meg_fname, 'MarkerFile.mrk'), 'w') as f:
+        f.write('PATH OF DATASET:\n')
+    return meg_fname
+
+def test_link_or_copy(tmp_path):
+    src = op.join(tmp_path, 'test.meg4')
+    with open(src, 'wb') as f:
+        f.write(os.urandom(1000))
+    dst = op.join(tmp_path, 'out.meg4')
+    method = link_or_copy(src, dst)
+    assert method in ['reflink', 'hardlink', 'copy_file_range', 'copy']
+    with open(src, 'rb') as f1, open(dst, 'rb') as f2:
+        assert f1.read() == f2.read()
+    if method == 'hardlink':
+        assert os.stat(src).st_ino == os.stat(dst).st_ino
+    #No shared data without hardlinks
+    dst_nolink = op.join(tmp_path, 'out_nolink.meg4')
+    assert link_or_copy(src, dst_nolink, hardlink=False) != 'hardlink'
+    assert os.stat(src).st_ino != os.stat(dst_nolink).st_ino
+    with open(src, 'rb') as f1, open(dst_nolink, 'rb') as f2:
+        assert f1.read() == f2.read()
+
+def test_copyfile_ctf_linked(tmp_path):
+    meg_fname = _make_fake_ds(tmp_path)
+    dest = op.join(tmp_path, 'sub-S01_ses-1_task-rest_run-01_meg.ds')
+    copyfile_ctf_linked(meg_fname, dest)
+    out_files = sorted(os.listdir(dest))
+    assert out_files == ['MarkerFile.mrk', 
+                         'sub-S01_ses-1_task-rest_run-01_meg.1_meg4',
+                         'sub-S01_ses-1_task-rest_run-01_meg.hc',
+                         'sub-S01_ses-1_task-rest_run-01_meg.infods',
+                         'sub-S01_ses-1_task-rest_run-01_meg.meg4',
+                         'sub-S01_ses-1_task-rest_run-01_meg.res4']
+    #Small files are independent copies
+    src_res4 = op.join(meg_fname, 'ABABABAB_rest_20010101_001.res4')
+    dst_res4 = op.join(dest, 'sub-S01_ses-1_task-rest_run-01_meg.res4')
+    assert os.stat(src_res4).st_ino != os.stat(dst_res4).st_ino
+    with open(op.join(dest, 'sub-S01_ses-1_task-rest_run-01_meg.meg4'), 'rb') as f:
+        assert f.read() == b'.meg4'*100
@@ -43,3 +43,47 @@ def test_make_swarm_file():
 def test_make_serial_proc():
     proc=make_serial_proc(test_csv_filled, run=False, return_cmd=True)
     assert proc=='make_meg_bids.py -bids_dir bids_dir -subjid_input test1 -bids_id BIDSTEST1 -meg_input_dir /data/test -afni_brik /data/mri/mri.BRIK;make_meg_bids.py -bids_dir /tmp/test -subjid_input test2 -bids_id BIDSTEST2 -meg_input_dir /tmp -mri_bsight /test/tmp.nii -mri_bsight_elec /test/tmp.txt -bids_session 2'
+
+def test_make_row_argv():
+    from nih2mne.utilities.make_meg_bids_fromcsv import make_row_argv
+    dframe = read_csv_entries(test_csv_filled)
+    argv = make_row_argv(dframe.loc[0], anonymize=True, 
+                         additional_args='-ignore_eroom -autocrop_zeros')
+    assert argv == ['-bids_dir', 'bids_dir', '-subjid_input', 'test1', 
+                    '-bids_id', 'BIDSTEST1', '-meg_input_dir', '/data/test',
+                    '-mri_brik', '/data/mri/mri.BRIK', '-anonymize', 
+                    '-ignore_eroom', '-autocrop_zeros']
+
+def test_make_batch_proc(tmp_path):
+    from nih2mne.utilities.make_meg_bids_fromcsv import make_batch_proc
+    with open(bids_entry_template) as f:
+        lines = f.readlines()
+    for subj in ['test1', 'test2']:
+        lines.append(f'{tmp_path}/bids,{subj},{subj.upper()},{tmp_path}/missing_{subj},{tmp_path}/mri+orig.BRIK,,,\n')
+    csvfile = op.join(tmp_path, 'entries.csv')
+    with open(csvfile, 'w') as f:
+        f.writelines(lines)
+    summary_fname = op.join(tmp_path, 'summary.csv')
+    summary = make_batch_proc(csvfile, n_workers=2, summary_fname=summary_fname)
+    assert op.exists(summary_fname)
+    assert list(summary.subjid_input) == ['test1', 'test2']
+    assert all(summary.status == 'failed')
+    assert all(summary.error.str.contains('does not exist'))
+
+def test_make_batch_proc_success(tmp_path):
+    from nih2mne.utilities.make_meg_bids_fromcsv import make_batch_proc
+    from nih2mne.utilities.tests.ctf_fixtures import make_ds
+    meg_dir = op.join(tmp_path, 'meg')
+    make_ds(op.join(meg_dir, 'ABABABAB_rest_20010101_001.ds'), n_samples=600, n_trials=2)
+    with open(bids_entry_template) as f:
+        lines = f.readlines()
+    lines.append(f'{tmp_path}/bids,ABABABAB,S01,{meg_dir},,,,\n')
+    csvfile = op.join(tmp_path, 'entries.csv')
+    with open(csvfile, 'w') as f:
+        f.writelines(lines)
+    summary = make_batch_proc(csvfile, n_workers=1, summary_fname=None, 
+                              additional_args='-ignore_mri_checks -ignore_eroom')
+    assert list(summary.status) == ['success']
+    assert list(summary.error) == ['']
+    assert op.exists(op.join(tmp_path, 'bids', 'sub-S01', 'ses-1', 'meg', 
+                             'sub-S01_ses-1_task-rest_run-01_meg.ds'))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the MarkerFile reader/writer
+"""
+import os, os.path as op
+import numpy as np
+import pandas as pd
+import mne
+from nih2mne.utilities import markerfile_write as mw
+from nih2mne.utilities.markerfile import read_markerfile, write_markerfile
+from nih2mne.utilities.tests.ctf_fixtures import make_ds
+
+def _legacy_markerfile(dframe, ds_filename, mrk_output_file):
+    '''Block by block append from markerfile_write'''
+    stim_names = dframe['condition'].dropna().unique()
+    mw.append_file(mrk_output_file, textwrite=mw.return_header1(ds_filename))
+    mw.append_file(mrk_output_file, textwrite=mw.return_header2(stim_names))
+    mw.append_stim_vector(dframe, column_name='condition', classid=1, 
+                          mrk_output_file=mrk_output_file)
+    mw.append_file(mrk_output_file, textwrite='\n')
+
+def test_markerfile_roundtrip(tmp_path):
+    ds_fname, _ = make_ds(op.join(tmp_path, 'ABABABAB_task_20010101_001.ds'))
+    rng = np.random.default_rng(0)
+    dframe = pd.DataFrame({'onset':np.sort(rng.uniform(0, 9.9, 500)),
+                           'condition':rng.choice(['stim', 'resp', 'probe', None], 500),
+                           'trial':0})
+    
+    np.random.seed(0)
+    _legacy_markerfile(dframe, ds_fname, op.join(tmp_path, 'legacy.mrk'))
+    np.random.seed(0)
+    mrk_fname = write_markerfile(dframe, ds_filename=ds_fname)
+    with open(op.join(tmp_path, 'legacy.mrk')) as f1, open(mrk_fname) as f2:
+        assert f1.read() == f2.read()
+    
+    #Reader matches the input and the mne annotations
+    events = dframe.dropna()
+    out = read_markerfile(ds_fname)
+    assert len(out) == len(events)
+    for cond in events.condition.unique():
+        assert np.array_equal(out[out.condition==cond].onset.values, 
+                              events[events.condition==cond].onset.values)
+    raw = mne.io.read_raw_ctf(ds_fname, system_clock='ignore', verbose=False)
+    assert np.allclose(np.sort(raw.annotations.onset), np.sort(out.onset.values), 
+                       atol=1/raw.info['sfreq'])
+    
+    #Rewrite keeps a backup and leaves no temporary files
+    np.random.seed(0)
+    mw.main(dframe=dframe[dframe.condition=='stim'], ds_filename=ds_fname)
+    ds_files = os.listdir(ds_fname)
+    assert len([i for i in ds_files if i.startswith('MarkerFile.mrkBAK')]) == 1
+    assert not any(i.startswith('.MarkerFile') for i in ds_files)
+    assert set(read_markerfile(ds_fname).condition) == {'stim'}
+
+def test_markerfile_trials(tmp_path):
+    dframe = pd.DataFrame({'onset':[0.1, 0.2, 0.15], 'condition':['a', 'a', 'b'],
+                           'trial':[0, 2, 1]})
+    mrk_fname = write_markerfile(dframe, ds_filename='test.ds', trial_column='trial',
+                                 mrk_output_file=op.join(tmp_path, 'MarkerFile.mrk'))
+    out = read_markerfile(mrk_fname)
+    assert list(out.trial) == [0, 2, 1]
+    assert list(out.condition) == ['a', 'a', 'b']
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the raw trigger detection cache
+"""
+import os, os.path as op
+import numpy as np
+import pandas as pd
+from nih2mne.utilities import trigger_utilities as tu
+from nih2mne.utilities.trigger_cache import TriggerCache
+from nih2mne.utilities.tests.ctf_fixtures import make_ds
+
+def _make_trigger_ds(ds_fname):
+    data = np.random.default_rng(0).integers(1, 1000, size=(2, 8, 6000))
+    data[:, 5] = 10
+    for onset in [1000, 3000]:
+        data[:, 5, onset] = 30000
+        data[:, 5, onset+1:onset+100] = 50000
+    data[:, 7] = 0
+    data[:, 7, 2000:2010] = 100000
+    data[:, 7, 4000:4010] = 300000
+    return make_ds(ds_fname, n_samples=6000, n_trials=2, data=data)[0]
+
+def test_trigger_cache(tmp_path, monkeypatch):
+    ds_fname = _make_trigger_ds(op.join(tmp_path, 'ABABABAB_task_20010101_001.ds'))
+    monkeypatch.setenv('trigger_cache_dir', op.join(tmp_path, 'cache'))
+    trig = TriggerCache(ds_fname)
+    assert op.dirname(trig.cache_fname) == op.join(tmp_path, 'cache')
+    ana = trig.threshold_detect(channel='UADC001', mark='stim', invert=False)
+    dig = trig.detect_digital(channel='UPPT001', trial=1)
+    inverted = trig.check_analog_inverted(ch_name='UADC001')
+    pd.testing.assert_frame_equal(ana, tu.threshold_detect(ds_fname, channel='UADC001', mark='stim'))
+    pd.testing.assert_frame_equal(dig, tu.detect_digital(ds_fname, channel='UPPT001', trial=1))
+    assert inverted == tu.check_analog_inverted(ds_fname, ch_name='UADC001')
+    trig.save()
+    
+    assert not [i for i in os.listdir(ds_fname) if i.endswith('.trigcache.json')]
+    #Second pass is served from the cache without reading the meg4 data
+    with monkeypatch.context() as m:
+        m.setattr(tu, 'read_trigger_channels', None)
+        trig = TriggerCache(ds_fname)
+        pd.testing.assert_frame_equal(ana, trig.threshold_detect(channel='UADC001', 
+                                                                 mark='stim', invert=False))
+        pd.testing.assert_frame_equal(dig, trig.detect_digital(channel='UPPT001', trial=1))
+        assert trig.check_analog_inverted(ch_name='UADC001') == inverted
+        assert (trig.hits == 3) and (trig.modified == False)
+    
+    #Different settings are a new entry
+    _ = trig.threshold_detect(channel='UADC001', mark='stim', invert=True)
+    assert trig.modified == True
+    
+    #Changing the meg4 invalidates the cache
+    trig.save()
+    meg4 = op.join(ds_fname, 'ABABABAB_task_20010101_001.meg4')
+    st = os.stat(meg4)
+    os.utime(meg4, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    trig = TriggerCache(ds_fname)
+    assert trig.entries == {}
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the declarative trigger rule engine
+"""
+import os, os.path as op
+import numpy as np
+import pandas as pd
+import pytest
+import mne
+from nih2mne.utilities import trigger_utilities as tu
+from nih2mne.utilities import trigger_rules as tr
+from nih2mne.utilities.tests.ctf_fixtures import make_trigger_ds
+
+spec = {'analog':[{'channel':'UADC001', 'name':'projector'},
+                  {'channel':'UADC002', 'name':'response'}],
+        'digital':[{'channel':'UPPT001', 'codes':{1:'stim_a', 3:'stim_b'}}],
+        'projector_correction':{'events':['stim_a', 'stim_b']},
+        'parse_marks':[{'name':'stim_a_resp', 'lead':'stim_a', 'lag':'response', 
+                        'window':[0, 1]}],
+        'keep':['stim_a', 'stim_b', 'stim_a_resp']}
+
+def test_validate_rule_spec(tmp_path):
+    out = tr.validate_rule_spec(spec)
+    assert out['digital'][0]['codes'] == {'1':'stim_a', '3':'stim_b'}
+    assert out['parse_marks'][0]['marker_on'] == 'lead'
+    fname = tr.save_rule_spec(spec, op.join(tmp_path, 'task_v1.yml'))
+    assert tr.load_rule_spec(fname) == out
+    with pytest.raises(ValueError):
+        tr.validate_rule_spec({**spec, 'keep':[]})
+    with pytest.raises(ValueError):
+        tr.validate_rule_spec({**spec, 'unknown':1})
+    with pytest.raises(ValueError):
+        tr.validate_rule_spec({**spec, 'parse_marks':[{'name':'a', 'lead':'b', 'lag':'c', 
+                                                       'window':[0,1], 'marker_on':'lag', 
+                                                       'null_window':True}]})
+
+def test_apply_rules(tmp_path):
+    ds_fname = make_trigger_ds(op.join(tmp_path, 'ABABABAB_task_20010101_001.ds'))
+    out = tr.apply_rules(spec, ds_fname)
+    
+    #Same as the generated python script steps
+    dframe_list = [tu.threshold_detect(ds_fname, channel='UADC001', mark='projector'),
+                   tu.threshold_detect(ds_fname, channel='UADC002', mark='response')]
+    dig_dframe = tu.detect_digital(ds_fname, channel='UPPT001')
+    dig_dframe.loc[dig_dframe.condition=='1', 'condition'] = 'stim_a'
+    dig_dframe.loc[dig_dframe.condition=='3', 'condition'] = 'stim_b'
+    dframe = tu.append_conditions(dframe_list + [dig_dframe])
+    dframe = tu.correct_to_projector_asof(dframe, event_list=['stim_a', 'stim_b'])
+    dframe = tu.parse_marks(dframe, lead_condition='stim_a', lag_condition='response', 
+                            window=[0, 1], marker_name='stim_a_resp').dropna()
+    ref = tu.append_conditions([dframe[dframe.condition==i] for i in spec['keep']])
+    pd.testing.assert_frame_equal(out, ref)
+    assert out.condition.value_counts().to_dict() == {'stim_a':2, 'stim_b':2, 'stim_a_resp':1}
+    assert np.allclose(out[out.condition=='stim_a'].onset, np.array([1010, 3010]) / 600)
+
+def test_process_datasets(tmp_path):
+    ds_list = [make_trigger_ds(op.join(tmp_path, f'ABABABAB_task_20010101_00{i}.ds')) 
+               for i in [1, 2]]
+    ds_list.append(op.join(tmp_path, 'missing.ds'))
+    spec_fname = tr.save_rule_spec(spec, op.join(tmp_path, 'task_v1.yml'))
+    results = tr.process_datasets(spec_fname, ds_list, n_workers=2)
+    assert [i[2] for i in results] == ['success', 'success', 'failed']
+    assert results[0][4] == {'stim_a':2, 'stim_b':2, 'stim_a_resp':1}
+    for ds_fname in ds_list[:2]:
+        assert op.exists(op.join(ds_fname, 'MarkerFile.mrk'))
+        raw = mne.io.read_raw_ctf(ds_fname, system_clock='ignore', verbose=False)
+        assert len(raw.annotations) == 5
@@ -44,3 +44,227 @@ def test_correct_to_projector():
     #Check all corrected onsets match test values
     assert np.allclose(test_output_dframe.onset.values,out_dframe.onset.values, atol=0.0001)
     
+
+def test_detectors_preloaded_channels(tmp_path):
+    from nih2mne.utilities.tests.ctf_fixtures import make_ds
+    from nih2mne.utilities.trigger_utilities import (threshold_detect, detect_digital, 
+                                                     read_trigger_channels)
+    data = np.random.default_rng(0).integers(1, 1000, size=(1, 8, 6000))
+    #Analog pulses with a 1 sample rise on UADC001, digital codes on UPPT001
+    data[0, 5] = 10
+    for onset in [1000, 3000]:
+        data[0, 5, onset] = 30000
+        data[0, 5, onset+1:onset+100] = 50000
+    data[0, 7] = 0
+    data[0, 7, 2000:2010] = 100000
+    data[0, 7, 4000:4010] = 300000
+    ds_fname, _ = make_ds(op.join(tmp_path, 'ABABABAB_task_20010101_001.ds'), 
+                          n_samples=6000, data=data)
+    trig_data = read_trigger_channels(ds_fname)
+    assert trig_data.ch_names == ['UADC001', 'UADC002', 'UPPT001']
+    
+    file_dframe = threshold_detect(ds_fname, channel='UADC001', mark='stim')
+    preload_dframe = threshold_detect(trig_data, channel='UADC001', mark='stim')
+    assert len(file_dframe) == 2
+    assert file_dframe.equals(preload_dframe)
+    
+    file_dframe = detect_digital(ds_fname, channel='UPPT001')
+    preload_dframe = detect_digital(trig_data, channel='UPPT001')
+    assert list(file_dframe.condition) == ['1', '3']
+    assert file_dframe.equals(preload_dframe)
+
+def _threshold_onsets_loop(x, d, ampThresh, derivThresh, s, e, deadSamp):
+    '''Previous sample by sample implementation - reference for the tests'''
+    onsets = []
+    e = min(e, len(d)) #d is shorter than x when t0/t1 are set
+    while s < e:
+        if x[s] > ampThresh and d[s] > derivThresh:
+            onsets.append(s)
+            s += deadSamp
+        s += 1
+    return onsets
+
+def test_threshold_onsets_matches_loop():
+    from nih2mne.utilities.trigger_utilities import _threshold_onsets
+    rng = np.random.default_rng(0)
+    for dead_samp in [0, 5, 119]:
+        x = rng.random(20000)
+        d = rng.random(19999)*2 - 1
+        for s, e in [(1, 19999), (500, 7000)]:
+            ref = _threshold_onsets_loop(x, d, 0.5, 0.1, s, e, dead_samp)
+            assert len(ref) > 0
+            assert list(_threshold_onsets(x, d, 0.5, 0.1, s, e, dead_samp)) == ref
+
+# Onsets from the baseline (pyctf reader / loop) threshold_detect on the
+# make_trigger_ds dataset
+baseline_cases = {'default': {}, 'invert': dict(invert=True), 
+                  'bandpass': dict(lo=1, hi=40), 'window': dict(t0=1, t1=8), 
+                  'neg_deriv': dict(derivThresh=-0.1), 
+                  'amp_dead': dict(ampThresh=0.3, deadTime=0.5),
+                  'invert_neg_deriv': dict(invert=True, derivThresh=-0.1)}
+
+@pytest.mark.parametrize("case", list(baseline_cases))
+def test_threshold_detect_regression(tmp_path, case):
+    from nih2mne.utilities import trigger_utilities
+    from nih2mne.utilities.tests.ctf_fixtures import make_trigger_ds
+    ds_fname = str(tmp_path / 'trig.ds')
+    make_trigger_ds(ds_fname)
+    baseline = pd.read_csv(op.join(topdir, 'utilities', 'tests', 
+                                   'test_threshold_detect_baseline.csv'))
+    for ch_name in ['UADC001', 'UADC002']:
+        ref = baseline[(baseline.case == case) & (baseline.channel == ch_name)]
+        out = trigger_utilities.threshold_detect(ds_fname, channel=ch_name, 
+                                                 mark='evt', **baseline_cases[case])
+        assert out.trial.tolist() == ref.trial.tolist()
+        np.testing.assert_allclose(out.onset.astype(float), ref.onset, rtol=0, atol=1e-9)
+
+@pytest.mark.parametrize("marker_on,null_window,window", 
+                         [('lead', False, [0, 0.5]), ('lag', False, [0, 0.5]),
+                          ('lead', True, [0, 0.5]), ('lead', False, [-0.2, 0.05]),
+                          ('lag', False, [0.1, 1.5])])
+def test_parse_marks_matches_apply(monkeypatch, marker_on, null_window, window):
+    from nih2mne.utilities import trigger_utilities
+    dframe_fname = op.join(topdir, 'utilities','tests', 
+                           'test_initial_trigger_flanker_dframe.csv')
+    dframe = pd.read_csv(dframe_fname)
+    for lead, lag in [('fixation', 'projector'), ('right_con', 'response_r'), 
+                      ('projector', 'fixation')]:
+        if lag == 'response_r':
+            #Build a lag condition from the response channel
+            dframe.loc[dframe.channel == 'UADC006', 'condition'] = 'response_r'
+        kwargs = dict(dframe=dframe, lead_condition=lead, lag_condition=lag,
+                      window=window, marker_on=marker_on, null_window=null_window,
+                      marker_name='evt')
+        out = trigger_utilities.parse_marks(**kwargs)
+        with monkeypatch.context() as m:
+            m.setattr(trigger_utilities, '_is_sorted', lambda vals: False)
+            ref = trigger_utilities.parse_marks(**kwargs)
+        pd.testing.assert_frame_equal(out, ref)
+
+def test_correct_to_projector_asof():
+    from nih2mne.utilities.trigger_utilities import correct_to_projector_asof
+    dframe = pd.read_csv(op.join(topdir, 'utilities','tests', 
+                                 'test_initial_trigger_flanker_dframe.csv'))
+    test_output_dframe = pd.read_csv(op.join(topdir, 'utilities','tests', 
+                                             'test_projCorrected_flanker_dframe.csv'))
+    event_list = ['fixation','right_con','right_incon','left_incon','left_con']
+    
+    out_dframe, stats = correct_to_projector_asof(dframe, event_list=event_list, 
+                                                  return_stats=True)
+    ref_dframe = correct_to_projector(dframe, event_list=event_list)
+    pd.testing.assert_frame_equal(out_dframe, ref_dframe)
+    assert np.allclose(test_output_dframe.onset.values,out_dframe.onset.values, atol=0.0001)
+    assert list(stats.index) == event_list
+    assert np.all(stats.dropped == 0)
+    assert np.all((stats['max'] > 0) & (stats['max'] <= 200))
+    
+    #Events without a projector in the latency window are dropped
+    dframe.loc[dframe.condition=='projector', 'onset'] += 0.05
+    out_dframe, stats = correct_to_projector_asof(dframe, event_list=event_list, 
+                                                  max_latency=0.05, return_stats=True)
+    assert np.all(stats.dropped == stats['count'])
+    assert not np.any(out_dframe.condition.isin(event_list))
+
+def test_correct_to_projector_asof_symmetric():
+    from nih2mne.utilities.trigger_utilities import correct_to_projector_asof
+    #Projector before/after the event, two projectors in the window and
+    #an event without a projector
+    dframe = pd.DataFrame({'onset':[1.0, 1.05, 2.1, 2.15, 3.0, 3.1, 3.15, 5.0],
+                           'channel':['UADC016', 'UADC006', 'UADC007', 'UADC016',
+                                      'UADC006', 'UADC016', 'UADC016', 'UADC007'],
+                           'condition':['projector', 'stim', 'resp', 'projector',
+                                        'stim', 'projector', 'projector', 'resp'],
+                           'trial':0})
+    ref_dframe = correct_to_projector(dframe, event_list=['stim', 'resp'])
+    out_dframe, stats = correct_to_projector_asof(dframe, event_list=['stim', 'resp'],
+                                                  return_stats=True)
+    pd.testing.assert_frame_equal(out_dframe, ref_dframe)
+    #The stim at 3.0 is written at both the 3.1 and 3.15 projectors
+    assert stats.loc['stim', 'corrected'] == 2
+    assert stats.loc['stim', 'dropped'] == 0
+    assert stats.loc['stim', 'surplus'] == 1
+    assert stats.loc['resp', 'dropped'] == 1
+    assert np.all(stats.dropped >= 0)
+    
+    #Forward only search is not identical
+    out_dframe = correct_to_projector_asof(dframe, event_list=['stim', 'resp'],
+                                           direction='forward')
+    assert out_dframe.condition.value_counts()['stim'] == 1
+    with pytest.raises(ValueError):
+        correct_to_projector_asof(dframe, event_list=['stim'], direction='up')
+
+def test_decode_digital(tmp_path):
+    from nih2mne.utilities.tests.ctf_fixtures import make_ds
+    from nih2mne.utilities.trigger_utilities import (decode_digital, detect_digital, 
+                                                     return_edge_timing)
+    from nih2mne.utilities.ctf_reader import Meg4Reader
+    rng = np.random.default_rng(0)
+    data = rng.integers(1, 1000, size=(3, 8, 600))
+    data[:, 6:] = 0
+    for trial in range(3):
+        for onset in rng.choice(np.arange(1, 590), 10, replace=False):
+            data[trial, 7, onset:onset+5] += rng.integers(1, 8) * 100000
+            data[trial, 6, onset+2:onset+4] = 200000
+    ds_fname, _ = make_ds(op.join(tmp_path, 'ABABABAB_task_20010101_001.ds'), 
+                          n_samples=600, n_trials=3, data=data)
+    
+    #Legacy per sample / per trial reference
+    ds = Meg4Reader(ds_fname)
+    ref = []
+    for trial in range(3):
+        for ch_name in ['UADC002', 'UPPT001']:
+            edges = return_edge_timing(ds.getDsRawData(trial, ch_name))
+            for samp in np.argwhere(edges > 0):
+                ref.append((trial, ds.getTimePt(samp), str(int(edges[samp][0])), ch_name))
+    ref = pd.DataFrame(ref, columns=['trial', 'onset', 'condition', 'channel'])
+    ref = ref.sort_values(['trial', 'onset'], kind='stable', ignore_index=True)
+    
+    out = decode_digital(ds_fname, channels=['UADC002', 'UPPT001'])
+    assert np.array_equal(out.trial.values, ref.trial.values)
+    assert np.array_equal(out.onset.values, ref.onset.values)
+    assert list(out.condition) == list(ref.condition)
+    assert list(out.channel) == list(ref.channel)
+    
+    #Single trial / channel matches detect_digital and the default is all UPPT
+    all_ppt = decode_digital(ds_fname)
+    assert set(all_ppt.channel) == {'UPPT001'}
+    for trial in range(3):
+        single = detect_digital(ds_fname, channel='UPPT001', trial=trial)
+        sel = all_ppt[all_ppt.trial == trial].reset_index(drop=True)
+        assert np.array_equal(single.onset.values, sel.onset.values)
+        assert list(single.condition) == list(sel.condition)
+
+def test_threshold_detect_chunked(tmp_path):
+    from nih2mne.utilities.tests.ctf_fixtures import make_ds
+    from nih2mne.utilities import trigger_utilities as tu
+    rng = np.random.default_rng(0)
+    data = rng.integers(1, 1000, size=(2, 8, 6000))
+    data[:, 5] = rng.integers(0, 2000, size=(2, 6000))
+    for trial in range(2):
+        #Pulses with 1 sample ramps, some closer than the dead time
+        for onset in [499, 500+trial, 1000, 1030, 2047, 3999, 5900]:
+            data[trial, 5, onset] = 30000
+            data[trial, 5, onset+1:onset+40] = 50000
+    ds_fname, _ = make_ds(op.join(tmp_path, 'ABABABAB_task_20010101_001.ds'), 
+                          n_samples=6000, n_trials=2, data=data)
+    ref = tu.threshold_detect_samples(ds_fname, channel='UADC001')
+    assert len(ref) > 8
+    for chunk_size in [2, 37, 500, 1001, 6000, 10000]:
+        for kwargs in [{}, dict(invert=True), dict(derivThresh=-0.1), dict(trial=1),
+                       dict(lo=1, hi=40)]:
+            out = tu.threshold_detect_samples(ds_fname, channel='UADC001', 
+                                              chunk_size=chunk_size, **kwargs)
+            assert out == tu.threshold_detect_samples(ds_fname, channel='UADC001', **kwargs)
+    dframe = tu.threshold_detect(ds_fname, channel='UADC001', mark='stim', chunk_size=100)
+    pd.testing.assert_frame_equal(dframe, tu.threshold_detect(ds_fname, channel='UADC001', 
+                                                              mark='stim'))
+    
+    #Streaming histogram
+    for ch_name in ['UADC001', 'UADC002']:
+        ds = tu.Meg4Reader(ds_fname)
+        counts, volts = np.histogram(ds.getDsData(0, ch_name))
+        s_counts, s_volts = tu._streaming_histogram(ds, 0, ds.channel[ch_name], 333)
+        assert np.array_equal(counts, s_counts)
+        assert np.allclose(volts, s_volts)
+        assert tu.check_analog_inverted(ds_fname, ch_name, chunk_size=333) == \
+            tu.check_analog_inverted(ds_fname, ch_name)
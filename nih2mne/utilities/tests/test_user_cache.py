@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the per user cache folders
+"""
+import os, os.path as op
+import getpass
+import tempfile
+from nih2mne.utilities.user_cache import get_user_cache_dir
+
+def test_get_user_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(getpass, 'getuser', lambda : 'megcore')
+    assert get_user_cache_dir('eroom_cache') == \
+        op.join(tempfile.gettempdir(), 'nih2mne_eroom_cache_megcore')
+
+    #No passwd entry for the user
+    def _no_user():
+        raise KeyError('getpwuid(): uid not found')
+    monkeypatch.setattr(getpass, 'getuser', _no_user)
+    assert get_user_cache_dir('eroom_cache') == \
+        op.join(tempfile.gettempdir(), f'nih2mne_eroom_cache_{os.getuid()}')
+
+    monkeypatch.setenv('eroom_cache_dir', str(tmp_path))
+    assert get_user_cache_dir('eroom_cache', env_var='eroom_cache_dir') == str(tmp_path)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of the raw trigger detections for a CTF dataset.
+
+The detected edges (channel, onset sample, value/threshold settings,
+inversion) are stored in a json file in the user cache folder and are
+keyed by the dataset path and the size and mtime of the meg4 files.  Re-running a trigger
+processing script only re-applies the parsing rules to the cached edges and
+the meg4 data is not read again.  The cache is discarded if the meg4 files
+change.
+
+    trig = TriggerCache(meg_fname)
+    dframe = trig.threshold_detect(channel='UADC016', mark='projector')
+    dig_dframe = trig.detect_digital(channel='UPPT001')
+    trig.save()
+
+The cache is never written inside the dataset, so it is not copied into the
+BIDS tree or the anonymized datasets.  Set the trigger_cache_dir environment 
+variable to override the cache folder.
+
+@author: jstout
+"""
+import os, os.path as op
+import json
+import hashlib
+import tempfile
+import pandas as pd
+from nih2mne.utilities.ctf_reader import Meg4Reader, list_meg4
+from nih2mne.utilities import trigger_utilities as tu
+from nih2mne.utilities.user_cache import get_user_cache_dir
+
+# Increment if the detection code changes the output
+_cache_version = 2
+
+def meg4_signature(dsname):
+    '''[name, size, mtime_ns] of each meg4 file in the dataset'''
+    return [[op.basename(i), os.stat(i).st_size, os.stat(i).st_mtime_ns]
+            for i in list_meg4(dsname)]
+
+def default_cache_fname(dsname):
+    '''Cache file in the user cache dir - keyed by the dataset path'''
+    dsname = str(dsname).rstrip('/')
+    base = op.basename(dsname)[:-3]
+    cache_dir = get_user_cache_dir('trigger_cache', env_var='trigger_cache_dir')
+    ds_hash = hashlib.md5(op.abspath(dsname).encode()).hexdigest()[:12]
+    return op.join(cache_dir, f'{base}_{ds_hash}.trigcache.json')
+
+def _entry_key(kind, **kwargs):
+    return json.dumps([kind, kwargs], sort_keys=True)
+
+class TriggerCache():
+    def __init__(self, dsname, cache_fname=None):
+        '''
+        Cached trigger detections for a dataset.  The detector methods match
+        the trigger_utilities functions without the dataset argument.
+
+        Parameters
+        ----------
+        dsname : str
+            CTF dataset
+        cache_fname : str, optional
+            Cache file. The default is default_cache_fname(dsname).
+
+        '''
+        self.dsname = str(dsname).rstrip('/')
+        self.cache_fname = cache_fname or default_cache_fname(self.dsname)
+        self.signature = meg4_signature(self.dsname)
+        self._trig_data = None
+        self.modified = False
+        self.hits = 0
+        self.entries = {}
+        cache = self._load()
+        if cache is not None:
+            self.sfreq, self.pretrig = cache['sfreq'], cache['pretrig']
+            self.entries = cache['entries']
+        else:
+            ds = Meg4Reader(self.dsname)
+            self.sfreq, self.pretrig = float(ds.sfreq), int(ds.pretrig)
+
+    def _load(self):
+        if not op.exists(self.cache_fname):
+            return None
+        try:
+            with open(self.cache_fname) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (cache.get('version') != _cache_version) or \
+            (cache.get('meg4') != self.signature):
+            return None
+        return cache
+
+    @property
+    def trig_data(self):
+        '''Trigger channels - only read from disk on a cache miss'''
+        if self._trig_data is None:
+            self._trig_data = tu.read_trigger_channels(self.dsname)
+        return self._trig_data
+
+    def _get(self, key, func):
+        if key in self.entries:
+            self.hits += 1
+        else:
+            self.entries[key] = func()
+            self.modified = True
+        return self.entries[key]
+
+    def threshold_detect(self, channel=None, mark=None, invert=False, **kwargs):
+        '''Cached trigger_utilities.threshold_detect'''
+        key = _entry_key('threshold', channel=channel, invert=bool(invert), **kwargs)
+        marklist = self._get(key, lambda : tu.threshold_detect_samples(
+            self.trig_data, channel=channel, invert=invert, **kwargs))
+        output = pd.DataFrame([(tr, i / self.sfreq) for tr, i in marklist],
+                              columns=['trial', 'onset'])
+        output['condition'] = mark
+        output['channel'] = channel
+        return output
+
+    def detect_digital(self, channel='UPPT001', trial=0):
+        '''Cached trigger_utilities.detect_digital'''
+        key = _entry_key('digital', channel=channel, trial=int(trial))
+        def _detect():
+            tmp = tu.detect_digital(self.trig_data, channel=channel, trial=trial)
+            samples = (tmp.onset.values * self.sfreq).round().astype(int) + self.pretrig
+            return [[int(i), j] for i, j in zip(samples, tmp.condition.values)]
+        edges = self._get(key, _detect)
+        samples = [i for i, j in edges]
+        tmp_dframe = pd.DataFrame({'onset':tu._samples_to_times(self, samples),
+                                   'condition':[j for i, j in edges]})
+        tmp_dframe['channel'] = channel
+        tmp_dframe['trial'] = trial
+        return tmp_dframe[['trial', 'onset', 'condition', 'channel']]
+
+    def check_analog_inverted(self, ch_name='UADC001'):
+        '''Cached trigger_utilities.check_analog_inverted'''
+        key = _entry_key('inverted', channel=ch_name)
+        return self._get(key, lambda : bool(tu.check_analog_inverted(
+            self.trig_data, ch_name=ch_name)))
+
+    def save(self):
+        '''Write the cache if there are new detections'''
+        if not self.modified:
+            return
+        cache = {'version':_cache_version, 'meg4':self.signature,
+                 'sfreq':self.sfreq, 'pretrig':self.pretrig,
+                 'entries':self.entries}
+        os.makedirs(op.dirname(self.cache_fname), exist_ok=True)
+        fd, tmp_fname = tempfile.mkstemp(dir=op.dirname(self.cache_fname),
+                                         suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp_fname, self.cache_fname)
+        self.modified = False
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Declarative trigger processing rules.
+
+The trigger_code_gui selections are stored as a yaml rule spec (in
+~/megcore/trigproc by default) instead of only as a generated python script.
+The spec is compiled to a list of processing steps that run in process on
+the vectorized trigger code (cached detections, batched projector
+correction, searchsorted parse_marks) and can be applied to any number of
+datasets in a pool of workers.
+
+Rule spec (yaml):
+
+    version: 1
+    analog:
+      - {channel: UADC016, name: projector, invert: false, auto_invert: true}
+      - {channel: UADC006, name: response_l, invert: false}
+    digital:
+      - channel: UPPT001
+        codes: {'1': fixation, '2': right_con}
+    projector_correction: {events: [fixation, right_con], max_latency: 0.2}
+    offset: {events: [fixation], seconds: 0.019}
+    parse_marks:
+      - {name: correct, lead: right_con, lag: response_r, window: [0, 1.0],
+         marker_on: lead, null_window: false}
+    keep: [fixation, right_con, correct]
+
+auto_invert uses check_analog_inverted (histogram) and the invert flag flips
+that result - same as the GUI.
+
+@author: jstout
+"""
+import copy
+import yaml
+import pandas as pd
+from multiprocessing import Pool
+from nih2mne.utilities.trigger_cache import TriggerCache
+from nih2mne.utilities.trigger_utilities import (append_conditions, parse_marks,
+                                                 correct_to_projector_asof,
+                                                 add_event_offset)
+
+_spec_version = 1
+_worker_plan = None  #Compiled plan in each pool worker
+_spec_keys = ['version', 'analog', 'digital', 'projector_correction', 'offset',
+              'parse_marks', 'keep']
+
+def load_rule_spec(fname):
+    '''Load and validate a yaml rule spec'''
+    with open(fname, 'r') as f:
+        spec = yaml.safe_load(f)
+    return validate_rule_spec(spec)
+
+def save_rule_spec(spec, fname):
+    '''Validate and write the rule spec to a yaml file'''
+    spec = validate_rule_spec(spec)
+    with open(fname, 'w') as f:
+        yaml.safe_dump(spec, f, sort_keys=False, default_flow_style=None)
+    return fname
+
+def validate_rule_spec(spec):
+    '''
+    Check the rule spec and fill in the default values
+
+    Parameters
+    ----------
+    spec : dict
+        Rule spec
+
+    Raises
+    ------
+    ValueError
+        Malformed spec
+
+    Returns
+    -------
+    spec : dict
+        Copy of the spec with defaults filled in
+
+    '''
+    if not isinstance(spec, dict):
+        raise ValueError('The rule spec must be a dictionary')
+    unknown = set(spec.keys()) - set(_spec_keys)
+    if len(unknown) > 0:
+        raise ValueError(f'Unknown rule spec entries: {sorted(unknown)}')
+    spec = copy.deepcopy(spec)
+    if spec.setdefault('version', _spec_version) != _spec_version:
+        raise ValueError(f'Rule spec version {spec["version"]} is not supported')
+
+    spec['analog'] = spec.get('analog') or []
+    for entry in spec['analog']:
+        if ('channel' not in entry) or ('name' not in entry):
+            raise ValueError(f'Analog rules require a channel and name: {entry}')
+        entry.setdefault('invert', False)
+        entry.setdefault('auto_invert', False)
+
+    spec['digital'] = spec.get('digital') or []
+    for entry in spec['digital']:
+        if 'channel' not in entry:
+            raise ValueError(f'Digital rules require a channel: {entry}')
+        entry['codes'] = {str(i):str(j) for i,j in (entry.get('codes') or {}).items()}
+
+    spec['parse_marks'] = spec.get('parse_marks') or []
+    for entry in spec['parse_marks']:
+        for key in ['name', 'lead', 'lag', 'window']:
+            if key not in entry:
+                raise ValueError(f'parse_marks rules require {key}: {entry}')
+        if len(entry['window']) != 2:
+            raise ValueError(f'parse_marks window must be [start, stop]: {entry}')
+        entry['window'] = [float(i) for i in entry['window']]
+        entry.setdefault('marker_on', 'lead')
+        entry.setdefault('null_window', False)
+        if entry['marker_on'] not in ['lead', 'lag']:
+            raise ValueError(f'marker_on must be lead or lag: {entry}')
+        if entry['null_window'] and (entry['marker_on'] == 'lag'):
+            raise ValueError(f'Null windows require marker_on lead: {entry}')
+
+    if spec.get('projector_correction'):
+        spec['projector_correction'].setdefault('projector', 'projector')
+        spec['projector_correction'].setdefault('max_latency', 0.2)
+        spec['projector_correction'].setdefault('events', [])
+        spec['projector_correction'].setdefault('direction', 'symmetric')
+        if spec['projector_correction']['direction'] not in ['symmetric', 'forward', 
+                                                             'backward', 'nearest']:
+            raise ValueError(f'Unknown projector_correction direction: {spec["projector_correction"]}')
+    if spec.get('offset'):
+        spec['offset'].setdefault('events', [])
+        spec['offset'].setdefault('seconds', 0.0)
+
+    if not spec.get('keep'):
+        raise ValueError('The rule spec requires a list of events to keep')
+    return spec
+
+# =============================================================================
+# Compile the spec to processing steps
+# =============================================================================
+def _analog_step(entry):
+    def step(trig, dframe_list):
+        invert = entry['invert']
+        if entry['auto_invert']:
+            invert = trig.check_analog_inverted(ch_name=entry['channel']) != invert
+        dframe_list.append(trig.threshold_detect(channel=entry['channel'],
+                                                 mark=entry['name'], invert=invert))
+    return step
+
+def _digital_step(entry):
+    def step(trig, dframe_list):
+        dig_dframe = trig.detect_digital(channel=entry['channel'])
+        dig_dframe['condition'] = dig_dframe.condition.replace(entry['codes'])
+        dframe_list.append(dig_dframe)
+    return step
+
+def _projector_step(entry):
+    def step(dframe):
+        return correct_to_projector_asof(dframe, projector_eventID=entry['projector'],
+                                         event_list=entry['events'],
+                                         max_latency=entry['max_latency'],
+                                         direction=entry['direction'])
+    return step
+
+def _offset_step(entry):
+    def step(dframe):
+        return add_event_offset(dframe, event_list=entry['events'],
+                                offset=entry['seconds'])
+    return step
+
+def _parse_step(entry):
+    def step(dframe):
+        dframe = parse_marks(dframe=dframe, lead_condition=entry['lead'],
+                             lag_condition=entry['lag'], window=entry['window'],
+                             marker_on=entry['marker_on'], marker_name=entry['name'],
+                             null_window=entry['null_window'], append_result=True)
+        return dframe.dropna()
+    return step
+
+def compile_rules(spec):
+    '''
+    Compile the rule spec into a processing plan
+
+    Parameters
+    ----------
+    spec : dict | str
+        Rule spec or yaml filename
+
+    Returns
+    -------
+    plan : dict
+        detect: list of detection steps  step(trig, dframe_list)
+        process: list of dataframe steps  step(dframe) -> dframe
+        keep: list of events to keep
+
+    '''
+    if isinstance(spec, dict):
+        spec = validate_rule_spec(spec)
+    else:
+        spec = load_rule_spec(spec)
+    detect = [_analog_step(i) for i in spec['analog']]
+    detect += [_digital_step(i) for i in spec['digital']]
+    process = []
+    if spec.get('projector_correction') and spec['projector_correction']['events']:
+        process.append(_projector_step(spec['projector_correction']))
+    if spec.get('offset') and spec['offset']['events'] and spec['offset']['seconds'] != 0:
+        process.append(_offset_step(spec['offset']))
+    process += [_parse_step(i) for i in spec['parse_marks']]
+    return {'detect':detect, 'process':process, 'keep':spec['keep'], 'spec':spec}
+
+def apply_rules(plan, meg_fname, use_cache=True):
+    '''
+    Apply the rules to a dataset
+
+    Parameters
+    ----------
+    plan : dict | str
+        Compiled plan (compile_rules), rule spec or yaml filename
+    meg_fname : str
+        CTF dataset
+    use_cache : bool, optional
+        Write the raw detections to the dataset trigger cache. The default is True.
+
+    Returns
+    -------
+    pd.DataFrame
+        Events to keep (trial, onset, condition, channel)
+
+    '''
+    if not isinstance(plan, dict) or ('detect' not in plan):
+        plan = compile_rules(plan)
+    trig = TriggerCache(meg_fname)
+    dframe_list = []
+    for step in plan['detect']:
+        step(trig, dframe_list)
+    if use_cache:
+        trig.save()
+    dframe = append_conditions(dframe_list)
+    for step in plan['process']:
+        dframe = step(dframe)
+    keep_list = [dframe[dframe.condition==i] for i in plan['keep']]
+    return append_conditions(keep_list)
+
+# =============================================================================
+# Multiple datasets
+# =============================================================================
+def _init_rules_worker(plan_spec):
+    global _worker_plan
+    _worker_plan = compile_rules(plan_spec)
+
+def _rules_worker(row_info):
+    '''Apply the rules to a single dataset.  Errors are returned so that the
+    remaining datasets continue processing'''
+    from nih2mne.utilities.markerfile import write_markerfile
+    idx, meg_fname, write_mrk = row_info
+    try:
+        dframe = apply_rules(_worker_plan, meg_fname)
+        if write_mrk:
+            write_markerfile(dframe=dframe, ds_filename=meg_fname)
+        counts = dframe.condition.value_counts().to_dict()
+        status, error = 'success', ''
+    except Exception as e:
+        counts, status, error = {}, 'failed', f'{type(e).__name__}: {str(e)}'
+    return idx, meg_fname, status, error, counts
+
+def process_datasets(spec, meg_fnames, n_workers=1, write_mrk=True):
+    '''
+    Apply the rule spec to a list of datasets in a pool of workers.  The spec
+    is compiled once per worker.
+
+    Parameters
+    ----------
+    spec : dict | str
+        Rule spec or yaml filename
+    meg_fnames : list
+        CTF datasets
+    n_workers : int, optional
+        Number of datasets to process concurrently. The default is 1.
+    write_mrk : bool, optional
+        Write the MarkerFile.mrk into each dataset (atomic replace). 
+        The default is True.
+
+    Returns
+    -------
+    results : list
+        (index, meg_fname, status, error, condition counts) for each dataset
+
+    '''
+    spec = validate_rule_spec(spec) if isinstance(spec, dict) else load_rule_spec(spec)
+    row_list = [(idx, str(i), write_mrk) for idx, i in enumerate(meg_fnames)]
+    if len(row_list) == 0:
+        return []
+    n_workers = max(1, min(int(n_workers), len(row_list)))
+    if n_workers == 1:
+        _init_rules_worker(spec)
+        return [_rules_worker(i) for i in row_list]
+    with Pool(processes=n_workers, initializer=_init_rules_worker,
+              initargs=(spec,)) as pool:
+        results = pool.map(_rules_worker, row_list, chunksize=1)
+    return results
@@ -13,6 +13,7 @@ import pyctf
 from pyctf.util import *
 import scipy
 import copy
+from nih2mne.utilities.ctf_reader import Meg4Reader
 
 
 '''
@@ -33,7 +34,35 @@ The correct response is calculated....
 '''
 
 
-def check_analog_inverted(fname=None, ch_name='UADC001'):
+def _open_ds(dsname):
+    '''Use a preloaded dataset (Meg4Reader / ChannelSubset) or open dsname'''
+    if isinstance(dsname, Meg4Reader):
+        return dsname
+    return Meg4Reader(dsname)
+
+def read_trigger_channels(dsname, patterns=('UADC', 'UPPT')):
+    '''
+    Read all of the trigger channels in one pass over the dataset.  The 
+    output can be passed in place of the filename to threshold_detect, 
+    detect_digital and check_analog_inverted.
+
+    Parameters
+    ----------
+    dsname : str
+        CTF dataset
+    patterns : tuple, optional
+        Channel name prefixes. The default is ('UADC', 'UPPT').
+
+    Returns
+    -------
+    ChannelSubset
+
+    '''
+    ds = _open_ds(dsname)
+    ch_names = [i for i in ds.ch_names if i.startswith(patterns)]
+    return ds.read_channels(ch_names)
+
+def check_analog_inverted(fname=None, ch_name='UADC001', chunk_size=None):
     '''Checks to determine if the analog channel has been inverted.
     
     Histogram is performed.  The two histogram bins with the most counts will be 
@@ -42,16 +71,20 @@ def check_analog_inverted(fname=None, ch_name='UADC001'):
     than the counts for the high voltage.
     
     Usage:
-        fname: Filename
+        fname: Filename (or preloaded channels - see read_trigger_channels)
         ch_name: Analog channel name default is UADC001
         print_output: If vizualization needed this will graph using matplolib (True/False)
+        chunk_size: Read the channel in chunks of samples and accumulate the 
+            histogram bins (constant memory).  Default None reads the full trial
         
     '''
-    df_var=pyctf.dsopen(fname)
+    df_var=_open_ds(fname)
     ADC_idx=df_var.getChannelIndex(ch_name)
-    dat = df_var.getDsData(0, ADC_idx)
-    
-    bin_counts, bin_volts =np.histogram(dat)
+    if chunk_size is not None:
+        bin_counts, bin_volts = _streaming_histogram(df_var, 0, ADC_idx, chunk_size)
+    else:
+        dat = df_var.getDsData(0, ADC_idx)
+        bin_counts, bin_volts =np.histogram(dat)
     
     #Determine the two highest counts
     #By default off_idx should have a greater count than on_idx
@@ -62,6 +95,27 @@ def check_analog_inverted(fname=None, ch_name='UADC001'):
     else:
         return False
 
+def _iter_chunks(ds, trial, ch, chunk_size):
+    '''(first sample, data) of a trial in chunks of chunk_size samples'''
+    nsamp = ds.getNumberOfSamples()
+    for c0 in range(0, nsamp, chunk_size):
+        yield c0, ds[trial, ch, c0:min(c0 + chunk_size, nsamp)]
+
+def _streaming_histogram(ds, trial, ch, chunk_size, bins=10):
+    '''np.histogram(data - data.mean()) accumulated over chunks (2 passes)'''
+    d_min, d_max, d_sum, n = np.inf, -np.inf, 0., 0
+    for c0, chunk in _iter_chunks(ds, trial, ch, chunk_size):
+        d_min, d_max = min(d_min, chunk.min()), max(d_max, chunk.max())
+        d_sum += chunk.sum()
+        n += len(chunk)
+    mean = d_sum / n
+    hist_range = (d_min - mean, d_max - mean)
+    bin_counts = np.zeros(bins, dtype=int)
+    for c0, chunk in _iter_chunks(ds, trial, ch, chunk_size):
+        bin_counts += np.histogram(chunk - mean, bins=bins, range=hist_range)[0]
+    bin_volts = np.linspace(hist_range[0], hist_range[1], bins + 1)
+    return bin_counts, bin_volts
+
 ############## Code from Tom Holroyd's threshold detect command from pyctf    
 def round(x):
     return int(floor(x + .5))
@@ -92,12 +146,64 @@ def butter_bandpass(data, lowcut, highcut, fs, order=5):
     y = lfilter(b, a, data)
     return y
 
+def butter_bandpass_coefs(lowcut, highcut, fs, order=5):
+    '''(b, a) coefficients of the butter_bandpass filter'''
+    nyq = 0.5 * fs
+    return butter(order, [lowcut / nyq, highcut / nyq], btype='band')
+
+def _threshold_onsets(x, d, ampThresh, derivThresh, start, stop, deadSamp):
+    '''
+    Samples in [start, stop) where x > ampThresh and d > derivThresh.  After
+    each onset the next deadSamp samples are skipped.
+    
+    The candidate samples are found in one pass and the dead time is applied
+    greedily with searchsorted (one step per detected onset).
+    '''
+    stop = min(stop, len(d))
+    if stop <= start:
+        return np.array([], dtype=int)
+    cand = np.flatnonzero((x[start:stop] > ampThresh) & (d[start:stop] > derivThresh)) 
+    cand += start
+    step = max(deadSamp + 1, 1)
+    onsets = []
+    idx = 0
+    while idx < len(cand):
+        onsets.append(cand[idx])
+        idx = np.searchsorted(cand, cand[idx] + step, side='left')
+    return np.array(onsets, dtype=int)
+
 def threshold_detect(dsname=None, channel=None, mark=None, mark_color=None,
                    invert=False, ampThresh=.5, derivThresh=.1, trial=None, 
-                   lo=None, hi=None, deadTime=.1, t0=None, t1=None):
+                   lo=None, hi=None, deadTime=.1, t0=None, t1=None, chunk_size=None):
     '''Tom Holroyd's code from threshold_detect.py. This is a functionalized version
-    of the code from pyctf'''
-    ds = pyctf.dsopen(dsname)
+    of the code from pyctf
+    
+    chunk_size: process each trial in chunks of samples in constant memory 
+        (see threshold_detect_chunked)'''
+    ds = _open_ds(dsname)
+    srate = ds.getSampleRate()
+    marklist = threshold_detect_samples(ds, channel=channel, invert=invert, 
+                                        ampThresh=ampThresh, derivThresh=derivThresh,
+                                        trial=trial, lo=lo, hi=hi, 
+                                        deadTime=deadTime, t0=t0, t1=t1, 
+                                        chunk_size=chunk_size)
+    marklist = [(tr, i / srate) for tr, i in marklist]
+    output = pd.DataFrame(marklist, columns=['trial', 'onset'])
+    output['condition'] = mark
+    output['channel'] = channel
+    return output
+    #return marklist
+
+def threshold_detect_samples(dsname=None, channel=None, invert=False, ampThresh=.5, 
+                             derivThresh=.1, trial=None, lo=None, hi=None, 
+                             deadTime=.1, t0=None, t1=None, chunk_size=None):
+    '''threshold_detect returning a list of (trial, onset sample)'''
+    ds = _open_ds(dsname)
+    if (chunk_size is not None) and (t0 is None):
+        return threshold_detect_chunked(ds, channel=channel, invert=invert, 
+                                        ampThresh=ampThresh, derivThresh=derivThresh,
+                                        trial=trial, lo=lo, hi=hi, deadTime=deadTime,
+                                        chunk_size=chunk_size)
     
     srate = ds.getSampleRate()
     ntrials = ds.getNumberOfTrials()
@@ -115,7 +221,7 @@ def threshold_detect(dsname=None, channel=None, mark=None, mark_color=None,
     #     except RuntimeError:
     #         filt = pyctf.mkfft(lo, hi, srate, nsamp)
     
-    # output mark list, trial and time
+    # output mark list, trial and sample
     marklist = []
     
     # list of trials to process
@@ -129,7 +235,7 @@ def threshold_detect(dsname=None, channel=None, mark=None, mark_color=None,
         if t0 is not None:
             x = x[t0 : t1 + 1]  # data to use when scaling
         if lo is not None:
-            x =  butter_bandpass(x, lo, hi, srate, order=6) #pyctf.dofilt(x, filt)
+            x = butter_bandpass(x, lo, hi, srate, order=6) #pyctf.dofilt(x, filt)
         if invert:
             x = -x
         d = dydx(x)
@@ -142,7 +248,6 @@ def threshold_detect(dsname=None, channel=None, mark=None, mark_color=None,
     
         if derivThresh < 0.:
             d = -d
-            derivThresh = -derivThresh
         if t0 is None:
             s = 1
             e = nsamp - 1
@@ -152,16 +257,94 @@ def threshold_detect(dsname=None, channel=None, mark=None, mark_color=None,
             x = y
             s = t0 + 1
             e = t1 - 1
-        while s < e:
-            if x[s] > ampThresh and d[s] > derivThresh:
-                marklist.append((tr, s / srate))
-                s += deadSamp
-            s += 1
-    output = pd.DataFrame(marklist, columns=['trial', 'onset'])
-    output['condition'] = mark
-    output['channel'] = channel
-    return output
-    #return marklist
+        onsets = _threshold_onsets(x, d, ampThresh, abs(derivThresh), s, e, 
+                                   deadSamp)
+        marklist.extend((tr, int(i)) for i in onsets)
+    return marklist
+
+def _iter_transformed(ds, trial, ch, chunk_size, ba=None, invert=False):
+    '''
+    Filtered/inverted data of a trial in chunks.  The filter state is carried
+    between the chunks (lfilter zi).  Yields (i0, x, d) with x the data for 
+    samples i0 .. i0+len(d) and d the first difference at samples 
+    i0 .. i0+len(d)-1.  The last sample of the previous chunk is prepended,
+    so each first difference is returned in exactly one chunk.
+    '''
+    zi = None if ba is None else np.zeros(max(len(ba[0]), len(ba[1])) - 1)
+    prev = None
+    for c0, x in _iter_chunks(ds, trial, ch, chunk_size):
+        if ba is not None:
+            x, zi = lfilter(ba[0], ba[1], x, zi=zi)
+        if invert:
+            x = -x
+        i0 = c0
+        if prev is not None:
+            x = np.concatenate([prev, x])
+            i0 = c0 - 1
+        prev = x[-1:]
+        yield i0, x, dydx(x)
+
+def threshold_detect_chunked(dsname=None, channel=None, invert=False, ampThresh=.5, 
+                             derivThresh=.1, trial=None, lo=None, hi=None, 
+                             deadTime=.1, chunk_size=600000):
+    '''
+    Memory bounded threshold_detect_samples for long continuous recordings.
+    
+    Each trial is read twice in chunks of chunk_size samples.  The first pass 
+    accumulates the min/max of the data and derivative that are used for 
+    scaling, the second pass finds the onsets.  The dead time is carried
+    across chunk boundaries so each onset is found once.
+    
+    The onsets are identical to the in memory version.  The bandpass filter 
+    state (lfilter zi) is carried between the chunks.
+
+    Parameters
+    ----------
+    chunk_size : int
+        Number of samples per read. The default is 600000.
+    Other parameters are the same as threshold_detect
+
+    Returns
+    -------
+    marklist : list
+        (trial, onset sample)
+
+    '''
+    ds = _open_ds(dsname)
+    srate = ds.getSampleRate()
+    ntrials = ds.getNumberOfTrials()
+    nsamp = ds.getNumberOfSamples()
+    ch = ds.channel[channel]
+    deadSamp = round(deadTime * srate) - 1
+    step = max(deadSamp + 1, 1)
+    ba = None if lo is None else butter_bandpass_coefs(lo, hi, srate, order=6)
+    chunk_size = max(int(chunk_size), 2)
+    
+    marklist = []
+    trl = range(ntrials) if trial is None else [trial]
+    for tr in trl:
+        # Pass 1: Scaling values
+        x_min, x_max, d_min, d_max = np.inf, -np.inf, np.inf, -np.inf
+        for i0, x, d in _iter_transformed(ds, tr, ch, chunk_size, ba, invert):
+            x_min, x_max = min(x_min, x.min()), max(x_max, x.max())
+            if len(d) > 0:
+                d_min, d_max = min(d_min, d.min()), max(d_max, d.max())
+        
+        # Pass 2: Onsets in samples 1 .. nsamp-1 (same as threshold_detect)
+        next_allowed = 1
+        for i0, x, d in _iter_transformed(ds, tr, ch, chunk_size, ba, invert):
+            x = (x[:len(d)] - x_min) / (x_max - x_min)
+            d = np.where(d >= 0., d / d_max, d / -(d_min))
+            if derivThresh < 0.:
+                d = -d
+            start = max(next_allowed - i0, 0)
+            stop = min(nsamp - 1 - i0, len(d))
+            onsets = _threshold_onsets(x, d, ampThresh, abs(derivThresh), start, 
+                                       stop, deadSamp) + i0
+            if len(onsets) > 0:
+                next_allowed = onsets[-1] + step
+            marklist.extend((tr, int(i)) for i in onsets)
+    return marklist
 
 ########### End of threshold detect
 
@@ -176,11 +359,18 @@ def return_edge_timing(ppt_vector, positive_edge=True):
         tmp[tmp>=0]=0
     return tmp
 
+def _samples_to_times(ds, samples):
+    '''Sample index (within trial) to time using the res4 preTrig and sfreq'''
+    samples = np.asarray(samples)
+    if hasattr(ds, 'pretrig') and hasattr(ds, 'sfreq'):
+        return (samples - ds.pretrig) / ds.sfreq
+    return np.array([ds.getTimePt(i) for i in samples], dtype=float)
+
 def samples_to_trig_timing(ds,digital_vector):
     '''Return the times and values of the of parrallel port positive transitions'''
-    sample_idx=np.argwhere(digital_vector>0)
-    values=digital_vector[digital_vector>0]
-    times=[ds.getTimePt(i) for i in sample_idx]
+    sample_idx=np.flatnonzero(digital_vector>0)
+    values=digital_vector[sample_idx]
+    times=_samples_to_times(ds, sample_idx)
     return np.array([times, values]).T
 
 def return_ch_pattern(ds, pattern):
@@ -191,19 +381,64 @@ def return_ch_pattern(ds, pattern):
     pattern_ch_idx = [ds.channel[i] for i in pattern_ch_names] 
     return  pattern_ch_names, pattern_ch_idx
 
+def decode_digital(filename, channels=None, trials=None):
+    '''
+    Decode the positive going parallel port transitions for all trials and 
+    channels at once.  The selected channels are read as a single 
+    (trial, channel, sample) array and all of the value changes are found with
+    one np.diff.  Sample indices are converted to time with the res4 preTrig
+    and sample rate.
+
+    Parameters
+    ----------
+    filename : str | Meg4Reader
+        CTF dataset or preloaded trigger channels (read_trigger_channels)
+    channels : list | str, optional
+        Digital channels. The default is None (all UPPT channels).
+    trials : list | int, optional
+        Trials to decode. The default is None (all trials).
+
+    Returns
+    -------
+    pd.DataFrame
+        trial, onset, condition, channel sorted by trial and onset.  The 
+        condition is the value of the positive transition (same as 
+        detect_digital)
+
+    '''
+    ds=_open_ds(filename)
+    if channels is None:
+        channels = [i for i in ds.ch_names if 'UPPT' in i]
+    elif isinstance(channels, str):
+        channels = [channels]
+    trials = np.arange(ds.n_trials) if trials is None else np.atleast_1d(trials)
+    columns = ['trial', 'onset', 'condition', 'channel']
+    if len(channels) == 0:
+        return pd.DataFrame(columns=columns)
+    
+    data = ds[trials, ds.pick(channels), :]  # (trial, channel, sample)
+    edges = np.diff(data, axis=-1)
+    trial_idx, ch_idx, samp_idx = np.nonzero(edges > 0)
+    order = np.lexsort((ch_idx, samp_idx, trial_idx))
+    trial_idx, ch_idx, samp_idx = trial_idx[order], ch_idx[order], samp_idx[order]
+    values = edges[trial_idx, ch_idx, samp_idx]
+    samp_idx += 1  #diff[k] is the transition into sample k+1
+    
+    dframe = pd.DataFrame({'trial':trials[trial_idx],
+                           'onset':_samples_to_times(ds, samp_idx),
+                           'condition':values.astype(int).astype(str),
+                           'channel':np.array(channels, dtype=object)[ch_idx]})
+    return dframe[columns]
+
 def detect_digital(filename, channel='UPPT001', trial=0):
     if 'PPT' not in channel:
         print('''WARNING: This channel is likely not a digitial parrallel port.
               Use threshold detect instead''')
-    ds=pyctf.dsopen(filename)
-    idx = return_ch_pattern(ds, channel)[1][0]
-    tmp=ds.getDsRawData(trial, idx)
-    tmp=return_edge_timing(tmp)
-    tmp=samples_to_trig_timing(ds, tmp)
-    tmp_dframe=pd.DataFrame(tmp, columns=['onset', 'condition'])
+    ds=_open_ds(filename)
+    ch_name = return_ch_pattern(ds, channel)[0][0]
+    tmp_dframe = decode_digital(ds, channels=[ch_name], trials=trial)
     tmp_dframe['channel'] = channel
     tmp_dframe['trial']=trial
-    tmp_dframe['condition'] = tmp_dframe['condition'].astype(int).astype(str)
     return tmp_dframe[['trial', 'onset', 'condition', 'channel']]    
 
 ######  End digital channel processing
@@ -234,6 +469,34 @@ def get_window_value(onset=None, window=None, lag_time_vector=[], time_on='lag',
     elif time_on.lower() == 'lead':
         return onset
 
+def _is_sorted(vals):
+    return bool(np.all(vals[1:] >= vals[:-1]))
+
+def get_window_values(onsets=None, window=None, lag_time_vector=[], time_on='lag',
+                      negate=False):
+    '''
+    Vectorized get_window_value for an array of onsets.  The lag_time_vector 
+    must be sorted.  The window bounds are searched with np.searchsorted, 
+    so the cost is O(N log M) instead of a scan of the lag events per onset.
+    
+    Returns a float array with nan where the window condition is not met
+    '''
+    if negate and (time_on=='lag'):
+        raise ValueError('Can only perform null windows if time_on is lead')
+    onsets = np.asarray(onsets, dtype=float)
+    lag_time_vector = np.asarray(lag_time_vector, dtype=float)
+    #Strict inequalities: onset + window[0] < lag < onset + window[1]
+    left = np.searchsorted(lag_time_vector, onsets + window[0], side='right')
+    right = np.searchsorted(lag_time_vector, onsets + window[1], side='left')
+    in_window = right > left
+    if negate == True:
+        return np.where(in_window, np.nan, onsets)
+    if time_on.lower() == 'lag':
+        first_lag = lag_time_vector[np.minimum(left, len(lag_time_vector)-1)] \
+            if len(lag_time_vector) > 0 else np.full(len(onsets), np.nan)
+        return np.where(in_window, first_lag, np.nan)
+    return np.where(in_window, onsets, np.nan)
+
 def parse_marks(dframe=None, lead_condition=None, lag_condition=None, window=[0,0.5],
                 marker_on='lead', marker_name=None, append_result=True, trial=0,
                 null_window=False):
@@ -254,10 +517,16 @@ def parse_marks(dframe=None, lead_condition=None, lag_condition=None, window=[0,
     lag_idxs = dframe[dframe.condition == lag_condition].index
 
     lag_time_vector = dframe.loc[lag_idxs].onset.values
-    new_onsets=dframe.loc[lead_idxs]['onset'].apply(get_window_value,window=window, 
-                                         lag_time_vector=lag_time_vector, 
-                                         time_on=marker_on, negate=null_window) 
-    new_condition = pd.DataFrame(new_onsets.values, columns=['onset'])
+    lead_onsets = dframe.loc[lead_idxs]['onset']
+    if (marker_on.lower() in ['lead', 'lag']) and _is_sorted(lag_time_vector):
+        new_onsets = get_window_values(lead_onsets.values, window=window, 
+                                       lag_time_vector=lag_time_vector, 
+                                       time_on=marker_on, negate=null_window)
+    else:
+        new_onsets=lead_onsets.apply(get_window_value,window=window, 
+                                     lag_time_vector=lag_time_vector, 
+                                     time_on=marker_on, negate=null_window).values
+    new_condition = pd.DataFrame(new_onsets, columns=['onset'])
     if marker_on=='lead':
         new_condition['channel']='*'+lead_condition+'>'+lag_condition
     else:
@@ -359,6 +628,118 @@ def correct_to_projector(dframe, projector_eventID='projector', event_list=[],
     
     return out_dframe     
 
+def correct_to_projector_asof(dframe, projector_eventID='projector', event_list=[],
+                              max_latency=0.2, direction='symmetric', 
+                              return_stats=False):
+    '''
+    Batched version of correct_to_projector.  The projector onsets are matched
+    to the listed events with one sorted search per event type (symmetric) or 
+    a single pd.merge_asof (forward/backward/nearest), instead of a 
+    parse_marks call and dataframe query per event type.
+    
+    direction='symmetric' (default) gives the same output as 
+    correct_to_projector(window=[-max_latency, max_latency]): an event is 
+    written at every projector onset that has the event within +/-max_latency.
+    The other directions move every event to a single projector onset within
+    max_latency (forward: subsequent projector, backward: preceding projector,
+    nearest: either) and events without a projector are dropped.  These are 
+    not identical to correct_to_projector - the counts and timing can change.
+
+    Parameters
+    ----------
+    dframe : pd.DataFrame
+        Dataframe.
+    projector_eventID : str
+        Event ID in dataframe for projector. The default is 'projector'.
+    event_list : list
+        Events to correct to projector timing. The default is [].
+    max_latency : float
+        Maximum event to projector latency in seconds. The default is 0.2.
+    direction : str
+        'symmetric', 'forward', 'backward' or 'nearest'.  The default is 
+        'symmetric'.
+    return_stats : bool
+        Also return the per condition latency dataframe. The default is False.
+
+    Returns
+    -------
+    out_dframe : pd.DataFrame
+        Corrected dataframe
+    stats : pd.DataFrame
+        Only if return_stats. Per condition count/corrected/dropped, the 
+        surplus projector events (symmetric) and latency mean/std/max in ms
+
+    '''
+    if direction not in ['symmetric', 'forward', 'backward', 'nearest']:
+        raise ValueError(f'direction must be symmetric, forward, backward or nearest: {direction}')
+    event_list = [i for i in event_list if i != projector_eventID]
+    is_evt = dframe.condition.isin(event_list)
+    evts = dframe[is_evt & dframe.onset.notna()].sort_values('onset', kind='stable')
+    proj = dframe.loc[dframe.condition == projector_eventID, ['onset']].dropna()
+    proj = proj.sort_values('onset')
+    proj['proj_onset'] = proj.onset
+    
+    if direction == 'symmetric':
+        # Projector centred window as in parse_marks(marker_on='lead')
+        proj_onsets = proj.onset.values
+        matched_list = []
+        for evt_name in event_list:
+            evt_onsets = evts.onset.values[evts.condition.values == evt_name]
+            first_evt = get_window_values(proj_onsets, window=[-max_latency, max_latency],
+                                          lag_time_vector=evt_onsets, time_on='lag')
+            keep = ~np.isnan(first_evt)
+            matched_list.append(pd.DataFrame({'onset': proj_onsets[keep],
+                                              'channel': '*'+projector_eventID+'>'+evt_name,
+                                              'condition': evt_name, 
+                                              'trial': 0,
+                                              'evt_onset': first_evt[keep]}))
+        # Same concatenation/sort order as correct_to_projector
+        matched = append_conditions(matched_list) if matched_list else \
+            pd.DataFrame(columns=['onset', 'channel', 'condition', 'trial', 'evt_onset'])
+        out_dframe = matched.drop(columns='evt_onset')
+        matched = matched.rename(columns={'onset':'proj_onset', 'evt_onset':'onset'})
+    else:
+        matched = pd.merge_asof(evts.reset_index(drop=True), proj.reset_index(drop=True), 
+                                on='onset', direction=direction, tolerance=max_latency)
+        matched = matched.dropna(subset=['proj_onset'])
+        out_dframe = pd.DataFrame({'onset': matched.proj_onset.values,
+                                   'channel': '*'+projector_eventID+'>'+matched.condition.values,
+                                   'condition': matched.condition.values,
+                                   'trial': matched.trial.values})
+    matched['latency'] = (matched.proj_onset - matched.onset) * 1000
+    
+    # Per condition QA of the correction
+    # corrected: distinct input events that were matched.  In symmetric mode 
+    # an event can be written at more than one projector (surplus)
+    latency = matched.groupby('condition', sort=False).latency
+    n_matched = matched.drop_duplicates(subset=['condition', 'onset']).condition
+    stats = pd.DataFrame({'count': evts.condition.value_counts()})
+    stats['corrected'] = n_matched.value_counts()
+    stats['corrected'] = stats['corrected'].fillna(0).astype(int)
+    stats['surplus'] = latency.size() - stats['corrected']
+    stats['surplus'] = stats['surplus'].fillna(0).astype(int)
+    stats['mean'] = latency.mean()
+    stats['std'] = latency.std(ddof=0)
+    stats['max'] = latency.max()
+    stats['dropped'] = stats['count'] - stats['corrected']
+    stats = stats.reindex([i for i in event_list if i in stats.index]).round(2)
+    for evt_name, row in stats.iterrows():
+        if row.dropped != 0:
+            print('warning:')
+            print(f'{evt_name} - IN={int(row["count"])} != OUT={int(row.corrected)}')
+            print('It is possible that you may have selected a response channel to correct to projector')
+        if row.surplus != 0:
+            print(f'warning: {evt_name} - {int(row.surplus)} surplus projector events (an event within max_latency of several projectors)')
+    print('Projector latency (ms):')
+    print(stats[['count', 'dropped', 'surplus', 'mean', 'std', 'max']].to_string())
+    
+    # Add the conditions that were not in the event list back into new dataframe
+    unaffected_conditions = dframe[~is_evt]
+    out_dframe = append_conditions([out_dframe, unaffected_conditions])
+    if return_stats:
+        return out_dframe, stats
+    return out_dframe
+
 def add_event_offset(dframe, event_list=[], offset=0.0):
     '''
     Add a static offset to events in the event list
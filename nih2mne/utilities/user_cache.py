@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per user cache folders (emptyroom cache, trigger cache, bids index).
+
+The folder is resolved when it is used, so importing the modules does not
+require a user lookup (e.g. containers or batch jobs without a passwd entry).
+
+@author: jstout
+"""
+import os, os.path as op
+import getpass
+import tempfile
+
+def _get_username():
+    '''Login name - falls back to the uid if the user cannot be looked up'''
+    try:
+        return getpass.getuser()
+    except (KeyError, OSError, ImportError):
+        if hasattr(os, 'getuid'):
+            return str(os.getuid())
+        return 'user'
+
+def get_user_cache_dir(name, env_var=None):
+    '''
+    Cache folder for the current user: <tmpdir>/nih2mne_<name>_<user>
+
+    Parameters
+    ----------
+    name : str
+        Cache name
+    env_var : str, optional
+        Environment variable to override the folder. The default is None.
+
+    Returns
+    -------
+    cache_dir : str
+        The folder is not created
+
+    '''
+    if (env_var is not None) and (env_var in os.environ):
+        return os.environ[env_var]
+    return op.join(tempfile.gettempdir(), f'nih2mne_{name}_{_get_username()}')